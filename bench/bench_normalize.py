@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" bench_normalize.py
+Author: coman8@uw.edu
+
+Per-line throughput of the reference normalization in preprocess_ref.
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import preprocess_ref
+
+
+class Main:
+
+	def __init__(self, args):
+		preprocess_ref.args = args
+		prefix = preprocess_ref.get_prefix(args.datatype)
+		DIGIT = re.compile(r"\d")
+
+		# load transcription lines
+		lines = list()
+		for file in sorted(os.listdir(args.indir)):
+			if file.startswith(prefix):
+				with open(os.path.join(args.indir, file), 'r') as infile:
+					lines.extend((file[3:7], l) for l in infile if DIGIT.match(l[0]))
+		print('Loaded {} lines'.format(len(lines)))
+
+		best = None
+		for _ in range(args.repeat):
+			start = time.perf_counter()
+			for waveid, line in lines:
+				preprocess_ref.Trans(waveid, line, args.datatype)
+			elapsed = time.perf_counter() - start
+			best = elapsed if best is None else min(best, elapsed)
+
+		print('Best of {}: {:.3f}s'.format(args.repeat, best))
+		print('{:.0f} lines/s, {:.2f} us/line'.format(len(lines) / best, 1e6 * best / max(len(lines), 1)))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark reference normalization.")
+	parser.add_argument("indir", type=str, help="Directory with transcripts.")
+	parser.add_argument("datatype", type=str, help="Transcript type. Expecting one of: SWBD, CH")
+	parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs.")
+	parser.add_argument("--cont", action="store_true", help="Benchmark with contraction forms.")
+	parser.add_argument("--disf", action="store_true", help="Benchmark with grouped disfluencies.")
+	args = parser.parse_args()
+	Main(args)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" bench_sgml.py
+Author: coman8@uw.edu
+
+Compares the streaming sgml reader in get_utterance_table against the
+BeautifulSoup parse it replaced, and checks that both give the same rows.
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import get_utterance_table
+
+
+def soup_rows(infile):
+	"""The BeautifulSoup path, as get_utterance_table used to parse."""
+	from bs4 import BeautifulSoup
+	soup = BeautifulSoup(infile.read(), 'html.parser')
+	results = dict()
+	for sp in soup('speaker'):
+		speakerid = sp['id']
+		for x in sp('path'):
+			temp = [speakerid]
+			d = x.attrs
+			results_key = d.pop('id')
+			temp.extend(d.values())
+			result = re.sub(r"\n(.*)\n", r"\1", x.contents[0])
+			temp.append([i.strip("\"") for i in result.split(',')])
+			results[results_key] = temp
+	return results
+
+
+def reader_rows(infile):
+	results = dict()
+	for speakerid, d, utterance in get_utterance_table.SgmlReader(infile):
+		results_key = d.pop('id')
+		results[results_key] = [speakerid] + list(d.values()) + [utterance]
+	return results
+
+
+def measure(func, path):
+	tracemalloc.start()
+	start = time.perf_counter()
+	with open(path, 'r') as infile:
+		rows = func(infile)
+	elapsed = time.perf_counter() - start
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return rows, elapsed, peak
+
+
+class Main:
+
+	def __init__(self, args):
+		for file in sorted(os.listdir(args.projdir)):
+			if file.endswith('sgml'):
+				path = os.path.join(args.projdir, file)
+				print('File: {}'.format(file))
+				soup, soup_time, soup_peak = measure(soup_rows, path)
+				reader, reader_time, reader_peak = measure(reader_rows, path)
+				print('  BeautifulSoup: {:.3f}s, peak {:.1f} MB'.format(soup_time, soup_peak / 2**20))
+				print('  SgmlReader:    {:.3f}s, peak {:.1f} MB'.format(reader_time, reader_peak / 2**20))
+				print('  {} paths, identical: {}'.format(len(reader), soup == reader))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark sclite sgml parsing.")
+	parser.add_argument("projdir", type=str, help="Directory with sgml files.")
+	args = parser.parse_args()
+	Main(args)
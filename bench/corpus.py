@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" corpus.py
+Author: coman8@uw.edu
+
+Generates a synthetic corpus in the formats of every pipeline stage, at a
+multiple of the size of the NIST 2000 (HUB5) evaluation set:
+
+- refs/    NIST style reference transcripts (sw_*.txt, en_*.txt), with
+           contraction labels, fragments, guesses, asides and noise tags
+- hyps/    MSFT style CTMs, one human and one machine system per datatype
+- data/    sclite sgml of each system
+- data/models/  .all model tables of each system, as written by gather.sh
+
+At scale 1 there are 40 conversations per datatype, with about 55 segments
+per conversation side and 10 words per segment. The same seed always gives
+the same corpus, so results can be compared across commits.
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+
+CONVERSATIONS = 40
+SEGMENTS = 55
+WORDS = 10
+SYSTEMS = [('SWBD', 'sw_', 'swb'), ('CH', 'en_', 'callhome')]
+
+COMMON = ["i", "you", "the", "a", "and", "to", "that", "it", "of", "yeah", "know", "like",
+		  "so", "we", "they", "in", "but", "was", "just", "is", "have", "well", "not", "do",
+		  "oh", "what", "think", "right", "all", "for", "then", "on", "this", "there", "with",
+		  "really", "be", "one", "he", "mean", "get", "people", "go", "about", "out", "kids",
+		  "good", "lot", "years", "time", "little", "some", "work", "house", "school", "day",
+		  "care", "every", "more", "any", "into", "okay", "sure", "pretty", "much", "thing"]
+HESITATIONS = ["uh", "um", "hm", "hmm", "mm", "ah", "huh", "eh"]
+BACKCHANNELS = ["uh-huh", "um-hum", "mhm"]
+REDUCED = ["gonna", "wanna", "kinda", "sorta", "gotta"]
+CONTRACTIONS = {"don't": ("do", "not"), "it's": ("it", "is"), "i'm": ("i", "am"),
+				"that's": ("that", "is"), "can't": ("can", "not"), "you're": ("you", "are")}
+FRAGMENTS = ["th-", "s-", "w-", "i-", "uh-", "a-"]
+NOISES = ["[laughter]", "[noise]", "[vocalized-noise]", "{lipsmack}", "{breath}"]
+TAGS = ["NN", "VB", "UH", "DT", "PRP", "IN", "JJ", "RB"]
+SUBSTITUTIONS = COMMON[:20] + HESITATIONS[:3]
+MACHINE_ERRORS = (0.04, 0.06, 0.02)
+
+
+def pick_word(r):
+	"""A reference word, with the frequent HUB5 phenomena."""
+	x = r.random()
+	if x < 0.06:
+		return r.choice(HESITATIONS)
+	if x < 0.09:
+		return r.choice(BACKCHANNELS)
+	if x < 0.11:
+		return r.choice(REDUCED)
+	if x < 0.16:
+		return r.choice(list(CONTRACTIONS))
+	if x < 0.18:
+		return r.choice(FRAGMENTS)
+	return r.choice(COMMON)
+
+
+def ref_token(r, w):
+	"""Writes a reference word with the NIST transcription labels."""
+	if w in CONTRACTIONS:
+		full = CONTRACTIONS[w]
+		return '<contraction e_form="[{0}=>{1}][{0}=>{2}]">{0}'.format(w, *full)
+	x = r.random()
+	if x < 0.02 and len(w) > 2:
+		return '{}[{}]'.format(w[:-1], w[-1])  # partial guess, e.g. kno[w]
+	if x < 0.03:
+		return w.capitalize()
+	return w
+
+
+def segment(r, nwords, errors=(0.06, 0.08, 0.03)):
+	"""A reference segment with the alignment of a hypothesis to it.
+
+	errors are the deletion, substitution and insertion rates. Returns the
+	reference words and a list of (eval, ref word, hyp word).
+	"""
+	return align_words(r, [pick_word(r) for _ in range(nwords)], errors)
+
+
+def align_words(r, words, errors):
+	deletion, substitution, insertion = errors
+	alignment = list()
+	for w in words:
+		x = r.random()
+		if x < deletion:
+			alignment.append(('D', w, None))
+		elif x < deletion + substitution:
+			alignment.append(('S', w, r.choice(SUBSTITUTIONS)))
+		else:
+			# transcribers complete the fragments, which are still correct
+			alignment.append(('C', w, w.rstrip('-')))
+		if r.random() < insertion:
+			alignment.append(('I', None, r.choice(SUBSTITUTIONS)))
+	return words, alignment
+
+
+def conversation(r, prefix, convid, segments):
+	"""Segments of both sides of a conversation, in time order."""
+	result = list()
+	t = 0.0
+	for _ in range(2 * segments):
+		nwords = max(0, int(r.gauss(WORDS, 4)))
+		begin = t + r.uniform(0.1, 1.0)
+		end = begin + max(0.5, 0.3 * nwords + r.uniform(0, 1))
+		t = end
+		words, alignment = segment(r, nwords)
+		result.append((prefix + str(convid), r.choice('AB'), begin, end, words, alignment))
+	return result
+
+
+def write_ref(out, r, segs):
+	out.write("# synthetic transcript\n\n")
+	for waveform, channel, begin, end, words, _ in segs:
+		tokens = [ref_token(r, w) for w in words]
+		x = r.random()
+		if x < 0.1:
+			tokens.insert(r.randint(0, len(tokens)), r.choice(NOISES))
+		elif x < 0.12:
+			tokens = ['<b_aside>'] + tokens + ['<e_aside>']
+		elif x < 0.14:
+			tokens.append('--')
+		label = 'B1' if channel == 'B' and r.random() < 0.02 else channel
+		out.write("{:.2f} {:.2f} {}: {}\n".format(begin, end, label, ' '.join(tokens)))
+
+
+def hyp_times(begin, end, alignment):
+	"""Spreads the hypothesis words of a segment over its duration."""
+	hyps = [h for _, _, h in alignment if h is not None]
+	step = (end - begin) / max(len(hyps), 1)
+	return [(begin + i * step, 0.8 * step, h) for i, h in enumerate(hyps)]
+
+
+def write_ctm(out, segs, machine):
+	for waveform, channel, begin, end, _, alignment in segs:
+		for start, dur, h in hyp_times(begin, end, alignment):
+			if not machine and h == 'uh-huh':
+				# human transcribers split backchannels over two tokens
+				out.write("{} {} {:.3f} {:.3f} uh\n".format(waveform, channel, start, dur / 2))
+				out.write("{} {} {:.3f} {:.3f} huh\n".format(waveform, channel, start + dur / 2, dur / 2))
+				continue
+			out.write("{} {} {:.3f} {:.3f} {}\n".format(waveform, channel, start, dur, h))
+
+
+def sgml_entries(begin, end, alignment):
+	"""The sclite path entries of a segment, with ref and hyp times."""
+	step = (end - begin) / max(len(alignment), 1)
+	entries = list()
+	for i, (e, ref, hyp) in enumerate(alignment):
+		t = begin + i * step
+		times = "{:.3f}+{:.3f}".format(t, t + step)
+		entries.append(','.join([e, '"{}"'.format(ref) if ref is not None else '',
+								 '"{}"'.format(hyp) if hyp is not None else '',
+								 times if ref is not None else '', times if hyp is not None else '']))
+	return entries
+
+
+def by_speaker(segs):
+	speakers = dict()
+	for seg in segs:
+		speakers.setdefault((seg[0] + '_' + seg[1]).lower(), list()).append(seg)
+	return sorted(speakers.items())
+
+
+def write_sgml(out, name, datatype, segs):
+	out.write('<SYSTEM title="{0}" ref_fname="{1}O.stm" hyp_fname="/data/{0}" creation_date="" format="2.4" '
+			  'frag_corr="FALSE" opt_del="FALSE" weight_ali="FALSE" weight_filename="">\n'.format(name, datatype))
+	out.write('<LABEL id="" title="" desc="">\n</LABEL>\n<CATEGORY id="" title="" desc="">\n</CATEGORY>\n')
+	for speaker, temp in by_speaker(segs):
+		out.write('<SPEAKER id="{}">\n'.format(speaker))
+		for i, (waveform, channel, begin, end, _, alignment) in enumerate(temp):
+			out.write('<PATH id="({}-{:04d})" word_cnt="{}" file="{}" channel="{}" sequence="{}" '
+					  'R_T1="{:.3f}" R_T2="{:.3f}" word_aux="r_t1+t2,h_t1+t2">\n'.format(
+						  speaker, i + 1, len(alignment), waveform, channel, i, begin, end))
+			out.write(':'.join(sgml_entries(begin, end, alignment)) + '\n')
+			out.write('</PATH>\n')
+		out.write('</SPEAKER>\n')
+	out.write('</SYSTEM>\n')
+
+
+def model_lists(r, words):
+	"""Tagger and language model outputs of a sentence."""
+	tag, shape, gloss = list(), list(), list()
+	for w in words:
+		parts = 2 if w in CONTRACTIONS else 1
+		for k in range(parts):
+			tag.append(r.choice(TAGS))
+			shape.append(2 if w in HESITATIONS or w in BACKCHANNELS else r.choice([0, 1]))
+			gloss.append(k)
+	prob = [round(r.uniform(-9, 0), 4) for _ in words]
+	cprob = [round(r.uniform(-9, 0), 4) for _ in words]
+	return [str(x) for x in (tag, shape, gloss, prob, cprob)]
+
+
+def write_all(out, r, segs, seed):
+	writer = csv.writer(out, lineterminator='\n')
+	columns = ['speakerid', 'word_cnt', 'filename', 'channel', 'sequence', 'r_t1', 'r_t2',
+			   'word_aux', 'raw_sent', 'annotation', 'hyp_sent', 'ref_sent']
+	for stype in ['hyp', 'ref']:
+		columns.extend(stype + c for c in ['_tag', '_shape', '_cont_tag_gloss', '_prob', '_cprob'])
+	writer.writerow([''] + columns)
+	for speaker, temp in by_speaker(segs):
+		for i, (waveform, channel, begin, end, _, alignment) in enumerate(temp):
+			raw_sent = [x.strip('"') for x in ':'.join(sgml_entries(begin, end, alignment)).split(',')]
+			annotation = [e for e, _, _ in alignment]
+			hyp_sent = [h if h is not None else '' for _, _, h in alignment]
+			ref_sent = [w if w is not None else '' for _, w, _ in alignment]
+			row = ['({}-{:04d})'.format(speaker, i + 1), speaker, len(alignment), waveform, channel,
+				   i, '{:.3f}'.format(begin), '{:.3f}'.format(end), 'r_t1+t2,h_t1+t2',
+				   str(raw_sent or ['\n']), str(annotation), str(hyp_sent), str(ref_sent)]
+			row.extend(model_lists(r, [h for _, _, h in alignment if h is not None]))
+			# the models see the same reference sentence in every system
+			ref_r = random.Random('{} {} {}'.format(seed, speaker, i))
+			row.extend(model_lists(ref_r, [w for _, w, _ in alignment if w is not None]))
+			writer.writerow(row)
+
+
+class Main:
+
+	def __init__(self, args):
+		r = random.Random(args.seed)
+		refdir = os.path.join(args.outdir, 'refs')
+		hypdir = os.path.join(args.outdir, 'hyps')
+		datadir = os.path.join(args.outdir, 'data')
+		modir = os.path.join(datadir, 'models')
+		for d in [refdir, hypdir, modir]:
+			os.makedirs(d, exist_ok=True)
+
+		nconv = max(1, round(CONVERSATIONS * args.scale))
+		manifest = {'scale': args.scale, 'seed': args.seed, 'conversations': nconv,
+					'segments': 0, 'words': 0}
+		for datatype, prefix, label in SYSTEMS:
+			systems = {'human': list(), 'machine': list()}
+			for c in range(nconv):
+				convid = 4000 + c
+				segs = conversation(r, prefix, convid, SEGMENTS)
+				with open(os.path.join(refdir, '{}{}.txt'.format(prefix, convid)), 'w') as out:
+					write_ref(out, r, segs)
+				manifest['segments'] += len(segs)
+				manifest['words'] += sum(len(s[4]) for s in segs)
+				systems['human'].append(segs)
+				# the machine system makes other errors on the same references
+				systems['machine'].append([s[:5] + align_words(r, s[4], MACHINE_ERRORS)[1:]
+										   for s in segs])
+
+			for system, convs in systems.items():
+				segs = [s for temp in convs for s in temp]
+				name = '{}.{}'.format(system, label)
+				with open(os.path.join(hypdir, name + '.ctm'), 'w') as out:
+					write_ctm(out, segs, system == 'machine')
+				processed = name + '_processed.ctm'
+				with open(os.path.join(datadir, name + '.sgml'), 'w') as out:
+					write_sgml(out, processed, datatype, segs)
+				with open(os.path.join(modir, name + '_processed.all'), 'w') as out:
+					write_all(out, r, segs, args.seed)
+
+		with open(os.path.join(args.outdir, 'manifest.json'), 'w') as out:
+			json.dump(manifest, out, indent=1)
+		print('Generated {} conversations per datatype, {} segments, {} words in {}'.format(
+			nconv, manifest['segments'], manifest['words'], args.outdir))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Generates a synthetic HUB5 scale corpus.")
+	parser.add_argument("outdir", type=str, help="Directory to write the corpus to.")
+	parser.add_argument("--scale", type=float, default=1, help="Multiple of the NIST 2000 size (e.g. 1, 10, 100).")
+	parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+	args = parser.parse_args()
+	Main(args)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" suite.py
+Author: coman8@uw.edu
+
+Times the pipeline stages on a synthetic corpus (see corpus.py) and records
+the results as JSON, with the commit they were measured on.
+
+Each stage runs as its own process, on a scratch copy of the corpus, and is
+measured by its wall time and peak resident memory. With --compare, the
+results are printed against an earlier JSON file.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+SRC = os.path.join(ROOT, 'src')
+
+# name, script, arguments, with {refs}, {hyps}, {data}, {models} and {out} filled in,
+# and the stages whose outputs it reads
+STAGES = [
+	('preprocess_ref.SWBD', 'preprocess_ref.py', ['{refs}', '{out}', 'SWBD', '--cont'], []),
+	('preprocess_ref.CH', 'preprocess_ref.py', ['{refs}', '{out}', 'CH', '--cont'], []),
+	('preprocess_hyp', 'preprocess_hyp.py', ['{hyps}', '{out}'], []),
+	('get_utterance_table', 'get_utterance_table.py', ['{data}'], []),
+	('get_error_table', 'get_error_table.py', ['{models}'], []),
+	('misc.token_freq_stats', 'misc/token_freq_stats.py',
+	 ['{models}', '--top', '50', '--disf-top', '30', '--outdir', '{out}'], ['get_error_table']),
+	('misc.get_sents', 'misc/get_sents.py', ['{data}'], ['get_utterance_table']),
+	('misc.significance', 'misc/significance.py', ['{data}', '--errdir', '{models}'],
+	 ['get_utterance_table', 'get_error_table']),
+	('misc.get_voc.SWBD', 'misc/get_voc.py', ['{out}', 'SWBD'], ['preprocess_ref.SWBD', 'preprocess_hyp']),
+	('misc.get_voc.CH', 'misc/get_voc.py', ['{out}', 'CH'], ['preprocess_ref.CH', 'preprocess_hyp']),
+]
+
+
+def git_commit():
+	try:
+		out = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True)
+		return out.stdout.strip() or None
+	except OSError:
+		return None
+
+
+def measure(cmd, log):
+	"""Runs a command, returns its exit status, wall time and peak RSS in MB."""
+	start = time.perf_counter()
+	proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+	# wait4 gives the resource usage of this child only
+	_, status, usage = os.wait4(proc.pid, 0)
+	elapsed = time.perf_counter() - start
+	proc.returncode = os.waitstatus_to_exitcode(status)
+	# ru_maxrss is in KB on Linux
+	return proc.returncode, elapsed, usage.ru_maxrss / 1024
+
+
+class Main:
+
+	def __init__(self, args):
+		manifest_path = os.path.join(args.corpus, 'manifest.json')
+		if not os.path.exists(manifest_path):
+			sys.path.insert(0, BENCH)
+			import corpus
+			corpus.Main(argparse.Namespace(outdir=args.corpus, scale=args.scale, seed=args.seed))
+		with open(manifest_path, 'r') as f:
+			manifest = json.load(f)
+
+		# the selected stages, with the stages they read from
+		selected = set(args.stages or [s[0] for s in STAGES])
+		required = selected | {r for s in STAGES if s[0] in selected for r in s[3]}
+		stages = [s for s in STAGES if s[0] in required]
+		results = {'commit': git_commit(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+				   'python': platform.python_version(), 'platform': platform.platform(),
+				   'corpus': manifest, 'repeat': args.repeat, 'stages': dict()}
+
+		for _ in range(args.repeat):
+			work = tempfile.mkdtemp(prefix='bench_')
+			try:
+				self.run(stages, args.corpus, work, results['stages'])
+				for name in required - selected:
+					results['stages'].pop(name, None)
+			finally:
+				shutil.rmtree(work, ignore_errors=True)
+
+		for name, result in results['stages'].items():
+			print('{:<28} {:>8.3f}s {:>8.1f} MB{}'.format(
+				name, result['seconds'], result['max_rss_mb'], '' if result['status'] == 0 else '  FAILED'))
+
+		if args.output:
+			with open(args.output, 'w') as f:
+				json.dump(results, f, indent=1)
+			print('Saved to {}'.format(args.output))
+		if args.compare:
+			self.compare(args.compare, results)
+
+	def run(self, stages, corpus, work, results):
+		"""Runs the stages once on a scratch copy of the corpus, keeping the best runs."""
+		for d in ['refs', 'hyps', 'data']:
+			shutil.copytree(os.path.join(corpus, d), os.path.join(work, d))
+		out = os.path.join(work, 'out')
+		os.makedirs(out)
+		paths = {'refs': os.path.join(work, 'refs'), 'hyps': os.path.join(work, 'hyps'),
+				 'data': os.path.join(work, 'data'), 'models': os.path.join(work, 'data', 'models'),
+				 'out': out}
+
+		with open(os.path.join(work, 'log.txt'), 'w') as log:
+			for name, script, arguments, _ in stages:
+				cmd = [sys.executable, os.path.join(SRC, script)] + [a.format(**paths) for a in arguments]
+				status, elapsed, rss = measure(cmd, log)
+				best = results.get(name)
+				if best is None or (status == 0 and elapsed < best['seconds']):
+					results[name] = {'seconds': round(elapsed, 4), 'max_rss_mb': round(rss, 1),
+									 'status': status}
+				if status != 0:
+					print('{} failed with status {}, see the log:'.format(name, status))
+					log.flush()
+					with open(log.name, 'r') as f:
+						print(''.join(f.readlines()[-10:]))
+
+	def compare(self, path, results):
+		with open(path, 'r') as f:
+			old = json.load(f)
+		print('\nCompared with {} ({})'.format(path, (old.get('commit') or '')[:10]))
+		for name, result in results['stages'].items():
+			before = old['stages'].get(name)
+			if before is None:
+				continue
+			print('{:<28} {:>8.3f}s -> {:>8.3f}s ({:>5.2f}x)   {:>8.1f} MB -> {:>8.1f} MB'.format(
+				name, before['seconds'], result['seconds'], before['seconds'] / max(result['seconds'], 1e-9),
+				before['max_rss_mb'], result['max_rss_mb']))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on a synthetic corpus.")
+	parser.add_argument("corpus", type=str, help="Corpus directory, generated there if it has no manifest.")
+	parser.add_argument("--scale", type=float, default=1, help="Scale of a generated corpus.")
+	parser.add_argument("--seed", type=int, default=0, help="Seed of a generated corpus.")
+	parser.add_argument("--repeat", type=int, default=1, help="Number of runs, the fastest is kept.")
+	parser.add_argument("--stages", type=str, nargs='+', help="Only run these stages.")
+	parser.add_argument("--output", type=str, help="JSON file to save the results to.")
+	parser.add_argument("--compare", type=str, help="JSON results of an earlier run to compare to.")
+	args = parser.parse_args()
+	Main(args)
@@ -1,18 +1,14 @@
 #!/bin/bash
 
 DATADIR=$1 # parent of model dir
+FORMAT=${2:-csv} # table format, csv or parquet
+JOBS=${3:-1} # worker processes
 
-# extract utterances - from sclite sgml files
-python src/get_utterance_table.py ${DATADIR}
+# runs the stages below as a dependency graph, see src/pipeline.py; a failed
+# run resumes from its failed stage with: python src/pipeline.py ${DATADIR} --resume
+# - extract utterances - from sclite sgml files
+# - get full table - when models are complete (.uni, .gru, and .tag csv in models directory)
+# - get (single token) errors
+# - get frequency statistics and disf. frequency (freq_stats and hbkac_stats, as txt, csv and json)
 
-# get full csv - when models are complete (.uni, .gru, and .tag csv in models directory)
-src/gather.sh ${DATADIR}
-
-# get (single token) errors
-python src/get_error_table.py ${DATADIR}
-
-# get frequency statistics
-python src/misc/token_freq_stats.py ${DATADIR}/models > "${DATADIR}/freq_stats.txt" --top 50
-
-# get disf. frequency
-python src/misc/token_freq_stats.py ${DATADIR}/models --disf 1 > "${DATADIR}/hbkac_stats.txt"
+python src/pipeline.py ${DATADIR} --stages main --format ${FORMAT} --jobs ${JOBS}
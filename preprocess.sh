@@ -1,14 +1,11 @@
 #!/bin/bash
 
 DATADIR=$1
+JOBS=${2:-1} # worker processes
 
 # preprocessing steps before running SCLITE scoring program
+# (preprocess_ref writes the references sorted for sclite, as SWBDO.stm and CHO.stm)
+# SWBD, CH and each hypothesis file run as independent stages, see src/pipeline.py
 
-python src/preprocess_ref.py data/NIST2000 $DATADIR SWBD --cont
-python src/preprocess_ref.py data/NIST2000 $DATADIR CH --cont
-python src/preprocess_hyp.py data/human_parity $DATADIR
-sort +0 -1 +1 -2 +3nb -4 ${DATADIR}/CH.stm > ${DATADIR}/CHO.stm
-rm ${DATADIR}/CH.stm
-sort +0 -1 +1 -2 +3nb -4 ${DATADIR}/SWBD.stm > ${DATADIR}/SWBDO.stm
-rm ${DATADIR}/SWBD.stm
-
+python src/pipeline.py ${DATADIR} --stages preprocess --jobs ${JOBS} \
+	--refdir data/NIST2000 --hypdir data/human_parity --cont
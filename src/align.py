@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" align.py
+Author: coman8@uw.edu
+
+Scores a preprocessed CTM against the preprocessed STM without sclite, and
+saves the same utterance table as get_utterance_table, with 1 utterance per row.
+
+- Hypothesis words are assigned to the reference segment holding their midpoint
+- Words in IGNORE_TIME_SEGMENT_IN_SCORING segments are not scored
+- Reference alternations { a b / c / @ } are aligned as a network, the
+  cheapest alternative is kept and @ is a null alternative
+- Fragments (e.g. th-) are correct when the hypothesis shares the prefix
+- Costs follow sclite: correct 0, substitution 4, insertion and deletion 3
+"""
+
+import argparse
+import os
+from bisect import bisect_right
+from collections import defaultdict
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+import util
+from get_utterance_table import Main as Utterances
+
+EMPTY = "IGNORE_TIME_SEGMENT_IN_SCORING"
+SUB = 4
+INS = 3
+DEL = 3
+
+
+def read_stm(infile):
+	"""Yields waveform, channel, speaker, begin, end and transcript of each segment."""
+	for line in infile:
+		if not line.strip() or line.startswith(';;'):
+			continue
+		fields = line.split(None, 5)
+		transcript = fields[5].strip() if len(fields) > 5 else ''
+		# optional segment labels, e.g. <o,f0,male>
+		if transcript.startswith('<') and '>' in transcript:
+			transcript = transcript[transcript.index('>') + 1:].strip()
+		yield fields[0], fields[1], fields[2], float(fields[3]), float(fields[4]), transcript
+
+
+def read_ctm(infile):
+	"""Yields waveform, channel, start, end and word of each CTM entry."""
+	for line in infile:
+		fields = line.split()
+		if len(fields) < 5 or line.startswith(';;'):
+			continue
+		start = float(fields[2])
+		yield fields[0], fields[1], start, start + float(fields[3]), fields[4]
+
+
+def parse_ref(transcript):
+	"""Parses a reference transcript into a list of slots.
+
+	Each slot is a list of alternatives, each a list of words.
+	"""
+	slots = list()
+	alts = None
+	for t in transcript.split():
+		if t == '{':
+			alts = [[]]
+		elif t == '}' and alts is not None:
+			slots.append([[w for w in a if w != '@'] for a in alts])
+			alts = None
+		elif t == '/' and alts is not None:
+			alts.append([])
+		elif alts is not None:
+			alts[-1].append(t)
+		else:
+			slots.append([[t]])
+	return slots
+
+
+class Network:
+	"""Reference word network, states are numbered in topological order.
+
+	arcs holds the incoming arcs of each state as (from state, word), a None
+	word is a null arc.
+	"""
+
+	def __init__(self, slots):
+		self.arcs = [[]]
+		state = 0
+		for slot in slots:
+			ends = list()
+			for alt in slot:
+				prev = state
+				for w in alt[:-1]:
+					prev = self.add_state([(prev, w)])
+				ends.append((prev, alt[-1] if alt else None))
+			state = self.add_state(ends)
+		self.final = state
+
+	def add_state(self, arcs):
+		self.arcs.append(arcs)
+		return len(self.arcs) - 1
+
+
+def match(word, hyp):
+	"""Whether a hyp token matches a reference word."""
+	if word == hyp:
+		return True
+	if word.endswith('-') and len(word) > 1:
+		return hyp.startswith(word[:-1])
+	if word.startswith('-') and len(word) > 1:
+		return hyp.endswith(word[1:])
+	return False
+
+
+def align(transcripts, hyps):
+	"""Aligns a batch of hyp token lists to their reference transcripts.
+
+	The DP runs over all segments of the batch at once: row s of the cost
+	matrix holds reference network state s of every segment. Returns a list
+	of (eval, ref word, hyp index) per segment, with None for a missing ref
+	word or hyp index.
+	"""
+	nets = [Network(parse_ref(t)) for t in transcripts]
+	batch = len(nets)
+	nstates = max(net.final for net in nets) + 1
+	narcs = max(len(arcs) for net in nets for arcs in net.arcs)
+	lengths = np.array([len(h) for h in hyps], dtype=np.int64)
+	n = lengths.max() if batch else 0
+	steps = np.arange(n + 1)
+	rows = np.arange(batch)
+
+	# word ids, with the match of every ref word against every hyp word
+	ref_vocab = dict()
+	hyp_vocab = dict()
+	prev = np.full((batch, nstates, narcs), -1, dtype=np.int64)
+	word = np.full((batch, nstates, narcs), -1, dtype=np.int64)  # -1 is a null arc
+	for b, net in enumerate(nets):
+		for s, arcs in enumerate(net.arcs):
+			for a, (p, w) in enumerate(arcs):
+				prev[b, s, a] = p
+				if w is not None:
+					word[b, s, a] = ref_vocab.setdefault(w, len(ref_vocab))
+	hyp_ids = np.full((batch, n), -1, dtype=np.int64)  # -1 pads the shorter segments
+	for b, h in enumerate(hyps):
+		hyp_ids[b, :len(h)] = [hyp_vocab.setdefault(t, len(hyp_vocab)) for t in h]
+	matches = np.zeros((len(ref_vocab) + 1, len(hyp_vocab) + 1), dtype=bool)
+	for w, i in ref_vocab.items():
+		for t, j in hyp_vocab.items():
+			matches[i, j] = match(w, t)
+
+	inf = np.iinfo(np.int64).max // 4
+	cost = np.full((batch, nstates, n + 1), inf, dtype=np.int64)
+	op = np.zeros((batch, nstates, n + 1), dtype=np.int8)  # 0 diag, 1 del, 2 ins, 3 null
+	back = np.zeros((batch, nstates, n + 1), dtype=np.int64)  # arc index
+	cost[:, 0] = INS * steps
+	op[:, 0] = 2
+
+	for s in range(1, nstates):
+		best = np.full((batch, n + 1), inf, dtype=np.int64)
+		o = op[:, s]
+		k = back[:, s]
+		for a in range(narcs):
+			p = prev[:, s, a]
+			w = word[:, s, a]
+			pcost = np.where((p >= 0)[:, None], cost[rows, np.maximum(p, 0)], inf)
+
+			null = (p >= 0) & (w < 0)
+			better = (pcost < best) & null[:, None]
+			best[better] = pcost[better]
+			o[better] = 3
+			k[better] = a
+
+			arc = (p >= 0) & (w >= 0)
+			sub = np.where(matches[w[:, None], hyp_ids], 0, SUB)
+			better = np.zeros((batch, n + 1), dtype=bool)
+			diag = pcost[:, :-1] + sub
+			better[:, 1:] = (diag < best[:, 1:]) & arc[:, None]
+			best[better] = diag[better[:, 1:]]
+			o[better] = 0
+			k[better] = a
+			vert = pcost + DEL
+			better = (vert < best) & arc[:, None]
+			best[better] = vert[better]
+			o[better] = 1
+			k[better] = a
+
+		# insertions are a prefix minimum along the row
+		closed = INS * steps + np.minimum.accumulate(best - INS * steps, axis=1)
+		o[closed < best] = 2
+		cost[:, s] = closed
+
+	# trace back
+	results = list()
+	for b, net in enumerate(nets):
+		result = list()
+		s, j = net.final, lengths[b]
+		while s > 0 or j > 0:
+			o = op[b, s, j]
+			if o == 2:
+				j -= 1
+				result.append(('I', None, j))
+				continue
+			p, w = net.arcs[s][back[b, s, j]]
+			if o == 0:
+				j -= 1
+				result.append(('C' if match(w, hyps[b][j]) else 'S', w, j))
+			elif o == 1:
+				result.append(('D', w, None))
+			s = p
+		result.reverse()
+		results.append(result)
+	return results
+
+
+def align_speaker(segments, batch_size=64):
+	"""Aligns the segments of one waveform and channel, returns their rows."""
+	# segments of similar size are aligned in the same batch
+	order = sorted(range(len(segments)), key=lambda i: (len(segments[i][0][5]), len(segments[i][1])))
+	alignments = [None] * len(segments)
+	for i in range(0, len(order), batch_size):
+		batch = order[i:i + batch_size]
+		temp = align([segments[x][0][5] for x in batch],
+					 [[w[2] for w in segments[x][1]] for x in batch])
+		for x, alignment in zip(batch, temp):
+			alignments[x] = alignment
+
+	rows = list()
+	for ((waveform, channel, speaker, begin, end, transcript), words), alignment in zip(segments, alignments):
+		tokens = [w[2] for w in words]
+
+		entries = list()
+		annotation, hyp_sent, ref_sent = list(), list(), list()
+		for atype, ref, j in alignment:
+			rword = '"{}"'.format(ref) if ref is not None else ''
+			hword = '"{}"'.format(tokens[j]) if j is not None else ''
+			htimes = '{:.3f}+{:.3f}'.format(words[j][0], words[j][1]) if j is not None else ''
+			entries.append(','.join([atype, rword, hword, '', htimes]))
+			annotation.append(atype)
+			ref_sent.append(ref if ref is not None else '')
+			hyp_sent.append(tokens[j] if j is not None else '')
+		raw_sent = [i.strip("\"") for i in ':'.join(entries).split(',')]
+
+		rows.append([speaker.lower(), len(alignment), waveform, channel,
+					 '{:.3f}'.format(begin), '{:.3f}'.format(end),
+					 'r_t1+t2,h_t1+t2', raw_sent, annotation, hyp_sent, ref_sent])
+	return rows
+
+
+class Main:
+
+	def __init__(self, args):
+		segments, skipped = self.get_segments(args.stm, args.ctm)
+		if skipped:
+			print('Skipped {} hypothesis word(s) outside of scored segments'.format(skipped))
+
+		if args.jobs > 1:
+			with Pool(args.jobs) as pool:
+				results = list(pool.imap(align_speaker, segments))
+		else:
+			results = list(map(align_speaker, segments))
+
+		# number the paths of each speaker as sclite does
+		data = dict()
+		sequence = defaultdict(int)
+		for rows in results:
+			for row in rows:
+				speakerid = row[0]
+				sequence[speakerid] += 1
+				key = '({}-{:04d})'.format(speakerid, sequence[speakerid])
+				data[key] = row[:4] + [sequence[speakerid] - 1] + row[4:]
+
+		columns = ['speakerid', 'word_cnt', 'filename', 'channel', 'sequence', 'r_t1',
+				   'r_t2', 'word_aux', 'raw_sent', 'annotation', 'hyp_sent', 'ref_sent']
+		df = pd.DataFrame.from_dict(data, orient='index', columns=columns)
+		if args.format == 'parquet':
+			df = df.astype(Utterances.TYPES)
+		output = util.table_name(os.path.basename(args.ctm) + '.csv', args.format)
+		util.write_table(df, args.outdir, output)
+
+	def get_segments(self, stm, ctm):
+		"""Groups the scored segments by waveform and channel, with their hyp words."""
+		speakers = defaultdict(list)
+		with open(stm, 'r') as infile:
+			for seg in read_stm(infile):
+				speakers[seg[0], seg[1]].append((seg, list()))
+		for key in speakers:
+			speakers[key].sort(key=lambda x: x[0][3])
+
+		begins = {k: [seg[3] for seg, _ in v] for k, v in speakers.items()}
+		skipped = 0
+		with open(ctm, 'r') as infile:
+			for waveform, channel, start, end, word in read_ctm(infile):
+				segs = speakers.get((waveform, channel))
+				mid = (start + end) / 2
+				i = bisect_right(begins[waveform, channel], mid) - 1 if segs else -1
+				if i < 0 or mid > segs[i][0][4] or segs[i][0][5] == EMPTY:
+					skipped += 1
+					continue
+				segs[i][1].append((start, end, word))
+
+		groups = [[s for s in speakers[k] if s[0][5] != EMPTY] for k in sorted(speakers)]
+		return [g for g in groups if g], skipped
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Aligns a CTM to the reference STM \
+									 and saves the utterance table, without sclite.")
+	parser.add_argument("ctm", type=str, help="Preprocessed hypothesis CTM")
+	parser.add_argument("stm", type=str, help="Preprocessed (sorted) reference STM")
+	parser.add_argument("outdir", type=str, help="Directory to save the utterance table")
+	parser.add_argument("--jobs", type=int, default=1,
+						help="Number of worker processes (default is serial).")
+	parser.add_argument("--format", type=str, default='csv', choices=util.FORMATS,
+						help="Table format of the utterance table")
+	args = parser.parse_args()
+	Main(args)
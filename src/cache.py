@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" cache.py
+Author: coman8@uw.edu
+
+Content-addressed cache of pipeline stage outputs.
+
+A stage unit (e.g. get_error_table on one model table) is keyed by the hash of
+its parameters, the contents of its inputs and the source of its scripts.
+Outputs are stored under <datadir>/.cache/<key>/ and copied back on a hit.
+Each unit keeps one entry, so the entry of a stale key is evicted when the
+unit is stored again.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+CHUNK = 1 << 20
+
+
+class StageCache:
+    INDEX = 'index.json'
+    HASHES = 'hashes.json'
+
+    def __init__(self, basedir, cachedir=None):
+        self.basedir = os.path.abspath(basedir)
+        self.cachedir = cachedir or os.path.join(self.basedir, '.cache')
+        os.makedirs(self.cachedir, exist_ok=True)
+        self.index = self.load(self.INDEX)
+        # file digests, reused while the size and mtime of a file are unchanged
+        self.hashes = self.load(self.HASHES)
+
+    def load(self, name):
+        path = os.path.join(self.cachedir, name)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                return json.load(f)
+        return dict()
+
+    def save(self):
+        for name, data in [(self.INDEX, self.index), (self.HASHES, self.hashes)]:
+            path = os.path.join(self.cachedir, name)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(data, f, indent=1, sort_keys=True)
+            os.replace(path + '.tmp', path)
+
+    def hash_file(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        memo = self.hashes.get(path)
+        if memo and memo[:2] == stamp:
+            return memo[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK), b''):
+                digest.update(chunk)
+        self.hashes[path] = stamp + [digest.hexdigest()]
+        return digest.hexdigest()
+
+    def key(self, stage, params, inputs, sources):
+        """Hashes a stage unit. Inputs are hashed by name and contents."""
+        digest = hashlib.sha256()
+        digest.update(json.dumps([stage, params], sort_keys=True).encode('utf-8'))
+        for path in sorted(inputs):
+            digest.update(os.path.basename(path).encode('utf-8'))
+            digest.update(self.hash_file(path).encode('utf-8'))
+        for path in sources:
+            digest.update(self.hash_file(path).encode('utf-8'))
+        return digest.hexdigest()
+
+    def fetch(self, unit, key):
+        """Restores the outputs of a cached unit, returns them or None on a miss."""
+        entry = os.path.join(self.cachedir, key)
+        manifest = os.path.join(entry, 'outputs.json')
+        if not os.path.exists(manifest):
+            return None
+        with open(manifest, 'r') as f:
+            outputs = json.load(f)
+        for i, output in enumerate(outputs):
+            target = os.path.join(self.basedir, output)
+            cached = os.path.join(entry, str(i))
+            # outputs left in place by the last run are not copied again
+            if os.path.exists(target) and self.hash_file(target) == self.hash_file(cached):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(cached, target)
+            self.hash_file(target)
+        self.index[unit] = key
+        return outputs
+
+    def store(self, unit, key, outputs):
+        """Stores the outputs of a unit, evicting its previous entry."""
+        entry = os.path.join(self.cachedir, key)
+        os.makedirs(entry, exist_ok=True)
+        outputs = [os.path.relpath(os.path.abspath(o), self.basedir) for o in outputs]
+        for i, output in enumerate(outputs):
+            shutil.copyfile(os.path.join(self.basedir, output), os.path.join(entry, str(i)))
+        with open(os.path.join(entry, 'outputs.json'), 'w') as f:
+            json.dump(outputs, f)
+
+        old = self.index.get(unit)
+        self.index[unit] = key
+        if old and old != key and old not in self.index.values():
+            shutil.rmtree(os.path.join(self.cachedir, old), ignore_errors=True)
+
+    def evict(self):
+        """Removes the entries and file digests no unit refers to anymore."""
+        keys = set(self.index.values())
+        for name in os.listdir(self.cachedir):
+            path = os.path.join(self.cachedir, name)
+            if os.path.isdir(path) and name not in keys:
+                shutil.rmtree(path, ignore_errors=True)
+        self.hashes = {p: h for p, h in self.hashes.items() if os.path.exists(p)}
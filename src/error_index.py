@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" error_index.py
+Author: coman8@uw.edu
+
+Persistent inverted indexes over the error tables of a models directory, to
+look up and count errors without reloading and filtering the tables.
+
+The error rows of every table are numbered once, and each field is coded:
+tokens by one shared vocabulary, the other fields by their own list of
+values. The index of a coded field lists the rows of each value, in order
+(a permutation of the rows and the offset of each value in it), and the
+index of a numeric field (position, sen_len) is the rows sorted by value.
+A conjunctive query intersects the row lists of its values, smallest first,
+and filters the result by its ranges. The arrays are saved as .npy files in
+<projdir>/.error_index and memory-mapped on load, and the index is rebuilt
+when an error table changed.
+
+    index = ErrorIndex.open('models')
+    index.count(annotation='D', ref_token='%hesitation', file='*callhome*', ref_pos='UH')
+    index.query(annotation='S', hyp_token='a', ref_token='the', position=(11, None))
+"""
+
+import argparse
+import fnmatch
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import util
+from vocab import Vocab, IDS
+
+INDEX = '.error_index'
+META = 'meta.json'
+VERSION = 2
+
+
+def encode(column, vocab):
+    """The ids of a column, adding each distinct value to the vocabulary once."""
+    codes, uniques = pd.factorize(column, use_na_sentinel=False)
+    lookup = np.fromiter((vocab.add(value_name(v)) for v in uniques), dtype=IDS, count=len(uniques))
+    return lookup[codes]
+
+
+def value_name(v):
+    """The name of a field value: missing values are '', whole numbers have no decimals."""
+    if v is None or (isinstance(v, float) and np.isnan(v)):
+        return ''
+    if isinstance(v, (float, np.floating)) and float(v).is_integer():
+        return str(int(v))
+    return str(v)
+
+
+def postings(codes, size):
+    """The rows of each code, as a permutation of the rows and the offset of each code."""
+    order = np.argsort(codes, kind='stable')
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=size), out=offsets[1:])
+    return order.astype(np.int64), offsets
+
+
+class ErrorIndex:
+    # coded fields, the token fields sharing one vocabulary
+    FIELDS = ['file', 'annotation', 'hyp_token', 'ref_token', 'hyp_pos', 'ref_pos',
+              'hyp_shape', 'ref_shape']
+    TOKENS = ['hyp_token', 'ref_token']
+    RANGES = ['position', 'sen_len']
+    FLOATS = ['hyp_prob', 'hyp_cprob', 'ref_prob', 'ref_cprob']
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.files = meta['files']
+        self.values = {f: meta['values'][self.vocab_name(f)] for f in self.FIELDS}
+        self.ids = {f: {v: i for i, v in enumerate(self.values[f])} for f in self.FIELDS}
+        self.arrays = dict()
+
+    @staticmethod
+    def vocab_name(field):
+        return 'token' if field in ErrorIndex.TOKENS else field
+
+    def array(self, name):
+        if name not in self.arrays:
+            self.arrays[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+        return self.arrays[name]
+
+    def __len__(self):
+        return self.meta['rows']
+
+    @staticmethod
+    def sources(projdir, fmt):
+        """The size and mtime of each error table."""
+        suffix = '_errors.' + fmt
+        files = sorted(f for f in os.listdir(projdir) if f.endswith(suffix))
+        result = dict()
+        for f in files:
+            st = os.stat(os.path.join(projdir, f))
+            result[f] = [st.st_size, st.st_mtime_ns]
+        return result
+
+    @classmethod
+    def open(cls, projdir, fmt='csv'):
+        """Loads the index of a models directory, building it when an error table changed."""
+        path = os.path.join(projdir, INDEX)
+        meta_path = os.path.join(path, META)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            # the file codes are the positions of the tables, empty ones included
+            if meta.get('version') == VERSION and meta.get('format') == fmt \
+                    and meta.get('sources') == cls.sources(projdir, fmt) \
+                    and meta['values'].get('file') == meta['files']:
+                return cls(path, meta)
+        return cls.build(projdir, fmt)
+
+    @classmethod
+    def build(cls, projdir, fmt='csv'):
+        """Builds and saves the index of the error tables of a models directory."""
+        sources = cls.sources(projdir, fmt)
+        vocabs = {cls.vocab_name(f): Vocab() for f in cls.FIELDS}
+        files = [f[:-len('_errors.' + fmt)] for f in sources]
+        # every table has a file code, also the tables without rows
+        for name in files:
+            vocabs['file'].add(name)
+        columns = {f: list() for f in cls.FIELDS + cls.RANGES + cls.FLOATS + ['ix']}
+        for file, name in zip(sources, files):
+            infile = os.path.join(projdir, file)
+            print('Indexing {}'.format(infile))
+            if fmt == 'parquet':
+                df = pd.read_parquet(infile).reset_index()
+            else:
+                df = pd.read_csv(infile, dtype={'ix': str, 'hyp_token': str, 'ref_token': str,
+                                                'hyp_pos': str, 'ref_pos': str})
+            df['file'] = name
+            for f in cls.FIELDS:
+                columns[f].append(encode(df[f], vocabs[cls.vocab_name(f)]))
+            for f in cls.RANGES:
+                columns[f].append(df[f].to_numpy(dtype=np.int64))
+            for f in cls.FLOATS:
+                columns[f].append(df[f].to_numpy(dtype=np.float64))
+            columns['ix'].append(df['ix'].astype(str).to_numpy())
+
+        path = os.path.join(projdir, INDEX)
+        tmp = path + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        rows = 0
+        for name, parts in columns.items():
+            if name == 'ix':
+                values = np.concatenate(parts).astype(str) if parts else np.array([], dtype=str)
+            else:
+                dtype = np.float64 if name in cls.FLOATS else np.int64 if name in cls.RANGES else IDS
+                values = np.concatenate(parts) if parts else np.array([], dtype=dtype)
+            rows = len(values)
+            np.save(os.path.join(tmp, name + '.npy'), values)
+            if name in cls.FIELDS:
+                order, offsets = postings(values, len(vocabs[cls.vocab_name(name)]))
+                np.save(os.path.join(tmp, name + '.order.npy'), order)
+                np.save(os.path.join(tmp, name + '.offsets.npy'), offsets)
+            elif name in cls.RANGES:
+                order = np.argsort(values, kind='stable')
+                np.save(os.path.join(tmp, name + '.order.npy'), order)
+                np.save(os.path.join(tmp, name + '.sorted.npy'), values[order])
+
+        meta = {'version': VERSION, 'format': fmt, 'sources': sources, 'rows': rows,
+                'files': files,
+                'values': {name: v.tokens for name, v in vocabs.items()}}
+        with open(os.path.join(tmp, META), 'w') as f:
+            json.dump(meta, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        print('Indexed {} errors of {} tables in {}'.format(rows, len(sources), path))
+        return cls(path, meta)
+
+    def lookup(self, field, value):
+        """The codes of a value or list of values of a field, file names may be glob patterns."""
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        codes = set()
+        for v in values:
+            if field == 'file':
+                codes.update(self.ids[field].get(f) for f in fnmatch.filter(self.files, str(v)))
+                codes.discard(None)
+            else:
+                code = self.ids[field].get(value_name(v))
+                if code is not None:
+                    codes.add(code)
+        return sorted(codes)
+
+    def posting(self, field, codes):
+        """The rows of any of the codes of a field, in order."""
+        order, offsets = self.array(field + '.order'), self.array(field + '.offsets')
+        parts = [order[offsets[c]:offsets[c + 1]] for c in codes]
+        if len(parts) == 1:
+            return np.asarray(parts[0])
+        return np.sort(np.concatenate(parts)) if parts else np.array([], dtype=np.int64)
+
+    def range_rows(self, field, low, high):
+        """The rows with a value of a numeric field in [low, high], in order."""
+        values = self.array(field + '.sorted')
+        start = 0 if low is None else np.searchsorted(values, low, side='left')
+        end = len(values) if high is None else np.searchsorted(values, high, side='right')
+        return np.sort(self.array(field + '.order')[start:end])
+
+    def rows(self, **query):
+        """The rows matching every condition of a query, in order.
+
+        Conditions are field=value, or field=[values] for any of them, and
+        position or sen_len=(low, high), bounds included, None for no bound.
+        """
+        lists = list()
+        ranges = list()
+        for field, value in query.items():
+            if field in self.FIELDS:
+                lists.append((field, self.lookup(field, value)))
+            elif field in self.RANGES:
+                low, high = value if isinstance(value, (list, tuple)) else (value, value)
+                ranges.append((field, low, high))
+            else:
+                raise ValueError('Unknown field {}, use one of {}'.format(
+                    field, ', '.join(self.FIELDS + self.RANGES)))
+
+        if any(not codes for _, codes in lists):
+            return np.array([], dtype=np.int64)
+        # the shortest row lists first, so the intersections stay small
+        sizes = [sum(int(self.array(f + '.offsets')[c + 1] - self.array(f + '.offsets')[c]) for c in codes)
+                 for f, codes in lists]
+        result = None
+        for i in np.argsort(sizes, kind='stable'):
+            rows = self.posting(*lists[i])
+            result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+            if not len(result):
+                return result
+
+        for field, low, high in ranges:
+            if result is None:
+                result = self.range_rows(field, low, high)
+                continue
+            values = self.array(field)[result]
+            keep = np.ones(len(result), dtype=bool)
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values <= high
+            result = result[keep]
+        if result is None:
+            return np.arange(len(self), dtype=np.int64)
+        return result
+
+    def count(self, **query):
+        return len(self.rows(**query))
+
+    def counts(self, by, **query):
+        """The number of matching errors by value of a field, largest first."""
+        rows = self.rows(**query)
+        codes = self.array(by)[rows]
+        if by in self.RANGES:
+            values, counts = np.unique(codes, return_counts=True)
+        else:
+            counts = np.bincount(codes, minlength=len(self.values[by]))
+            values = np.asarray(self.values[by], dtype=object)
+        result = pd.Series(counts, index=pd.Index(values, name=by), name='count')
+        return result[result > 0].sort_values(ascending=False, kind='stable')
+
+    def query(self, limit=None, **query):
+        """The matching errors as a frame of the error table columns, with their file."""
+        rows = self.rows(**query)
+        if limit is not None:
+            rows = rows[:limit]
+        data = {'ix': self.array('ix')[rows]}
+        for f in self.FIELDS + self.RANGES + self.FLOATS:
+            values = self.array(f)[rows]
+            data[f] = np.asarray(self.values[f], dtype=object)[values] if f in self.FIELDS else values
+        columns = ['file', 'ix', 'annotation', 'position', 'sen_len'] + \
+            [s + '_' + c for s in ['hyp', 'ref'] for c in ['token', 'pos', 'shape', 'prob', 'cprob']]
+        return pd.DataFrame(data, columns=columns)
+
+
+class Main:
+
+    def __init__(self, args):
+        index = ErrorIndex.build(args.projdir, args.format) if args.rebuild \
+            else ErrorIndex.open(args.projdir, args.format)
+        query = {f: getattr(args, f) for f in ErrorIndex.FIELDS if getattr(args, f) is not None}
+        for f in ErrorIndex.RANGES:
+            if getattr(args, f) is not None:
+                low, _, high = getattr(args, f).partition(':')
+                query[f] = (int(low) if low else None, int(high) if high else None) if _ \
+                    else (int(low), int(low))
+
+        if args.by:
+            print(index.counts(args.by, **query).head(args.limit).to_string())
+        elif args.count:
+            print(index.count(**query))
+        else:
+            with pd.option_context('display.width', 200, 'display.max_columns', None):
+                print(index.query(limit=args.limit, **query).to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Looks up and counts errors with persistent indexes \
+                                     over the error tables.")
+    parser.add_argument("projdir", type=str, help="Models directory with the error tables")
+    parser.add_argument("--format", type=str, default='csv', choices=util.FORMATS,
+                        help="Table format of the error tables")
+    parser.add_argument("--rebuild", action="store_true", help="Build the index again")
+    for f in ErrorIndex.FIELDS:
+        parser.add_argument("--" + f.replace('_', '-'), dest=f, type=str, nargs='+',
+                            help="Values of {}{}".format(f, ', as glob patterns' if f == 'file' else ''))
+    for f in ErrorIndex.RANGES:
+        parser.add_argument("--" + f.replace('_', '-'), dest=f, type=str,
+                            help="Value or low:high range of {}, bounds included".format(f))
+    parser.add_argument("--count", action="store_true", help="Only print the number of errors")
+    parser.add_argument("--by", type=str, choices=ErrorIndex.FIELDS + ErrorIndex.RANGES,
+                        help="Print the number of errors by value of this field")
+    parser.add_argument("--limit", type=int, default=20, help="Number of rows printed")
+    args = parser.parse_args()
+    Main(args)
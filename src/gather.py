@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" gather.py
+Author: coman8@uw.edu
+
+Python counterpart of gather.sh: joins each utterance table with the tagger
+(.tag) and language model (.uni, .gru) outputs into a .all model table,
+without editing the model outputs in place. For parquet, list cells are
+parsed once here, so readers of the model table load them as is.
+
+With join, the model tables of the systems of each joined utterance table
+(see joined.py) are also joined, keeping the reference model outputs once.
+"""
+
+import argparse
+import os
+from ast import literal_eval
+import pandas as pd
+import util
+import joined
+
+
+class Main:
+    SOURCES = ['hyp', 'ref']
+
+    def __init__(self, datadir, fmt='parquet', files=None, join=False):
+        self.fmt = fmt
+        suffix = util.table_name('.ctm.csv', fmt)
+        modir = os.path.join(datadir, 'models')
+        for file in files or sorted(os.listdir(datadir)):
+            if file.endswith(suffix):
+                prefix = file[:-len(suffix)]
+                df = util.load_file(datadir, file)
+                for stype in self.SOURCES:
+                    mfile = os.path.join(modir, prefix + '_' + stype)
+                    df = df.join(self.load_tag(mfile + '.tag', stype, df.index))
+                    df[stype + '_prob'] = self.load_lm(mfile + '.uni')
+                    df[stype + '_cprob'] = self.load_lm(mfile + '.gru')
+                util.write_table(df, modir, util.table_name(prefix + '.all', fmt))
+        if join:
+            self.join(datadir, modir)
+
+    def join(self, datadir, modir):
+        suffix = util.table_name(joined.SUFFIX, self.fmt)
+        for file in sorted(os.listdir(datadir)):
+            if file.endswith(suffix):
+                if self.fmt == 'parquet':
+                    import pyarrow.parquet as pq
+                    columns = pq.read_schema(os.path.join(datadir, file)).names
+                else:
+                    columns = pd.read_csv(os.path.join(datadir, file), nrows=0).columns
+                frames = dict()
+                for system in joined.systems(pd.DataFrame(columns=columns)):
+                    df = util.load_file(modir, util.table_name(system + '.all', self.fmt))
+                    for c in ['annotation', 'ref_sent']:
+                        df[c] = [util.parse_cell(x) if isinstance(x, str) else x for x in df[c]]
+                    frames[system] = df
+                util.write_table(joined.join(frames), modir, file)
+
+    def load_tag(self, infile, stype, index):
+        tag = pd.read_csv(infile)
+        # gather.sh may already have prefixed the header
+        tag.columns = [c if c.startswith(stype + '_') else stype + '_' + c
+                       for c in tag.columns]
+        for c in tag.columns:
+            tag[c] = tag[c].apply(self.parse)
+        tag.index = index
+        return tag
+
+    def load_lm(self, infile):
+        with open(infile, 'r') as f:
+            lines = [l.strip().strip('"') for l in f]
+        # gather.sh may already have inserted a header
+        return [self.parse(l) for l in lines if l.startswith('[')]
+
+    def parse(self, x):
+        if self.fmt == 'parquet' and isinstance(x, str) and x.startswith('['):
+            return literal_eval(x)
+        return x
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gathers utterance and model \
+                                     tables into model tables.")
+    parser.add_argument("datadir", type=str, help="Data directory, parent of the models directory")
+    parser.add_argument("--format", type=str, default='parquet', choices=util.FORMATS,
+                        help="Table format of the utterance and model tables")
+    parser.add_argument("--files", type=str, nargs='+', help="Only gather these utterance tables")
+    parser.add_argument("--join", action="store_true",
+                        help="Also join the model tables of each joined utterance table")
+    args = parser.parse_args()
+    Main(args.datadir, args.format, args.files, args.join)
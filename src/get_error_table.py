@@ -5,13 +5,65 @@
 Author: coman8@uw.edu
 
 Given the csv of model infos, generates a csv of error info only.
+
+With ids, the sentences are read from the token table of the utterance table
+(see vocab.py) instead of being parsed from the model table.
+
+With incremental, a 64-bit fingerprint of the extracted columns of each
+utterance is saved next to the error table (<table>_errors.fp.npz). On the
+next run only the utterances whose fingerprint changed are parsed and
+extracted again, and the error rows of the others are copied from the
+existing error table, keyed by their ix. The fingerprints are only trusted
+with the error table and the code they were saved with.
 """
 
 import argparse
+import hashlib
 import os
-from ast import literal_eval
+from itertools import chain
+import numpy as np
 import pandas as pd
 import util
+import vocab
+
+FINGERPRINTS = '.fp.npz'
+# mixes the position of a list item into its hash
+MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def digest(*paths):
+    result = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                result.update(chunk)
+    return result.hexdigest()
+
+
+def hash_lists(values, starts, lengths):
+    """A 64-bit hash of each flattened list, by item and position, and the list lengths."""
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    position = (np.arange(len(values)) - starts[rows]).astype(np.uint64)
+    if len(values) and not isinstance(values[0], str):
+        values = values.astype(np.float64)
+    elif values.dtype.kind == 'U':
+        # the tokens of a token table
+        values = values.astype(object)
+    items = pd.util.hash_array(values) + position * MIX
+    total = np.zeros(len(values) + 1, dtype=np.uint64)
+    np.cumsum(pd.util.hash_array(items), out=total[1:])
+    return total[starts + lengths] - total[starts], lengths
+
+
+def select(flat, mask):
+    """The flattened lists of the rows of a mask."""
+    values, starts, lengths = flat
+    rows = np.flatnonzero(mask)
+    new_lengths = lengths[rows]
+    new_starts = np.zeros(len(rows), dtype=np.int64)
+    np.cumsum(new_lengths[:-1], out=new_starts[1:])
+    ix = np.repeat(starts[rows] - new_starts, new_lengths) + np.arange(new_lengths.sum())
+    return values[ix], new_starts, new_lengths
 
 
 class SError:
@@ -60,90 +112,266 @@ class TError:
 
 class Main:
     ERRORS = ['I', 'D', 'S']
+    # list columns used to extract errors
+    COLUMNS = ['annotation'] + [s + '_' + c for s in ['hyp', 'ref']
+                                for c in ['sent', 'tag', 'shape', 'cont_tag_gloss',
+                                          'prob', 'cprob']]
+    # error table types, so that parquet chunks share one schema
+    TYPES = dict({'ix': str, 'annotation': str, 'position': 'int64', 'sen_len': 'int64'},
+                 **{s + '_' + c: t for s in ['hyp', 'ref']
+                    for c, t in [('token', str), ('pos', str), ('shape', 'float64'),
+                                 ('prob', 'float64'), ('cprob', 'float64')]})
 
-    def __init__(self, projdir):
-        for file in os.listdir(projdir):
-            if file.endswith('.all'):
-                df = util.load_file(projdir, file)
+    SENTS = ['hyp_sent', 'ref_sent']
 
-                errors = self.get_errors(df)
+    def __init__(self, projdir, fmt='csv', files=None, chunksize=10000, ids=False,
+                 incremental=False):
+        suffix = util.table_name('.all', fmt)
+        for file in files or os.listdir(projdir):
+            if not file.endswith(suffix):
+                continue
+            table = self.load_ids(projdir, file[:-len(suffix)]) if ids else None
+            columns = self.COLUMNS if table is None else \
+                [c for c in self.COLUMNS if c not in self.SENTS]
+            if incremental:
+                self.update(projdir, file, util.table_name(file[:-len(suffix)] + '_errors.csv', fmt),
+                            columns, table, chunksize)
+            else:
+                # utterances are independent, so errors are extracted
+                # and written a chunk of utterances at a time
+                chunks = util.read_chunks(projdir, file, columns,
+                                          list_columns=columns, chunksize=chunksize)
+                errors = chain.from_iterable(self.get_errors(df, sents)
+                                             for df, sents in self.with_sents(chunks, table))
 
                 # write file
-                output = file[:-4] + '_errors.csv'
-                util.write_file(errors, projdir, output,
-                                cols=TError.get_columns())
+                output = util.table_name(file[:-len(suffix)] + '_errors.csv', fmt)
+                util.write_rows(errors, projdir, output,
+                                cols=TError.get_columns(), dtypes=self.TYPES)
 
-    def get_errors(self, df):
-        # read columns as list
-        columns = df.columns[8:]
-        for c in columns:
-            df[c] = df[c].apply(lambda x: literal_eval(x))
+    def update(self, projdir, file, output, columns, table, chunksize):
+        """Extracts the errors of the utterances of a model table whose fingerprint changed.
 
-        # get errors from each sentence
-        result = list()
-        for ix, row in df.iterrows():
-            temp = self.extract_errors(ix, row)  # list errors
-            if temp:
-                result.extend(temp)
+        The rows of the other utterances are spliced in from the existing
+        error table. Without valid fingerprints, every utterance is extracted.
+        With a token table, the sentences it holds are part of the fingerprints.
+        """
+        path = os.path.join(projdir, output)
+        store = os.path.splitext(path)[0] + FINGERPRINTS
+        source = digest(__file__, util.__file__, vocab.__file__)
+        known = dict()
+        old = list()
+        if os.path.exists(store) and os.path.exists(path):
+            with np.load(store, allow_pickle=False) as data:
+                if str(data['source']) == source and str(data['errors']) == digest(path):
+                    known = dict(zip(data['names'].tolist(), data['fingerprints'].tolist()))
+        if known:
+            old = self.load_errors(path)
+
+        names, fingerprints, new = list(), list(), dict()
+        chunks = util.read_chunks(projdir, file, columns, chunksize=chunksize)
+        for df, sents in self.with_sents(chunks, table):
+            chunk_names = [util.utterance_name(ix) for ix in df.index]
+            fp = self.fingerprints(df, sents)
+            changed = np.array([known.get(n) != f for n, f in zip(chunk_names, fp.tolist())], dtype=bool)
+            if changed.any():
+                df = df[changed]
+                for c in columns:
+                    df[c] = [util.parse_cell(x) if isinstance(x, str) else x for x in df[c]]
+                sents = {c: select(v, changed) for c, v in sents.items()}
+                for row in self.get_errors(df, sents):
+                    new.setdefault(row[0].rsplit('#', 1)[0], list()).append(row)
+                for n in np.asarray(chunk_names, dtype=object)[changed]:
+                    new.setdefault(n, list())
+            names.extend(chunk_names)
+            fingerprints.append(fp)
+        print('Extracted {} of {} utterances again'.format(len(new), len(names)))
+
+        rows = chain.from_iterable(new[n] if n in new else old.get(n, ()) for n in names)
+        util.write_rows(rows, projdir, output, cols=TError.get_columns(), dtypes=self.TYPES)
+        fingerprints = np.concatenate(fingerprints) if fingerprints else np.array([], dtype=np.uint64)
+        with open(store, 'wb') as f:
+            np.savez(f, names=np.array(names, dtype=str), fingerprints=fingerprints,
+                     source=np.array(source), errors=np.array(digest(path)))
+
+    def fingerprints(self, df, sents=None):
+        """A 64-bit hash of the extracted columns of each row, read as strings or lists.
+
+        Flattened columns in sents are hashed instead of those of df.
+        """
+        hashes = dict()
+        for c in self.COLUMNS:
+            if sents and c in sents:
+                hashes[c], hashes[c + '.len'] = hash_lists(*sents[c])
+            elif len(df) and not isinstance(df[c].iloc[0], str):
+                # list cells, hashed by item and position
+                hashes[c], hashes[c + '.len'] = hash_lists(*util.flatten(df[c]))
+            else:
+                hashes[c] = df[c].to_numpy()
+        return pd.util.hash_pandas_object(pd.DataFrame(hashes), index=False).to_numpy()
+
+    def load_errors(self, path):
+        """The rows of an error table as strings, by utterance."""
+        if path.endswith('.parquet'):
+            # the ix is the index of parquet tables
+            df = pd.read_parquet(path).reset_index()
+            df = df.astype(object).where(df.notna(), '').astype(str)
+        else:
+            df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        rows = df[TError.get_columns()].to_numpy().tolist()
+        result = dict()
+        for row in rows:
+            result.setdefault(row[0].rsplit('#', 1)[0], list()).append(row)
+        return result
+
+    def load_ids(self, projdir, prefix):
+        """The token table of the utterance table of a model table, if it was saved."""
+        path = vocab.table_path(os.path.dirname(os.path.abspath(projdir)), prefix + '.ctm.csv')
+        if not os.path.exists(path):
+            print('No token table {}, parsing the sentences'.format(path))
+            return None
+        return vocab.TokenTable.load(path)
 
+    def with_sents(self, chunks, table):
+        """Pairs each chunk with its sentences from the token table, as flattened lists."""
+        start = 0
+        for df in chunks:
+            if table is None:
+                yield df, dict()
+                continue
+            end = start + len(df)
+            if not np.array_equal(np.asarray(df.index, dtype=str), table.index[start:end]):
+                raise ValueError('The token table does not match the model table '
+                                 'at rows {} to {}'.format(start, end))
+            sents = dict()
+            for c in self.SENTS:
+                ids, starts, lengths = table.rows(c, start, end)
+                sents[c] = (table.tokens[ids], starts, lengths)
+            start = end
+            yield df, sents
+
+    def get_errors(self, df, sents=None):
+        """Extracts the errors of every sentence at once.
+
+        Annotations are flattened into one array, the hyp/ref word offsets
+        are cumulative sums over the I/D masks and the contraction offsets
+        come from the cont_tag_gloss arrays, so token/pos/shape/prob/cprob
+        are gathered in bulk. Returns the rows of the error table.
+        """
+        ann, starts, lengths = util.flatten(df['annotation'])
+        rows = np.repeat(np.arange(len(df)), lengths)
+        j = np.arange(len(ann)) - starts[rows]
+
+        hyp_step = ann != 'D'
+        ref_step = ann != 'I'
+        hyp_count = util.offsets(hyp_step, starts, rows)
+        ref_count = util.offsets(ref_step, starts, rows)
+        sen_len = util.counts(ref_step, starts, lengths)[rows]
+
+        # since TAG has tokenized contractions, skip those
+        hyp_ccount = self.get_cont_counts(df['hyp_cont_tag_gloss'], rows, hyp_step, hyp_count)
+        ref_ccount = self.get_cont_counts(df['ref_cont_tag_gloss'], rows, ref_step, ref_count)
+
+        errors = np.flatnonzero(np.isin(ann, self.ERRORS))
+        rows, j, atype = rows[errors], j[errors], ann[errors]
+        hyp = self.extract_src(df, 'hyp', rows, j, hyp_count[errors],
+                               hyp_ccount[errors], atype != 'D', sents)
+        ref = self.extract_src(df, 'ref', rows, j, ref_count[errors],
+                               ref_ccount[errors], atype != 'I', sents)
+
+        # position info
+        names = [util.utterance_name(ix) + "#" for ix in df.index]
+        ix = [names[r] + str(x) for r, x in zip(rows.tolist(), j.tolist())]
+        position = (ref_count[errors] + 1).tolist()
+        sen_len = sen_len[errors].tolist()
+        return zip(ix, atype.astype(str).tolist(), map(str, position),
+                   map(str, sen_len), *hyp, *ref)
+
+    def get_cont_counts(self, gloss, rows, step, count):
+        """Gets the contraction offset of each word.
+
+        A gloss of 1 marks a contraction token, which is skipped once per
+        word: in a run of 1s every other token is skipped, starting with
+        the first.
+        """
+        values, starts, lengths = util.flatten(gloss)
+        cont = values == 1
+        ix = np.arange(len(values))
+
+        # last token before each position that is not a contraction,
+        # each list starts after a virtual one
+        last = np.where(cont, -1, ix)
+        first = starts[lengths > 0]
+        last[first] = np.where(cont[first], first - 1, first)
+        last = np.maximum.accumulate(last) if len(last) else last
+        skipped = cont & ((ix - last - 1) % 2 == 0)
+
+        # the kth word is at the kth token kept, counting on past the end
+        kept = ~skipped
+        kept_ix = np.flatnonzero(kept)
+        kept_before = util.offsets(kept, starts, np.repeat(np.arange(len(starts)), lengths))
+        nkept = util.counts(kept, starts, lengths)
+        kept_start = np.zeros(len(starts), dtype=np.int64)
+        np.cumsum(nkept[:-1], out=kept_start[1:])
+
+        r = rows[step]
+        k = count[step]
+        inside = k < nkept[r]
+        ccount = lengths[r] + k - nkept[r]
+        ccount[inside] = kept_ix[kept_start[r[inside]] + k[inside]] - starts[r[inside]]
+
+        # the gloss is read before skipping, past its end is an error
+        before = ccount - 1
+        was_skipped = (before >= 0) & (before < lengths[r])
+        was_skipped[was_skipped] = skipped[starts[r[was_skipped]] + before[was_skipped]]
+        read = np.where(was_skipped, before, ccount)
+        short = np.flatnonzero(read >= lengths[r])
+        if len(short):
+            util.catch_index_error(gloss.index[r[short[0]]], gloss.name)
+            raise IndexError('{} is too short'.format(gloss.name))
+
+        result = np.zeros(len(rows), dtype=np.int64)
+        result[step] = ccount
         return result
 
-    def extract_errors(self, ix, row):
-        errors = list()
-        i = util.Counter()
-        ann = row['annotation']
-
-        for j in range(len(ann)):
-            try:
-                atype = ann[j]
-            except IndexError:
-                util.catch_index_error(ann, j)
-                raise
-
-            # since TAG has tokenized contractions, skip those
-            i.itercont(row, atype)
-
-            if atype in self.ERRORS:
-                e = TError(util.ix_name(ix, j))
-
-                # source-specific information
-                e.annotation = atype
-                if atype != 'D':
-                    e.hyp = self.extract_src(row, i, label='hyp')
-                if atype != 'I':
-                    e.ref = self.extract_src(row, i, label='ref')
-
-                # position info
-                e.position = i.ref + 1
-                e.sen_len = len([x for x in ann if x != 'I'])
-
-                errors.append(e)
-            i.iterall(atype)
-        return errors
-
-    def extract_src(self, row, i, label=None):
-        if label == 'hyp':
-            count = i.hyp
-            ccount = i.hyp_cont
-        if label == 'ref':
-            count = i.ref
-            ccount = i.ref_cont
-
-        se = SError()
-        try:
-            se.token = row[label + '_sent'][i.ix]
-            se.pos = row[label + '_tag'][ccount]
-            se.shape = row[label + '_shape'][ccount]
-            se.prob = row[label + '_prob'][count]
-            se.cprob = row[label + '_cprob'][count]
-        except IndexError:
-            util.catch_index_error(row, vars(i))
-        return se
+    def extract_src(self, df, label, rows, j, count, ccount, mask, sents=None):
+        """Gathers the source-specific columns of the errors.
+
+        Fields are filled in order and stop at the first index out of range.
+        Flattened columns in sents are used instead of those of df.
+        """
+        fields = [(label + '_sent', j), (label + '_tag', ccount),
+                  (label + '_shape', ccount), (label + '_prob', count),
+                  (label + '_cprob', count)]
+        result = list()
+        valid = mask.copy()
+        for column, index in fields:
+            values, starts, lengths = sents[column] if sents and column in sents \
+                else util.flatten(df[column])
+            valid &= index < lengths[rows]
+            temp = np.full(len(rows), '', dtype=object)
+            temp[valid] = values[starts[rows[valid]] + index[valid]]
+            result.append(temp.astype(str).tolist())
+
+        partial = np.flatnonzero(mask & ~valid)
+        for e in partial:
+            util.catch_index_error(df.index[rows[e]], label, j[e])
+        return result
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Given utterance infos, \
                                      generate csvs with error-specific info.")
     parser.add_argument("projdir", type=str, help="Project directory path")
+    parser.add_argument("--format", type=str, default='csv', choices=util.FORMATS,
+                        help="Table format of the model and error tables")
+    parser.add_argument("--files", type=str, nargs='+', help="Only process these model tables")
+    parser.add_argument("--chunksize", type=int, default=10000,
+                        help="Number of utterances processed at a time")
+    parser.add_argument("--ids", action="store_true",
+                        help="Read the sentences from the token tables saved by get_utterance_table.py --ids")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only extract the errors of the utterances that changed since the last \
+                        incremental run")
     args = parser.parse_args()
-    Main(args.projdir)
+    Main(args.projdir, args.format, args.files, args.chunksize, args.ids, args.incremental)
@@ -10,84 +10,159 @@ Also generates:
 	- Hypothesis sentence
 	- Reference sentence
 	- Error annotation
+
+With --ids, the sentences are also saved as int32 token ids (see vocab.py).
+With --join, the tables of the systems scored on the same reference are also
+saved as one joined table, sharing the reference side (see joined.py).
 """
 
 import argparse
 import os
 import re
+import html
 import pandas as pd
-from bs4 import BeautifulSoup
+import util
+import vocab
+import joined
+
+
+class SgmlReader:
+	"""Incremental reader for the sclite SYSTEM/SPEAKER/PATH sgml format.
+
+	Iterating yields the speaker id, the path attributes and the word alignment
+	fields of each path, without holding the document in memory.
+	"""
+	TAG = re.compile(r"<(/?)(\w+)([^>]*)>")
+	ATTR = re.compile(r"([\w-]+)\s*=\s*\"([^\"]*)\"")
+	BODY = re.compile(r"\n(.*)\n")
+
+	def __init__(self, infile, chunk_size=1 << 16):
+		self.infile = infile
+		self.chunk_size = chunk_size
+		self.system = dict()
+
+	def __iter__(self):
+		speakerid = None
+		attrs = None
+		buffer = ''
+		for chunk in iter(lambda: self.infile.read(self.chunk_size), ''):
+			buffer += chunk
+			end = 0
+			for m in self.TAG.finditer(buffer):
+				closing, name, attr_text = m.groups()
+				name = name.lower()
+				if closing:
+					if name == 'path' and attrs is not None:
+						yield speakerid, attrs, self.parse_contents(buffer[end:m.start()])
+						attrs = None
+				elif name == 'path':
+					attrs = self.parse_attrs(attr_text)
+				elif name == 'speaker':
+					speakerid = self.parse_attrs(attr_text)['id']
+				elif name == 'system':
+					self.system = self.parse_attrs(attr_text)
+				end = m.end()
+			buffer = buffer[end:]
+
+	def parse_attrs(self, s):
+		# attribute names are case insensitive
+		return {k.lower(): html.unescape(v) for k, v in self.ATTR.findall(s)}
+
+	def parse_contents(self, s):
+		if '&' in s:
+			s = html.unescape(s)
+		if s and not s.strip():
+			s = '\n' if '\n' in s else ' '
+		result = self.BODY.sub(r"\1", s)
+		result = result.split(',')
+		result = [i.strip("\"") for i in result]
+		return result
+
 
 class Main:
 	LABELS = ['C', 'S', 'I', 'D']
+	# typed path attributes, csv keeps them as written by sclite
+	TYPES = {'word_cnt': int, 'sequence': int, 'r_t1': float, 'r_t2': float}
 
 	def __init__(self, args):
 		column_names = ['speakerid', 'word_cnt', 'filename', 'channel', 'sequence', 'r_t1', 
-								'r_t2', 'word_aux', 'raw_sent']
+								'r_t2', 'word_aux', 'raw_sent', 'annotation', 'hyp_sent', 'ref_sent']
 
-		for file in os.listdir(args.projdir):
+		self.outputs = list()
+		# reference -> system -> table, with --join
+		groups = dict()
+		for file in sorted(args.files or os.listdir(args.projdir)):
 			if file.endswith('sgml'):
 
-				# read file
+				# read file and generate dataframe
 				with open(os.path.join(args.projdir, file), 'r') as infile:
-					text = infile.read()
-				soup=BeautifulSoup(text, 'html.parser')
-			
-				# generate dataframe
-				data= self.get_structured_data(soup)
+					reader = SgmlReader(infile)
+					data = self.get_structured_data(reader)
 				df = pd.DataFrame.from_dict(data, orient='index', columns=column_names)
-				df['annotation'] = df['raw_sent'].apply(lambda x: self.get_annotation(x))
-				df['hyp_sent'] = df['raw_sent'].apply(lambda x: self.get_sentence(x, ftype='hyp'))
-				df['ref_sent'] = df['raw_sent'].apply(lambda x: self.get_sentence(x, ftype='ref'))
+				if args.format == 'parquet':
+					df = df.astype(self.TYPES)
 
 				# write output
-				hyp_fname = soup('system')[0].attrs['hyp_fname'].split('/')[-1]
-				df.to_csv(os.path.join(args.projdir, hyp_fname + '.csv' ))
-
-	
-	def get_structured_data(self, data):
+				hyp_fname = reader.system['hyp_fname'].split('/')[-1]
+				output = util.table_name(hyp_fname + '.csv', args.format)
+				util.write_table(df, args.projdir, output)
+				self.outputs.append(output)
+
+				# sentences as token ids, for the stages that read them
+				if args.ids:
+					path = vocab.table_path(args.projdir, output)
+					vocab.TokenTable.from_frame(df, ['hyp_sent', 'ref_sent']).save(path)
+					self.outputs.append(os.path.basename(path))
+
+				if args.join:
+					system = output[:-len(util.table_name('.ctm.csv', args.format))]
+					groups.setdefault(reader.system['ref_fname'], dict())[system] = df
+
+		for ref_fname, frames in groups.items():
+			output = joined.table_name(ref_fname, args.format)
+			util.write_table(joined.join(frames), args.projdir, output)
+			self.outputs.append(output)
+
+	def get_structured_data(self, reader):
 		results = dict()
-		for sp in data('speaker'):
-			speakerid = sp['id']
-			for x in sp('path'):
-				temp = list()
-				temp.append(speakerid)
-				d = x.attrs
-				results_key = d.pop('id')
-				for k in d.keys():
-					temp.append(d[k])
-				utterance = self.parse_contents(x.contents)
-				temp.append(utterance)
-				assert(len(temp))==9
-				results[results_key] = temp
+		for speakerid, d, utterance in reader:
+			temp = list()
+			temp.append(speakerid)
+			results_key = d.pop('id')
+			for k in d.keys():
+				temp.append(d[k])
+			temp.append(utterance)
+			assert(len(temp))==9
+			temp.append(self.get_annotation(utterance))
+			temp.append(self.get_sentence(utterance, ftype='hyp'))
+			temp.append(self.get_sentence(utterance, ftype='ref'))
+			results[results_key] = temp
 		return results
 
-
-	def parse_contents(self, s):
-		result = re.sub(r"\n(.*)\n", r"\1" , s[0])
-		result = result.split(',')
-		result = [i.strip("\"") for i in result]
-		return result
-
 	def get_annotation(self, raw_sent):
-		ann = [raw_sent[i] for i in range(0, len(raw_sent), 4)]
-		ann = [i.split(':')[-1] for i in ann]
+		# fields are eval, ref, hyp, aux, and entries are joined with ':'
+		ann = [i.split(':')[-1] for i in raw_sent[0::4]]
 		ann = [i for i in ann if i in self.LABELS]
 		return ann
 
 	def get_sentence(self, raw_sent, ftype):
 		if ftype == 'ref':
-			sent = [raw_sent[i+1] for i in range(0, len(raw_sent)-1, 4)]
+			return raw_sent[1::4]
 		elif ftype == 'hyp':
-			sent = [raw_sent[i+2] for i in range(0, len(raw_sent)-2, 4)]
-		sent = [i.strip("\"") for i in sent]
-		return sent
+			return raw_sent[2::4]
 
 
 if __name__=="__main__":
 	parser = argparse.ArgumentParser(description="Parses sgml files to csv with \
 												  1 utterance per row.")
 	parser.add_argument("projdir", type=str, help="Project directory path")
+	parser.add_argument("--format", type=str, default='csv', choices=util.FORMATS,
+						help="Table format of the utterance tables")
+	parser.add_argument("--files", type=str, nargs='+', help="Only parse these sgml files")
+	parser.add_argument("--ids", action="store_true",
+						help="Also save the sentences as token ids (.ids.npz)")
+	parser.add_argument("--join", action="store_true",
+						help="Also save the tables of each reference as one joined table (<ref>_joined)")
 	args = parser.parse_args()
 	Main(args)
 
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" joined.py
+Author: coman8@uw.edu
+
+Joins the utterance (or model) tables of the systems scored on one reference
+into one wide table, with one row per utterance.
+
+Rows are matched by a hash index on the sclite path id, speaker and time span.
+The columns every system has the same values in (the path attributes, the
+reference words and, in model tables, the reference model outputs) are kept
+once; the other columns are kept once per system, as <system>:<column>, empty
+in the rows a system does not have. The aligned ref_sent of each system, with
+blanks at its insertions, is rebuilt from the reference words and its
+annotation, so system_frame gives back the table of one system.
+"""
+
+import numpy as np
+import pandas as pd
+import util
+
+SEP = ':'
+# path id, speaker and time span
+KEY = ['speakerid', 'r_t1', 'r_t2']
+# columns of the reference side, shared when all systems agree
+SHARED = ['speakerid', 'filename', 'channel', 'sequence', 'r_t1', 'r_t2', 'word_aux',
+          'ref_tag', 'ref_shape', 'ref_cont_tag_gloss', 'ref_prob', 'ref_cprob']
+REF = 'ref_words'
+SUFFIX = '_joined.csv'
+
+
+def column(system, name):
+    return system + SEP + name
+
+
+def systems(df):
+    """The systems of a joined table, in order."""
+    return [c[:-len(SEP + 'annotation')] for c in df.columns if c.endswith(SEP + 'annotation')]
+
+
+def aligned_ref(words, annotation):
+    """The aligned ref_sent of the reference words, with a blank at each insertion."""
+    words = iter(words)
+    return ['' if a == 'I' else next(words, '') for a in annotation]
+
+
+def table_name(ref_fname, fmt='csv'):
+    """The joined table of a reference, e.g. SWBDO.stm -> SWBDO_joined.csv."""
+    return util.table_name(ref_fname.split('/')[-1].rsplit('.', 1)[0] + SUFFIX, fmt)
+
+
+def join(frames, shared=SHARED):
+    """Joins the tables of a dict of system -> table into one table.
+
+    The ref_sent and annotation cells of the tables must be lists.
+    """
+    # hash index of the path id, speaker and time span of every row
+    keys = [pd.MultiIndex.from_arrays([df.index.astype(str), df[KEY[0]].astype(str)] +
+                                      [df[c].astype(float) for c in KEY[1:]])
+            for df in frames.values()]
+    codes, uniques = keys[0].append(keys[1:]).factorize() if len(keys) > 1 else keys[0].factorize()
+    bounds = np.cumsum([0] + [len(k) for k in keys])
+    rows = {s: codes[a:b] for s, a, b in zip(frames, bounds[:-1], bounds[1:])}
+    n = len(uniques)
+
+    # the reference words replace ref_sent where they give it back
+    frames = dict(frames)
+    for system, df in frames.items():
+        if 'ref_sent' in df and 'annotation' in df:
+            words = split_ref(df['ref_sent'], df['annotation'])
+            if words is not None:
+                loc = df.columns.get_loc('ref_sent')
+                df = df.drop(columns='ref_sent')
+                df.insert(loc, REF, words)
+                frames[system] = df
+
+    names = list()
+    for df in frames.values():
+        names.extend(c for c in df.columns if c not in names)
+    shared = set(shared) | {REF}
+
+    data = dict()
+    for name in names:
+        present = [s for s in frames if name in frames[s]]
+        if name in shared and len(present) == len(frames):
+            values = place(n, [(rows[s], frames[s][name]) for s in present])
+            if values is not None:
+                data[name] = values
+                continue
+        for s in present:
+            data[column(s, name)] = place(n, [(rows[s], frames[s][name])])
+
+    result = pd.DataFrame(data, index=pd.Index(uniques.get_level_values(0), name=None))
+    return result.infer_objects()
+
+
+def split_ref(ref_sent, annotation):
+    """The reference words of each aligned ref_sent, or None if they do not give it back."""
+    ann, starts, lengths = util.flatten(annotation)
+    ref, _, ref_lengths = util.flatten(ref_sent)
+    inserted = ann == 'I'
+    if (lengths != ref_lengths).any() or (ref[inserted] != '').any():
+        return None
+    words = ref[~inserted].tolist()
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(util.counts(~inserted, starts, lengths), out=offsets[1:])
+    return [words[a:b] for a, b in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def place(n, parts):
+    """Places the values of each (rows, values) part in one column of n rows.
+
+    Returns None when two parts have different values in a row.
+    """
+    result = np.empty(n, dtype=object)
+    filled = np.zeros(n, dtype=bool)
+    for rows, values in parts:
+        values = values.tolist()
+        seen = filled[rows]
+        if seen.any():
+            old = result[rows[seen]].tolist()
+            new = [v for v, s in zip(values, seen.tolist()) if s]
+            try:
+                equal = old == new
+            except ValueError:
+                # cells of parquet lists are arrays
+                equal = False
+            if not equal and any(not same(a, b) for a, b in zip(old, new)):
+                return None
+        for r, v in zip(rows.tolist(), values):
+            result[r] = v
+        filled[rows] = True
+    return result
+
+
+def same(a, b):
+    if isinstance(a, (list, np.ndarray)) or isinstance(b, (list, np.ndarray)):
+        return list(a) == list(b)
+    return a == b or (a != a and b != b)
+
+
+def parse(x):
+    # list cells of csv tables are read as strings
+    return util.parse_cell(x) if isinstance(x, str) else x
+
+
+def system_frame(df, system):
+    """The table of one system of a joined table, with its aligned ref_sent."""
+    annotation = column(system, 'annotation')
+    keep = df[annotation].notna()
+    data = dict()
+    for name in df.columns:
+        s, sep, base = name.rpartition(SEP)
+        if sep and s != system:
+            continue
+        if base == REF:
+            data['ref_sent'] = [aligned_ref(parse(w), parse(a)) for w, a in
+                                zip(df.loc[keep, name], df.loc[keep, annotation])]
+        else:
+            data[base] = df.loc[keep, name]
+    return pd.DataFrame(data, index=df.index[keep]).infer_objects()
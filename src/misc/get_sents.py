@@ -1,47 +1,82 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-""" token_freq_stats.py
+""" get_sents.py
 Author: coman8@uw.edu
 
 Makes text files of the hypothesis and reference sentences for downstream processing
+
+The utterance table is read in chunks of rows, and both sentence files are
+written as the chunks are read. With --ids, the sentences are decoded from the
+token table of the utterance table instead (see vocab.py).
 """
 
 import argparse
 import os
+import sys
 import pandas as pd
-from ast import literal_eval
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import util
+import vocab
+
 
 class Main:
 
+	COLUMNS = ['hyp_sent', 'ref_sent']
+
 	def __init__(self, args):
-		#load file
+		suffix = '.ctm.' + args.format
 		for file in os.listdir(args.projdir):
-			if file.endswith('.ctm.csv'):
+			if file.endswith(suffix):
 				print('Loaded: {}'.format(file))
 				infile = os.path.join(args.projdir, file)
-				df = pd.read_csv(infile, index_col=0)
-				
-				output = os.path.join(args.projdir, file[:-8])
-				
-				self.get_sent_txt(df['hyp_sent'], output + '_hyp.txt')
-				self.get_sent_txt(df['ref_sent'], output + '_ref.txt')
-				
-	def get_sent_txt(self, series, outfile):
-		result = series.apply(lambda x: literal_eval(x))
-		result =  result.tolist()
-		for i in range(len(result)):
-			result[i] = [x for x in result[i] if x]
-			if not result[i]:
-				result[i].append('%empty_sent')
-		result = [' '.join(x) for x in result]
-		
-		with open(outfile, 'w+') as out:
-			for r in result:
-				out.write(r + '\n')
+				output = os.path.join(args.projdir, file[:-len(suffix)])
+
+				with open(output + '_hyp.txt', 'w+') as hyp, open(output + '_ref.txt', 'w+') as ref:
+					ids = vocab.table_path(args.projdir, file)
+					if args.ids and os.path.exists(ids):
+						chunks = self.read_ids(ids, args.chunksize)
+					else:
+						chunks = self.read_chunks(infile, args.format, args.chunksize)
+					for chunk in chunks:
+						self.write_sents(chunk['hyp_sent'], hyp)
+						self.write_sents(chunk['ref_sent'], ref)
+
+	def read_chunks(self, infile, fmt, chunksize):
+		"""Yields the sentence columns of the table, chunksize rows at a time, as lists."""
+		if fmt == 'parquet':
+			import pyarrow.parquet as pq
+			for batch in pq.ParquetFile(infile).iter_batches(batch_size=chunksize, columns=self.COLUMNS):
+				yield {c: batch.column(c).to_pylist() for c in self.COLUMNS}
+		else:
+			reader = pd.read_csv(infile, usecols=self.COLUMNS, dtype=str,
+								 keep_default_na=False, chunksize=chunksize)
+			for chunk in reader:
+				yield {c: [util.parse_list(x) for x in chunk[c]] for c in self.COLUMNS}
+
+	def read_ids(self, path, chunksize):
+		"""Yields the sentence columns of a token table, chunksize rows at a time, as lists."""
+		table = vocab.TokenTable.load(path)
+		for start in range(0, len(table.index), chunksize):
+			end = min(start + chunksize, len(table.index))
+			yield {c: table.sents(c, start, end, skip=('',)) for c in self.COLUMNS}
+
+	def write_sents(self, sents, out):
+		for sent in sents:
+			words = [x for x in sent if x]
+			out.write(' '.join(words) if words else '%empty_sent')
+			out.write('\n')
+
 
 if __name__=="__main__":
 	parser = argparse.ArgumentParser(description="Produces both sentence alternatives as .txt files for downstream modeling.")
 	parser.add_argument("projdir", type=str, help="Project directory path")
+	parser.add_argument("--format", type=str, default='csv', choices=['csv', 'parquet'],
+						help="Table format of the utterance tables")
+	parser.add_argument("--ids", action="store_true",
+						help="Read the sentences from the token tables (.ids.npz) where there are some")
+	parser.add_argument("--chunksize", type=int, default=10000,
+						help="Number of utterances read at a time")
 	args = parser.parse_args()
 	Main(args)
@@ -1,79 +1,154 @@
 """
 A script to get a vocabulary file for a stm or ctm formatted text.
+
+Files are counted in parallel, each as a stream, and the counts are merged
+into a sparse token by file matrix, written as the .vocab table in one pass.
+CTM words are counted as ids over windows of the mapped file (see readers.py).
 """
 
 import argparse
 import os
 import re
-from collections import defaultdict
-import pandas as pd
+import sys
+from collections import Counter
+from multiprocessing import Pool
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import readers
+
+# a reference alternation is counted as its first alternative when that is a
+# single token, e.g. { th / @ }, any other token is counted as is
+TOKEN = re.compile(r"{\s([-|\w|\']+)\s\/[^}]+}|\S+")
+EXAMPLES = 3
+
+
+def count_stm(infile):
+	"""Counts the transcript tokens of an STM, with the lines of unresolved alternations."""
+	vocab = Counter()
+	unresolved = list()
+	for line in infile:
+		sent = line.rstrip("\n").rsplit("\t", 1)[-1]
+		tokens = [m.group(1) or m.group(0) for m in TOKEN.finditer(sent)]
+		vocab.update(tokens)
+		if "{" in tokens:
+			unresolved.append(sent)
+	return vocab, unresolved
+
+
+def count_ctm(infile):
+	"""Counts the word tokens of a CTM."""
+	vocab = Counter()
+	for line in infile:
+		fields = line.split()
+		if len(fields) > 4 and not line.startswith(";;"):
+			vocab[fields[4]] += 1
+	return vocab, []
+
+
+def count_ctm_tables(tables):
+	"""Counts the word tokens of the windows of a mapped CTM."""
+	vocab = Counter()
+	for table in tables:
+		keep = (table.nfields > 4) & ~table.comment
+		keep[table.owned:] = False
+		counts = np.bincount(table.words[keep], minlength=len(table.vocab))
+		vocab.update({t: int(c) for t, c in zip(table.vocab.tokens, counts) if c})
+	return vocab, []
+
+
+def count_file(path):
+	if path.endswith(".ctm"):
+		try:
+			return count_ctm_tables(readers.CtmTable.windows(path))
+		except readers.Irregular:
+			pass
+	with open(path, 'r') as infile:
+		if path.endswith(".stm"):
+			return count_stm(infile)
+		return count_ctm(infile)
 
 
 class Main:
 
 	def __init__(self, args):
-		result = list()
-
 		if args.ftype=="CH":
 			labels = ['callhome', 'CH']
 		else:
 			labels = ['swb', 'SWBD']
 
+		# vocabulary files, the reference first
+		files = sorted(f for f in os.listdir(args.indir) if f.endswith("O.stm") and labels[1] in f)
+		files += sorted(f for f in os.listdir(args.indir) if f.endswith(".ctm") and labels[0] in f)
+		paths = [os.path.join(args.indir, f) for f in files]
+
 		# make vocabulary for each file
-		for file in os.listdir(args.indir):
-			if file.endswith(".ctm") and labels[0] in file:
-				temp = self.get_voc(os.path.join(args.indir, file), "ctm")
-				result.append((file, temp))
-			if file.endswith("O.stm") and labels[1] in file:
-				temp = self.get_voc(os.path.join(args.indir, file), "stm")
-				result.append((file, temp))
-
-		# get total vocabulary
-		all_tokens = set()
-		for _, v in result:
-			all_tokens.update(v.keys())
-
-		# add vocabulary to frequency table
-		df = pd.DataFrame(index=sorted(list(all_tokens)))
-		for column, v in result:
-			temp = pd.Series(v)
-			df[column] = temp
-
-		# print frequency table
-		df = self.sort_freq(df, labels[1] + 'O.stm')
-		df.to_csv(os.path.join(args.indir, labels[1] + '.vocab'), sep='\t')
-
-
-	def get_voc(self, infile, dtype):
-		vocab = defaultdict(int)
-
-		if dtype == "stm":
-			df = pd.read_csv(infile, sep='\t')
-			sents = df.iloc[:,-1].tolist()
-			for s in sents:
-				s = re.sub(r"{(\s[-|\w|\']+\s)\/[^}]+}", r"\1", s)
-				if "{" in s:
-					print(s)
-				s = s.split()
-				for t in s:
-					vocab[t] += 1
+		if args.jobs > 1:
+			with Pool(args.jobs) as pool:
+				counts = pool.map(count_file, paths)
 		else:
-			df = pd.read_csv(infile, sep=' ')
-			toks = df.iloc[:, 4].tolist()
-			for t in toks:
-				vocab[t] += 1
-
-		return vocab
-
-
-	def sort_freq(self, df, colname):
-		return df.sort_values(colname, ascending=False)
+			counts = list(map(count_file, paths))
+
+		tokens, matrix = self.merge([c for c, _ in counts])
+		for file, (vocab, unresolved) in zip(files, counts):
+			self.report(file, vocab, unresolved)
+
+		# write frequency table, sorted by the reference counts
+		sort_col = files.index(labels[1] + 'O.stm') if labels[1] + 'O.stm' in files else None
+		outfile = os.path.join(args.indir, labels[1] + '.vocab')
+		with open(outfile, 'w') as out:
+			self.write(out, files, tokens, matrix, sort_col)
+		print('Saved {} tokens in {} files to {}'.format(len(tokens), len(files), outfile))
+
+	def merge(self, vocabs):
+		"""Merges the file counts into a sparse token by file matrix.
+
+		Returns the sorted tokens and the matrix in coordinate format, as
+		(token ids, file ids, counts) sorted by token.
+		"""
+		tokens = sorted(set().union(*vocabs))
+		ids = {t: i for i, t in enumerate(tokens)}
+		rows, cols, data = list(), list(), list()
+		for j, vocab in enumerate(vocabs):
+			rows.extend(ids[t] for t in vocab)
+			cols.extend([j] * len(vocab))
+			data.extend(vocab.values())
+		rows = np.array(rows, dtype=np.int64)
+		order = np.argsort(rows, kind='stable')
+		return tokens, (rows[order], np.array(cols, dtype=np.int64)[order],
+						np.array(data, dtype=np.int64)[order])
+
+	def report(self, file, vocab, unresolved):
+		print('{}: {} tokens, {} types'.format(file, sum(vocab.values()), len(vocab)))
+		if unresolved:
+			print('  {} line(s) with unresolved alternations, e.g.:'.format(len(unresolved)))
+			for sent in unresolved[:EXAMPLES]:
+				print('    {}'.format(sent))
+
+	def write(self, out, files, tokens, matrix, sort_col):
+		rows, cols, data = matrix
+		starts = np.searchsorted(rows, np.arange(len(tokens) + 1))
+
+		# tokens by decreasing count in the sort column, missing counts last
+		order = np.arange(len(tokens))
+		if sort_col is not None:
+			key = np.full(len(tokens), -1, dtype=np.int64)
+			mask = cols == sort_col
+			key[rows[mask]] = data[mask]
+			order = np.argsort(-key, kind='stable')
+
+		out.write('\t' + '\t'.join(files) + '\n')
+		for i in order:
+			row = [''] * len(files)
+			for j, c in zip(cols[starts[i]:starts[i + 1]], data[starts[i]:starts[i + 1]]):
+				row[j] = str(c)
+			out.write(tokens[i] + '\t' + '\t'.join(row) + '\n')
 
 
 if __name__=="__main__":
 	parser = argparse.ArgumentParser(description="Get vocab and counts for transcripts.")
 	parser.add_argument("indir", type=str, help="Data dir with transcripts")
 	parser.add_argument("ftype", type=str, help="One of SWBD or CH.")
+	parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes (default is serial).")
 	args = parser.parse_args()
 	Main(args)
-
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" significance.py
+Author: coman8@uw.edu
+
+Tests whether the error rates of two systems (e.g. human and ASR) differ
+
+The utterance tables of a data directory are reduced to error counts per
+resampling unit (conversation or speaker): substitutions, deletions,
+insertions, their sum (WER), and with the error tables the errors on
+disfluent tokens, over the reference words. The systems scored on the same
+units are compared pairwise with a paired bootstrap (confidence interval of
+the difference and its p-value) and a paired permutation test (the units of
+two systems swapped at random).
+
+Resamples are drawn in batches, as matrices of unit weights or swaps, so a
+batch of every metric of every system is one matrix product. Batches have
+their own seeds and run in a process pool with --jobs, giving the same
+result for any number of jobs.
+"""
+
+import argparse
+import os
+import sys
+from itertools import combinations
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import util
+
+UNITS = {'conversation': 'filename', 'speaker': 'speakerid'}
+# metric, annotation labels it counts
+LABELS = [('wer', ['S', 'D', 'I']), ('sub', ['S']), ('del', ['D']), ('ins', ['I'])]
+# errors on disfluent tokens, counted from the error tables
+DISF = 'disf'
+COLUMNS = ['system_a', 'system_b', 'metric', 'rate_a', 'rate_b', 'diff', 'ci_low', 'ci_high',
+		   'p_bootstrap', 'p_permutation']
+
+# the counts of the group being resampled, set in each worker
+_data = None
+
+
+def set_data(data):
+	global _data
+	_data = data
+
+
+def bootstrap(task):
+	"""The rate differences of each pair and metric in a batch of bootstrap resamples."""
+	seed, size = task
+	errors, words, a, b = _data['errors'], _data['words'], _data['a'], _data['b']
+	units = words.shape[1]
+	rng = np.random.default_rng(seed)
+	# how often each unit is drawn in each resample, (size, units)
+	weights = rng.multinomial(units, np.full(units, 1.0 / units), size=size).astype(np.float64)
+	err = (weights @ errors.reshape(-1, units).T).reshape(size, *errors.shape[:2])
+	rates = err / np.maximum(weights @ words.T, 1)[:, :, None]
+	return rates[:, a] - rates[:, b]
+
+
+def permutation(task):
+	"""Counts the resamples of a batch of random swaps whose difference is as large as observed."""
+	seed, size = task
+	errors, words, a, b = _data['errors'], _data['words'], _data['a'], _data['b']
+	observed = _data['observed']
+	units = words.shape[1]
+	rng = np.random.default_rng(seed)
+	# the units whose systems are swapped in each resample, (size, units)
+	swaps = (rng.random((size, units)) < 0.5).astype(np.float64)
+	moved = (swaps @ (errors[b] - errors[a]).reshape(-1, units).T).reshape(size, len(a), -1)
+	moved_words = swaps @ (words[b] - words[a]).T
+	err_a, err_b = errors[a].sum(axis=-1), errors[b].sum(axis=-1)
+	words_a, words_b = words[a].sum(axis=-1), words[b].sum(axis=-1)
+	diff = (err_a + moved) / np.maximum(words_a + moved_words, 1)[:, :, None] \
+		- (err_b - moved) / np.maximum(words_b - moved_words, 1)[:, :, None]
+	return (np.abs(diff) >= np.abs(observed) - 1e-12).sum(axis=0)
+
+
+class Main:
+
+	def __init__(self, args):
+		self.args = args
+		suffix = util.table_name('.ctm.csv', args.format)
+		files = sorted(f for f in os.listdir(args.projdir) if f.endswith(suffix))
+		errdir = args.errdir or os.path.join(args.projdir, 'models')
+
+		counts = dict()
+		for file in files:
+			system = file[:-len(suffix)]
+			errfile = os.path.join(errdir, system + '_errors.' + args.format)
+			counts[system] = self.count(os.path.join(args.projdir, file),
+										errfile if os.path.exists(errfile) else None, UNITS[args.unit])
+
+		self.results = list()
+		for systems in self.groups(counts):
+			self.results.append(self.compare(systems, counts))
+		self.results = pd.concat(self.results, ignore_index=True) if self.results \
+			else pd.DataFrame(columns=COLUMNS)
+
+		with pd.option_context('display.width', 200, 'display.max_rows', None):
+			print(self.results.to_string(index=False, float_format='{:.4f}'.format))
+		if args.output:
+			self.results.to_csv(args.output, index=False)
+			print('Saved {}'.format(args.output))
+
+	def count(self, table, errfile, unit):
+		"""The reference words and the errors of each metric, by unit, of one utterance table."""
+		frames = list()
+		index = list()
+		for df in util.read_chunks(os.path.dirname(table), os.path.basename(table), ['annotation', unit],
+								   list_columns=['annotation']):
+			ann, starts, lengths = util.flatten(df['annotation'])
+			chunk = pd.DataFrame({'unit': df[unit].to_numpy(),
+								  'words': util.counts(ann != 'I', starts, lengths)})
+			for metric, labels in LABELS:
+				chunk[metric] = util.counts(np.isin(ann, labels), starts, lengths)
+			frames.append(chunk)
+			index.append(df.index.to_numpy())
+		df = pd.concat(frames, ignore_index=True)
+		# utterance ids without the parentheses of the table index
+		utterances = pd.Series(df['unit'].to_numpy(), index=[str(i).strip('()') for i in np.concatenate(index)])
+
+		df = df.groupby('unit')[['words'] + [m for m, _ in LABELS]].sum()
+		if errfile is not None:
+			disf = self.count_disf(errfile)
+			units = utterances.reindex(disf.index).to_numpy()
+			df[DISF] = disf.groupby(units).sum().reindex(df.index, fill_value=0)
+		return df
+
+	def count_disf(self, errfile):
+		"""The errors on disfluent tokens by utterance, as token_freq_stats.py defines them."""
+		columns = ['ix', 'annotation', 'hyp_shape', 'ref_shape']
+		if errfile.endswith('.parquet'):
+			df = pd.read_parquet(errfile, columns=columns)
+		else:
+			df = pd.read_csv(errfile, usecols=columns)
+		shape = np.where(df['annotation'] == 'D', df['ref_shape'], df['hyp_shape'])
+		utterance = df['ix'].astype(str).str.rsplit('#', n=1).str[0]
+		return pd.Series(shape == 2, index=utterance.to_numpy()).groupby(level=0).sum()
+
+	def groups(self, counts):
+		"""The systems scored on the same units, with more than one system."""
+		groups = dict()
+		for system, df in counts.items():
+			groups.setdefault(tuple(sorted(df.index)), list()).append(system)
+		for units, systems in groups.items():
+			if len(systems) > 1:
+				yield systems
+			else:
+				print('No system to compare {} with, over its {} units'.format(systems[0], len(units)))
+
+	def compare(self, systems, counts):
+		"""Tests the pairs of a group of systems, on every metric they all have."""
+		args = self.args
+		metrics = [m for m in counts[systems[0]].columns[1:] if all(m in counts[s] for s in systems)]
+		units = counts[systems[0]].index
+		# (systems, metrics, units) and (systems, units)
+		errors = np.stack([counts[s].loc[units, metrics].to_numpy(dtype=np.float64).T for s in systems])
+		words = np.stack([counts[s].loc[units, 'words'].to_numpy(dtype=np.float64) for s in systems])
+		pairs = list(combinations(range(len(systems)), 2))
+		a = np.array([i for i, _ in pairs])
+		b = np.array([j for _, j in pairs])
+
+		rates = errors.sum(axis=-1) / np.maximum(words.sum(axis=-1), 1)[:, None]
+		observed = rates[a] - rates[b]
+		data = {'errors': errors, 'words': words, 'a': a, 'b': b, 'observed': observed}
+		print('Comparing {} systems over {} {}s, {} resamples'.format(
+			len(systems), len(units), args.unit, args.resamples))
+
+		sizes = [min(args.batch, args.resamples - i) for i in range(0, args.resamples, args.batch)]
+		seeds = np.random.SeedSequence(args.seed).spawn(2 * len(sizes))
+		boot_tasks = list(zip(seeds[:len(sizes)], sizes))
+		perm_tasks = list(zip(seeds[len(sizes):], sizes))
+		if args.jobs > 1:
+			with Pool(args.jobs, initializer=set_data, initargs=(data,)) as pool:
+				diffs = pool.map(bootstrap, boot_tasks)
+				extreme = pool.map(permutation, perm_tasks)
+		else:
+			set_data(data)
+			diffs = list(map(bootstrap, boot_tasks))
+			extreme = list(map(permutation, perm_tasks))
+		diffs = np.concatenate(diffs)
+		extreme = np.sum(extreme, axis=0)
+
+		alpha = (1 - args.confidence) / 2
+		low, high = np.quantile(diffs, [alpha, 1 - alpha], axis=0)
+		# twice the smaller share of resamples on either side of zero
+		p_boot = np.minimum(1, 2 * np.minimum((diffs <= 0).mean(axis=0), (diffs >= 0).mean(axis=0)))
+		p_perm = (extreme + 1) / (args.resamples + 1)
+
+		names = np.asarray(systems, dtype=object)
+		return pd.DataFrame({
+			'system_a': np.repeat(names[a], len(metrics)),
+			'system_b': np.repeat(names[b], len(metrics)),
+			'metric': np.tile(metrics, len(pairs)),
+			'rate_a': 100 * rates[a].ravel(),
+			'rate_b': 100 * rates[b].ravel(),
+			'diff': 100 * observed.ravel(),
+			'ci_low': 100 * low.ravel(),
+			'ci_high': 100 * high.ravel(),
+			'p_bootstrap': p_boot.ravel(),
+			'p_permutation': p_perm.ravel()}, columns=COLUMNS)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Paired bootstrap and permutation tests of the error rate \
+									 differences between the systems of a data directory.")
+	parser.add_argument("projdir", type=str, help="Directory with the utterance tables")
+	parser.add_argument("--errdir", type=str, help="Directory with the error tables (default projdir/models)")
+	parser.add_argument("--format", type=str, default='csv', choices=util.FORMATS,
+						help="Table format (default csv)")
+	parser.add_argument("--unit", type=str, default='conversation', choices=sorted(UNITS),
+						help="Resampling unit (default conversation)")
+	parser.add_argument("--resamples", type=int, default=10000, help="Number of resamples of each test")
+	parser.add_argument("--batch", type=int, default=1000, help="Resamples drawn at once")
+	parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the intervals")
+	parser.add_argument("--seed", type=int, default=0, help="Random seed")
+	parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes (default is serial)")
+	parser.add_argument("--output", type=str, help="Save the results as csv")
+	args = parser.parse_args()
+	Main(args)
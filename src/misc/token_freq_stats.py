@@ -5,46 +5,136 @@
 Author: coman8@uw.edu
 
 Produces the top errors for each error category in each error set
+
+The error tables are loaded once, with the tokens as int32 ids of one shared
+vocabulary (see vocab.py), and the counts of every label, with and without
+the disfluency filter, come from one pass of integer keys. Tokens are decoded
+for the top errors only. With --outdir, both reports are saved as text, csv
+and json.
 """
 
 import argparse
+import json
 import os
+import sys
 import numpy as np
 import pandas as pd
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from vocab import Vocab, IDS
+
 
 class Main:
 	LABELS = ['I', 'D', 'S']
+	COLUMNS = ['annotation', 'hyp_token', 'ref_token', 'hyp_shape', 'ref_shape']
+	# report name of each variant, as main.sh saves them
+	REPORTS = {'all': 'freq_stats', 'disf': 'hbkac_stats'}
 
 	def __init__(self, args):
-		for file in os.listdir(args.projdir):
-			if file.endswith('_errors.csv'):
-
-				#load file
-				print('Loaded: {}'.format(file))
-				infile = os.path.join(args.projdir, file)
-				df = pd.read_csv(infile, index_col=0)
-				df = df.replace(np.nan, "", regex=True)
-				df['comb_token'] = df['hyp_token'] + '_' + df['ref_token']
-
-
-				for label in self.LABELS:
-					print('Label: {}'.format(label))
-					temp = df[df['annotation'] == label]
-					if args.disf:
-						temp = self.filter_disf(temp, label)
-					grouped = temp[['comb_token', 'annotation']].groupby('comb_token').count()
-					grouped.rename(columns={'annotation':'count'}, inplace=True)
-					grouped.sort_values('count', ascending=False, inplace=True)
-					print(grouped.head(args.top))
-					print('\n')
-
-	def filter_disf(self, df, label):
-		if label == 'D':
-			shape = 'ref_shape'
+		files, df = self.load(args.projdir, args.format)
+		counts = self.count(df)
+		tops = {'all': args.top, 'disf': args.disf_top or args.top}
+		reports = {v: self.top_errors(counts[v], files, tops[v]) for v in self.REPORTS}
+
+		if args.outdir:
+			for variant, name in self.REPORTS.items():
+				output = os.path.join(args.outdir, name)
+				with open(output + '.txt', 'w') as out:
+					self.write_text(out, files, reports[variant], tops[variant])
+				reports[variant].to_csv(output + '.csv', index=False)
+				with open(output + '.json', 'w') as out:
+					json.dump(self.to_json(files, reports[variant]), out, indent=1)
+				print('Saved {}.txt, .csv and .json'.format(output))
 		else:
-			shape = 'hyp_shape'
-		return df[df[shape]==2]
+			variant = 'disf' if args.disf else 'all'
+			self.write_text(None, files, reports[variant], tops[variant])
+
+	def load(self, projdir, fmt):
+		"""Loads the columns used from all error tables into one frame of integer codes.
+
+		Files and labels are coded by their order, tokens by their id in self.vocab.
+		"""
+		suffix = '_errors.' + fmt
+		files = sorted(f for f in os.listdir(projdir) if f.endswith(suffix))
+		self.vocab = Vocab()
+		frames = list()
+		for n, file in enumerate(files):
+			infile = os.path.join(projdir, file)
+			if fmt == 'parquet':
+				temp = pd.read_parquet(infile, columns=self.COLUMNS)
+			else:
+				temp = pd.read_csv(infile, usecols=self.COLUMNS)
+			# deletions are disfluent by their reference shape, others by their hypothesis
+			shape = np.where(temp['annotation'] == 'D', temp['ref_shape'], temp['hyp_shape'])
+			frames.append(pd.DataFrame({
+				'file': np.full(len(temp), n, dtype=np.int64),
+				'annotation': pd.Categorical(temp['annotation'], categories=self.LABELS).codes,
+				'hyp': self.encode(temp['hyp_token']),
+				'ref': self.encode(temp['ref_token']),
+				'disf': shape == 2}))
+		if not frames:
+			return files, pd.DataFrame({c: np.array([], dtype=np.int64)
+										for c in ['file', 'annotation', 'hyp', 'ref', 'disf']})
+		return files, pd.concat(frames, ignore_index=True)
+
+	def encode(self, column):
+		"""The token ids of a column, adding each distinct token to the vocabulary once."""
+		codes, uniques = pd.factorize(column.fillna(''))
+		lookup = np.fromiter((self.vocab.add(t) for t in uniques), dtype=IDS, count=len(uniques))
+		return lookup[codes]
+
+	def count(self, df):
+		"""Counts each error of each file and label, for every variant.
+
+		Each error is packed into one integer key, so counting is np.unique.
+		"""
+		df = df[df['annotation'] >= 0]
+		size = max(len(self.vocab), 1)
+		key = ((df['file'].to_numpy() * len(self.LABELS) + df['annotation'].to_numpy()) * size
+			   + df['hyp'].to_numpy()) * size + df['ref'].to_numpy()
+		disf = df['disf'].to_numpy(dtype=bool)
+		return {'all': self.unpack(*np.unique(key, return_counts=True)),
+				'disf': self.unpack(*np.unique(key[disf], return_counts=True))}
+
+	def unpack(self, key, counts):
+		size = max(len(self.vocab), 1)
+		key, ref = np.divmod(key, size)
+		key, hyp = np.divmod(key, size)
+		file, annotation = np.divmod(key, len(self.LABELS))
+		return pd.DataFrame({'file': file, 'annotation': annotation, 'hyp': hyp, 'ref': ref,
+							 'count': counts})
+
+	def top_errors(self, counts, files, top):
+		"""The top errors of each file and label, by count and then error."""
+		tokens = np.array([str(t) for t in self.vocab.tokens], dtype=object)
+		counts = counts.assign(hyp_token=tokens[counts['hyp'].to_numpy()],
+							   ref_token=tokens[counts['ref'].to_numpy()])
+		counts['comb_token'] = counts['hyp_token'] + '_' + counts['ref_token']
+		counts = counts.sort_values(['file', 'annotation', 'comb_token', 'hyp_token'])
+		largest = counts.groupby(['file', 'annotation'])['count'].nlargest(top)
+		result = counts.loc[largest.index.get_level_values(-1)]
+		result = result.assign(file=np.asarray(files, dtype=object)[result['file'].to_numpy()],
+							   annotation=np.asarray(self.LABELS, dtype=object)[result['annotation'].to_numpy()])
+		return result[['file', 'annotation', 'comb_token', 'hyp_token', 'ref_token', 'count']] \
+			.reset_index(drop=True)
+
+	def write_text(self, out, files, report, top):
+		for file in files:
+			print('Loaded: {}'.format(file), file=out)
+			for label in self.LABELS:
+				print('Label: {}'.format(label), file=out)
+				temp = report[(report['file'] == file) & (report['annotation'] == label)]
+				grouped = pd.DataFrame({'count': temp['count'].to_numpy()},
+									   index=pd.Index(temp['comb_token'].to_numpy(), name='comb_token'))
+				print(grouped.head(top), file=out)
+				print('\n', file=out)
+
+	def to_json(self, files, report):
+		result = {f: {l: list() for l in self.LABELS} for f in files}
+		for row in report.itertuples(index=False):
+			result[row.file][row.annotation].append(
+				{'hyp_token': row.hyp_token, 'ref_token': row.ref_token, 'count': int(row.count)})
+		return result
 
 
 if __name__=="__main__":
@@ -52,5 +142,11 @@ if __name__=="__main__":
 	parser.add_argument("projdir", type=str, help="Project directory path")
 	parser.add_argument("--top", type=int, default=30, help="Number of top errors to display")
 	parser.add_argument("--disf", type=bool, default=False, help="Get disfluency information only")
+	parser.add_argument("--disf-top", type=int,
+						help="Number of top disfluency errors to save with --outdir (default is --top)")
+	parser.add_argument("--outdir", type=str,
+						help="Save both reports here as text, csv and json, instead of printing one")
+	parser.add_argument("--format", type=str, default='csv', choices=['csv', 'parquet'],
+						help="Table format of the error tables")
 	args = parser.parse_args()
 	Main(args)
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" pipeline.py
+Author: coman8@uw.edu
+
+Runs the preprocess.sh and main.sh stages as a dependency graph, with a
+content-addressed cache.
+
+Each stage runs per file (per datatype for the references, and once for the
+frequency reports). A stage starts once the stages it reads from are done, so
+independent stages (the SWBD and CH references, the hypotheses and the sclite
+sgml) run side by side on a pool of worker processes. A unit is skipped when
+the hash of its inputs, parameters and scripts matches a cached run, whose
+outputs are restored instead.
+
+The stage timings and statuses of the last run are saved in the cache, and
+--resume runs again from the stages that failed or were skipped. sclite is
+still run separately, between preprocessing and the utterance tables.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from argparse import Namespace
+from collections import namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import util
+import preprocess_ref
+import preprocess_hyp
+import token_rules
+import readers
+import get_utterance_table
+import gather
+import get_error_table
+import vocab
+from cache import StageCache
+from misc import token_freq_stats, significance
+
+DATATYPES = ['SWBD', 'CH']
+
+# name, stages whose outputs it reads
+STAGES = [
+    ('preprocess_ref', []),
+    ('preprocess_hyp', []),
+    ('get_utterance_table', []),
+    ('gather', ['get_utterance_table']),
+    ('get_error_table', ['gather']),
+    ('token_freq_stats', ['get_error_table']),
+    ('significance', ['get_utterance_table', 'get_error_table']),
+]
+# the stages of each shell script
+GROUPS = {'preprocess': ['preprocess_ref', 'preprocess_hyp'],
+          'main': ['get_utterance_table', 'gather', 'get_error_table', 'token_freq_stats']}
+STATE = 'pipeline.json'
+
+# a unit of work of a stage, outputs is None when the task returns them
+Unit = namedtuple('Unit', ['stage', 'name', 'params', 'inputs', 'modules', 'ns', 'outputs'])
+
+
+def sources(*modules):
+    return [os.path.abspath(m.__file__) for m in modules] + [os.path.abspath(util.__file__)]
+
+
+def run_preprocess_ref(ns):
+    # the transcript rules read the module arguments
+    preprocess_ref.set_args(ns)
+    preprocess_ref.Main(ns)
+
+
+def run_get_utterance_table(ns):
+    m = get_utterance_table.Main(ns)
+    return [os.path.join(ns.projdir, o) for o in m.outputs]
+
+
+TASKS = {'preprocess_ref': run_preprocess_ref,
+         'preprocess_hyp': preprocess_hyp.Main,
+         'get_utterance_table': run_get_utterance_table,
+         'gather': lambda ns: gather.Main(ns.datadir, ns.format, ns.files),
+         'get_error_table': lambda ns: get_error_table.Main(ns.projdir, ns.format, ns.files, ids=ns.ids,
+                                                            incremental=True),
+         'token_freq_stats': token_freq_stats.Main,
+         'significance': significance.Main}
+
+
+def execute(stage, ns):
+    """Runs one unit, in a worker process, returns its task result and wall time."""
+    start = time.perf_counter()
+    try:
+        result = TASKS[stage](ns)
+    except SystemExit as e:
+        # the scripts exit when they skip corrupt lines
+        raise RuntimeError('{} exited with status {}'.format(stage, e.code))
+    return result, time.perf_counter() - start
+
+
+class Main:
+
+    def __init__(self, args):
+        self.args = args
+        self.cache = StageCache(args.datadir)
+        self.modir = os.path.join(args.datadir, 'models')
+        self.state_path = os.path.join(self.cache.cachedir, STATE)
+        last = dict()
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as f:
+                last = json.load(f)['stages']
+
+        self.pool = ProcessPoolExecutor(args.jobs) if args.jobs > 1 else None
+        try:
+            state = self.schedule(self.select(args, last))
+            self.cache.evict()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+            self.cache.save()
+
+        # stages left out of this run keep their last status
+        self.report(state)
+        last.update(state['stages'])
+        with open(self.state_path, 'w') as f:
+            json.dump({'stages': last, 'failed': state['failed']}, f, indent=1)
+        if state['failed']:
+            sys.exit(1)
+
+    def select(self, args, last):
+        """The stages to run, by name or group, without those done in the last run with --resume."""
+        names = [s for n in args.stages or ['preprocess', 'main'] for s in GROUPS.get(n, [n])]
+        if args.resume:
+            names = [n for n in names if last.get(n, {}).get('status') != 'done']
+        return [n for n, _ in STAGES if n in names]
+
+    def schedule(self, names):
+        """Runs the units of the stages, each stage once the stages it reads from are done."""
+        requires = {n: [r for r in reqs if r in names] for n, reqs in STAGES if n in names}
+        self.stages = stages = {n: {'status': 'waiting', 'units': 0, 'cached': 0, 'failed': 0,
+                                    'seconds': 0.0, 'unit_seconds': 0.0} for n in names}
+        self.started = dict()
+        self.running = dict()
+        self.failed = list()
+
+        while True:
+            for name in names:
+                stage = stages[name]
+                if stage['status'] != 'waiting':
+                    continue
+                status = [stages[r]['status'] for r in requires[name]]
+                if any(s in ('failed', 'skipped') for s in status):
+                    stage['status'] = 'skipped'
+                elif all(s == 'done' for s in status):
+                    # the stage closes once its units are all started and finished
+                    self.started[name] = time.perf_counter()
+                    stage['status'] = 'starting'
+                    for unit in getattr(self, name)():
+                        self.start(unit, stage)
+                    stage['status'] = 'running'
+                    self.finish(name, stage)
+
+            if not self.running:
+                break
+            done, _ = wait(self.running, return_when=FIRST_COMPLETED)
+            for future in done:
+                self.collect(future)
+
+        return {'stages': stages, 'failed': self.failed}
+
+    def start(self, unit, stage):
+        """Restores a unit from the cache, or submits it to the pool."""
+        stage['units'] += 1
+        name = unit.stage + ':' + unit.name
+        key = self.cache.key(unit.stage, unit.params, unit.inputs, sources(*unit.modules))
+        if not self.args.force and self.cache.fetch(name, key) is not None:
+            print('Cached: {}'.format(name))
+            stage['cached'] += 1
+            return
+        print('Running: {}'.format(name))
+        if self.pool is not None:
+            # forked workers would print the pending output again
+            sys.stdout.flush()
+            self.running[self.pool.submit(execute, unit.stage, unit.ns)] = (unit, key)
+            return
+
+        future = Future()
+        try:
+            future.set_result(execute(unit.stage, unit.ns))
+        except Exception as e:
+            future.set_exception(e)
+        self.running[future] = (unit, key)
+        self.collect(future)
+
+    def collect(self, future):
+        """Stores the outputs of a finished unit in the cache, or records its failure."""
+        unit, key = self.running.pop(future)
+        stage = self.stages[unit.stage]
+        try:
+            result, seconds = future.result()
+        except Exception as e:
+            print('Failed: {}:{}: {}'.format(unit.stage, unit.name, e))
+            self.failed.append({'unit': unit.stage + ':' + unit.name, 'error': str(e)})
+            stage['failed'] += 1
+        else:
+            self.cache.store(unit.stage + ':' + unit.name, key,
+                             result if unit.outputs is None else unit.outputs)
+            stage['unit_seconds'] += seconds
+        self.finish(unit.stage, stage)
+
+    def finish(self, name, stage):
+        """Closes a stage when none of its units are running."""
+        if stage['status'] != 'running' or any(u.stage == name for u, _ in self.running.values()):
+            return
+        stage['status'] = 'failed' if stage['failed'] else 'done'
+        stage['seconds'] = time.perf_counter() - self.started[name]
+
+    def report(self, state):
+        print('{:<22} {:>8} {:>6} {:>6} {:>6} {:>9} {:>9}'.format(
+            'stage', 'status', 'units', 'cached', 'failed', 'wall (s)', 'units (s)'))
+        for name, s in state['stages'].items():
+            print('{:<22} {:>8} {:>6} {:>6} {:>6} {:>9.2f} {:>9.2f}'.format(
+                name, s['status'], s['units'], s['cached'], s['failed'], s['seconds'], s['unit_seconds']))
+        if state['failed']:
+            first = next(n for n, s in state['stages'].items() if s['status'] == 'failed')
+            print('{} unit(s) failed, run again with --resume to resume from {}'.format(
+                len(state['failed']), first))
+
+    def preprocess_ref(self):
+        a = self.args
+        if not a.refdir:
+            return
+        for datatype in DATATYPES:
+            prefix = preprocess_ref.get_prefix(datatype)
+            inputs = [os.path.join(a.refdir, f) for f in os.listdir(a.refdir) if f.startswith(prefix)]
+            if not inputs:
+                continue
+            ns = Namespace(indir=a.refdir, outdir=a.datadir, datatype=datatype, cont=a.cont,
+                           disf=a.disf, jobs=1, profile_rules=None)
+            yield Unit('preprocess_ref', datatype, {'cont': a.cont, 'disf': a.disf}, inputs,
+                       [preprocess_ref, token_rules, util], ns, [os.path.join(a.datadir, datatype + 'O.stm')])
+
+    def preprocess_hyp(self):
+        a = self.args
+        if not a.hypdir:
+            return
+        for file in sorted(os.listdir(a.hypdir)):
+            if file.endswith('.ctm'):
+                ns = Namespace(indir=a.hypdir, outdir=a.datadir, disf=a.disf, jobs=1, files=[file],
+                               profile_rules=None)
+                yield Unit('preprocess_hyp', file, {'disf': a.disf}, [os.path.join(a.hypdir, file)],
+                           [preprocess_hyp, token_rules, readers, vocab, util], ns,
+                           [os.path.join(a.datadir, file[:-4] + '_processed.ctm')])
+
+    def get_utterance_table(self):
+        a = self.args
+        for file in sorted(os.listdir(a.datadir)):
+            if file.endswith('sgml'):
+                ns = Namespace(projdir=a.datadir, format=a.format, files=[file], ids=a.ids, join=False)
+                yield Unit('get_utterance_table', file, {'format': a.format, 'ids': a.ids},
+                           [os.path.join(a.datadir, file)], [get_utterance_table, vocab], ns, None)
+
+    def gather(self):
+        a = self.args
+        if not os.path.isdir(self.modir):
+            return
+        suffix = util.table_name('.ctm.csv', a.format)
+        for file in sorted(os.listdir(a.datadir)):
+            if file.endswith(suffix):
+                prefix = file[:-len(suffix)]
+                models = [os.path.join(self.modir, prefix + '_' + s + e)
+                          for s in gather.Main.SOURCES for e in ['.tag', '.uni', '.gru']]
+                if not all(os.path.exists(m) for m in models):
+                    print('Missing model outputs for {}'.format(file))
+                    continue
+                ns = Namespace(datadir=a.datadir, format=a.format, files=[file])
+                yield Unit('gather', file, {'format': a.format},
+                           [os.path.join(a.datadir, file)] + models, [gather], ns,
+                           [os.path.join(self.modir, util.table_name(prefix + '.all', a.format))])
+
+    def get_error_table(self):
+        a = self.args
+        if not os.path.isdir(self.modir):
+            return
+        suffix = util.table_name('.all', a.format)
+        for file in sorted(os.listdir(self.modir)):
+            if file.endswith(suffix):
+                output = util.table_name(file[:-len(suffix)] + '_errors.csv', a.format)
+                inputs = [os.path.join(self.modir, file)]
+                ids = vocab.table_path(a.datadir, file[:-len(suffix)] + '.ctm.csv')
+                if a.ids and os.path.exists(ids):
+                    inputs.append(ids)
+                ns = Namespace(projdir=self.modir, format=a.format, files=[file], ids=a.ids)
+                # the fingerprints let a changed model table be extracted incrementally
+                fingerprints = os.path.splitext(output)[0] + get_error_table.FINGERPRINTS
+                yield Unit('get_error_table', file, {'format': a.format, 'ids': a.ids},
+                           inputs, [get_error_table, vocab], ns,
+                           [os.path.join(self.modir, o) for o in [output, fingerprints]])
+
+    def token_freq_stats(self):
+        a = self.args
+        if not os.path.isdir(self.modir):
+            return
+        suffix = '_errors.' + a.format
+        inputs = [os.path.join(self.modir, f) for f in os.listdir(self.modir) if f.endswith(suffix)]
+        ns = Namespace(projdir=self.modir, top=50, disf_top=30, disf=False, format=a.format,
+                       outdir=a.datadir)
+        outputs = [os.path.join(a.datadir, name + ext)
+                   for name in token_freq_stats.Main.REPORTS.values() for ext in ['.txt', '.csv', '.json']]
+        yield Unit('token_freq_stats', 'reports', {'top': ns.top, 'disf_top': ns.disf_top, 'format': a.format},
+                   inputs, [token_freq_stats], ns, outputs)
+
+    def significance(self):
+        a = self.args
+        suffix = util.table_name('.ctm.csv', a.format)
+        inputs = [os.path.join(a.datadir, f) for f in sorted(os.listdir(a.datadir)) if f.endswith(suffix)]
+        if os.path.isdir(self.modir):
+            inputs += [os.path.join(self.modir, f) for f in sorted(os.listdir(self.modir))
+                       if f.endswith('_errors.' + a.format)]
+        ns = Namespace(projdir=a.datadir, errdir=None, format=a.format, unit='conversation',
+                       resamples=10000, batch=1000, confidence=0.95, seed=0, jobs=1,
+                       output=os.path.join(a.datadir, 'significance.csv'))
+        params = {k: getattr(ns, k) for k in ['format', 'unit', 'resamples', 'batch', 'confidence', 'seed']}
+        yield Unit('significance', 'tests', params, inputs, [significance], ns, [ns.output])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the pipeline stages as a dependency graph, skipping \
+                                     the files whose inputs and parameters are unchanged.")
+    parser.add_argument("datadir", type=str, help="Data directory, parent of the models directory")
+    parser.add_argument("--refdir", type=str, help="Directory with reference transcripts to preprocess")
+    parser.add_argument("--hypdir", type=str, help="Directory with hypothesis CTMs to preprocess")
+    parser.add_argument("--cont", action="store_true", help="Expand contractions in the references")
+    parser.add_argument("--disf", action="store_true", help="Group disfluencies in the transcripts")
+    parser.add_argument("--format", type=str, default='csv', choices=util.FORMATS,
+                        help="Table format of the utterance, model and error tables")
+    parser.add_argument("--ids", action="store_true",
+                        help="Save the sentences as token ids and extract the errors from them")
+    parser.add_argument("--stages", type=str, nargs='+',
+                        choices=sorted(GROUPS) + [n for n, _ in STAGES],
+                        help="Stages to run, or groups: preprocess (preprocess.sh) and main (main.sh). \
+                        Default is both groups, significance only runs when named")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Number of worker processes running stage units (default is serial)")
+    parser.add_argument("--force", action="store_true", help="Rerun every stage, refreshing the cache")
+    parser.add_argument("--resume", action="store_true",
+                        help="Only run the stages that failed or were skipped in the last run")
+    args = parser.parse_args()
+    Main(args)
@@ -11,118 +11,293 @@ Preprocessing code for the MSFT HUB5 human and ASR transcriptions.
 """
 
 import os
+import sys
 import argparse
+import time
+from multiprocessing import Pool
+import numpy as np
+from rule_stats import RuleStats
+import token_rules
+import util
+import readers
 
 
 class Main:
-	UPDATES = {"'bout":"about",
-			   "'cause":"because",
-			   "hmm":"hm"}
-	REDUCED = {"gonna":("going", "to"), 
-			   "wanna":("want", "to"),
-			   "kinda":("kind", "of"),
-			   "sorta":("sort", "of"),
-			   "gotta":("got", "to"),
-			   # abbrevs. to expand
-			   "hp":("h", "p"),
-			   "dj":("d", "j"),
-			   "dc":("d", "c"),
-			   "ll":("l", "l"),
-			   "cre":("c", "r", "e"),
-			   "rpm":("r", "p", "m"),
-			   "phd":("p", "h", "d"),
-			   "twa":("t", "w", "a")}
-	HESITATIONS = ["uh", "um", "eh", "hm", 
-				   "hmm", "mm", "ah", "huh", 
-				   "ha", "er", "oof", "hee", 
-				   "ach", "ee", "ew"]
-	BACKCHANNELS = ["uh-huh", "um-hum", "mhm"]
-			  
+	# the branches of clean_tokens besides the token rules
+	BRANCHES = ("hyphenation", "period")
 
 	def __init__(self, args):
-		files = os.listdir(args.indir)
-
-		for file in files:
-			if file.endswith(".ctm"):
-				processed = list()
-				with open(os.path.join(args.indir, file), 'r') as infile:
-					lines = infile.readlines()
-				i = 0
-				while i < len(lines):
-					current = lines[i].split()
-					if len(current) > 4:
-						current[4] = current[4].lower()
-						token = current[4]
-
-						# hyphenation
-						if  "-" in token and token != "uh-huh":
-							tokens = token.split("-")
-							temp = self.get_extension(current,
-													  tokens,
-													  self.get_endpoint(lines[i+1]))
-							processed.extend(temp)
-
-						# abbreviations
-						elif token in self.REDUCED:
-							temp = self.get_extension(current, 
-													  self.REDUCED[token], 
-													  self.get_endpoint(lines[i+1]))
-							processed.extend(temp)
-
-						# others (include normalize period from ASR abbreviations)
-						else:
-							if token in self.UPDATES:
-								current[4] = self.UPDATES[token]
-							if token in self.BACKCHANNELS:
-								current[4] = "%backchannel"
-							if self.match_split_backchannel(token, lines, i):
-								token = 'uh-huh'
-								current[4] = "%backchannel"
-								i += 1  # the backchannel is uh \n huh, we remove the second line
-							if args.disf and token in self.HESITATIONS:
-								current[4] = "%hesitation"
-							if token.endswith("."):
-								current[4] = token.rstrip(".")
-							processed.append(current)
-					i += 1
-
-				# write processed transcription to file
-				outfilename = file[:-4] + "_processed.ctm"
-				with open(os.path.join(args.outdir, outfilename), 'w+') as outfile:
-					for p in processed:
-						outfile.write(' '.join(p))
-						outfile.write("\n")
-
-	def match_split_backchannel(self, token, line, i):
-		if token != "uh":
-			return False
-		if i+1 > len(line)-1:
-			return False
-		next_line = line[i+1].split()[4]
-		if next_line.lower() == "huh":
-			return True
-		return False
-
-	def get_endpoint(self, line):
-		return float(line.split()[2])
-
-	def get_extension(self, arr, tokens, end):
-		timepoint = float(arr[2])
-		step = float(end - timepoint) / float(len(tokens))
-
-		# edge case where current line ends conversation
-		if step < 0:
-			timepoint -= 0.004
-			step = 0.001
-		
-		result = list()
-		for t in tokens:
-			temp = arr.copy()
-			temp[2] = "{:.3f}".format(timepoint)
-			temp[4] = t
-			timepoint += step
-			result.append(temp)
-		return result 
+		self.args = args
+		# the rule table is shared with the references, see token_rules.py
+		self.rules = token_rules.hyp_rules(args.disf)
+		files = [f for f in args.files or os.listdir(args.indir) if f.endswith(".ctm")]
+		failed = list()
+
+		# rules are profiled in a serial run
+		stats = None
+		if args.profile_rules:
+			stats = RuleStats()
+			self.profile_rules(stats)
+
+		if args.jobs > 1 and stats is None:
+			with Pool(args.jobs) as pool:
+				for temp in pool.imap(self.clean_file, files):
+					failed.extend(temp)
+		else:
+			for temp in map(self.clean_file, files):
+				failed.extend(temp)
+
+		if stats is not None:
+			stats.report()
+			stats.save(args.profile_rules)
+
+		if failed:
+			util.report_failures(failed)
+			sys.exit(1)
+
+	def clean_file(self, file):
+		"""Processes one CTM file, returns its corrupt lines.
+
+		The file is read in windows with the byte-level reader, and the lines
+		no rule changes are copied as they are. Files it cannot split like
+		text, and profiled runs, are processed as a stream of lines.
+		"""
+		failed = list()
+		inpath = os.path.join(self.args.indir, file)
+		outpath = os.path.join(self.args.outdir, file[:-4] + "_processed.ctm")
+		windows = None
+		if not self.args.profile_rules:
+			try:
+				windows = readers.CtmTable.windows(inpath)
+			except readers.Irregular:
+				pass
+
+		if windows is not None:
+			with open(outpath, 'wb') as outfile:
+				merged = False
+				for table in windows:
+					merged = self.clean_table(table, outfile, file, failed, merged)
+			return failed
+
+		with open(inpath, 'r') as infile, open(outpath, 'w+') as outfile:
+			for p in self.clean_lines(self.lookahead(infile), file, failed):
+				outfile.write(' '.join(p))
+				outfile.write("\n")
+		return failed
+
+	def clean_table(self, table, outfile, file, failed, merged=False):
+		"""Writes the processed lines a CTM table owns, copying the unchanged runs of lines.
+
+		The times of the split tokens are parsed, computed and formatted
+		together from the start and duration fields of their lines, before
+		the lines are written. merged is whether the first line was merged
+		into the line before, and the same is returned for the lookahead line.
+		"""
+		process, skip = self.changed_lines(table, merged)
+		n = table.owned
+		prev = 0
+		pieces = list()
+		# piece, line and fields, and tokens of each split line
+		splits = list()
+		for i in np.flatnonzero((process | skip)[:n]).tolist():
+			if i > prev:
+				pieces.append(table.lines(prev, i))
+			prev = i + 1
+			if skip[i]:
+				continue
+			current = table.line(i).split()
+			following = table.line(i + 1).split() if i + 1 < len(table) else None
+			try:
+				tokens, _, _ = self.clean_tokens(current, following)
+			except (IndexError, ValueError) as e:
+				failed.append((file, table.offset + i + 1, "{}: {}".format(type(e).__name__, e)))
+				continue
+			if len(tokens) > 1:
+				splits.append((len(pieces), i, current, tokens))
+				pieces.append(b'')
+			elif tokens:
+				current[4] = tokens[0]
+				pieces.append((' '.join(current) + "\n").encode('utf-8'))
+		if prev < n:
+			pieces.append(table.lines(prev, n))
+
+		if splits:
+			rows = np.array([s[1] for s in splits])
+			try:
+				starts = table.fields.floats(table.START, rows)
+				durations = table.fields.floats(table.DURATION, rows)
+			except ValueError:
+				# the corrupt times are reported by the line they are on
+				splits, starts, durations = self.split_fields(splits, file, failed, table.offset)
+				failed.sort(key=lambda f: f[1])
+			counts = np.array([len(s[3]) for s in splits], dtype=np.int64)
+			starts, durations = split_times(starts, durations, counts)
+			k = 0
+			for piece, _, current, tokens in splits:
+				lines = list()
+				for t in tokens:
+					lines.append(' '.join(current[:2] + [starts[k], durations[k], t] + current[5:]))
+					k += 1
+				pieces[piece] = ("\n".join(lines) + "\n").encode('utf-8')
+		outfile.writelines(pieces)
+		return n < len(table) and bool(skip[n])
+
+	def split_fields(self, splits, file, failed, offset=0):
+		"""The split lines whose times parse, with their starts and durations."""
+		valid, starts, durations = list(), list(), list()
+		for split in splits:
+			current = split[2]
+			try:
+				start, duration = float(current[2]), float(current[3])
+			except ValueError as e:
+				failed.append((file, offset + split[1] + 1, "{}: {}".format(type(e).__name__, e)))
+				continue
+			valid.append(split)
+			starts.append(start)
+			durations.append(duration)
+		return valid, np.array(starts, dtype=np.float64), np.array(durations, dtype=np.float64)
+
+	def changed_lines(self, table, merged=False):
+		"""Finds the lines clean_line would change, and the lines merged into the line before.
+
+		Words are looked up once per distinct word. Lines that are short, or
+		before a short line, or not joined by single spaces, are processed too.
+		merged is whether the first line was merged into the line before it.
+		"""
+		words = [w.lower() for w in table.vocab.tokens]
+		# by word id, with a last entry for the short lines (id -1)
+		changed = np.array([t != w or ("-" in t and t != "uh-huh") or t.endswith(".")
+							or self.rules.match([t], 0) is not None
+							for w, t in zip(table.vocab.tokens, words)] + [False], dtype=bool)
+		starts = np.array([self.rules.extends(t) for t in words] + [False], dtype=bool)
+
+		short = table.nfields <= 4
+		process = short | ~table.fields.normal | changed[table.words]
+		process[:-1] |= short[1:]
+		skip = np.zeros(len(table), dtype=bool)
+		if len(table):
+			skip[0] = merged
+
+		# rules of two tokens, e.g. the backchannel uh \n huh
+		for i in np.flatnonzero(starts[table.words]).tolist():
+			if skip[i] or i + 1 >= len(table) or short[i + 1]:
+				continue
+			match = self.rules.match([words[table.words[i]], words[table.words[i + 1]]], 0)
+			if match is not None and match[0] == 2:
+				process[i] = True
+				skip[i + 1] = True
+		return process, skip
+
+	def lookahead(self, infile):
+		"""Yields the line number and fields of each line, with the fields of the next line."""
+		current = None
+		n = 0
+		for n, line in enumerate(infile):
+			following = line.split()
+			if current is not None:
+				yield n, current, following
+			current = following
+		if current is not None:
+			yield n + 1, current, None
+
+	def clean_lines(self, lines, file, failed):
+		"""Yields processed CTM fields, recording corrupt lines in failed."""
+		for n, current, following in lines:
+			try:
+				processed, merged = self.clean_line(current, following)
+			except (IndexError, ValueError) as e:
+				failed.append((file, n, "{}: {}".format(type(e).__name__, e)))
+				continue
+			yield from processed
+			if merged:
+				next(lines, None)  # the backchannel is uh \n huh, we remove the second line
+
+	def clean_line(self, current, following):
+		"""Processes one line, returns its CTM fields and whether the next line was merged."""
+		tokens, merged, _ = self.clean_tokens(current, following)
+		if len(tokens) > 1:
+			return self.get_extension(current, tokens), merged
+		if not tokens:
+			return [], False
+		current[4] = tokens[0]
+		return [current], merged
+
+	def clean_tokens(self, current, following):
+		"""The output tokens of one line, whether the next line was merged into it, and the rules applied."""
+		if len(current) <= 4:
+			# blank lines and comments are skipped, other short lines are corrupt
+			if current and not current[0].startswith(";;"):
+				raise ValueError("expected 5 fields, got {}".format(len(current)))
+			return [], False, ()
+		token = current[4].lower()
+
+		# hyphenation
+		if  "-" in token and token != "uh-huh":
+			return token.split("-"), False, ("hyphenation",)
+
+		# rules of this token, or of this and the following token (split backchannels)
+		tokens = [token]
+		if following is not None and len(following) > 4 and self.rules.extends(token):
+			tokens.append(following[4].lower())
+		match = self.rules.match(tokens, 0)
+
+		# others (include normalize period from ASR abbreviations)
+		if match is None:
+			if token.endswith("."):
+				return [token.rstrip(".")], False, ("period",)
+			return [token], False, ()
+
+		# reduced forms and abbreviations are spread over the token's time,
+		# the backchannel is uh \n huh, the second line is merged
+		end, output, names = match
+		return list(output), end > 1, names
+
+	def profile_rules(self, stats):
+		"""Records the branches of clean_tokens in stats, with the time of the lines they apply to.
+
+		Hyphenation and periods are timed as branches, the token rules as one
+		branch whose rule groups are counted on their own (see rule_stats.py).
+		The substitutions are the tokens a branch replaced when it changed them.
+		"""
+		clean_tokens = self.clean_tokens
+
+		def profiled(current, following):
+			start = time.perf_counter()
+			tokens, merged, names = clean_tokens(current, following)
+			elapsed = time.perf_counter() - start
+			stats.lines += 1
+			if names:
+				replaced = [t[4].lower() for t in ([current, following] if merged else [current])]
+				subs = len(replaced) if tokens != replaced else 0
+				if names[0] in self.BRANCHES:
+					stats.add(names[0], elapsed, subs)
+				else:
+					stats.add("token_rules", elapsed, subs)
+					for rule in names:
+						stats.count("token_rules." + rule, subs)
+			return tokens, merged, names
+
+		self.clean_tokens = profiled
+
+	def get_extension(self, arr, tokens):
+		"""The CTM fields of the tokens a line is split into, over the line's own time."""
+		starts, durations = split_times(np.array([float(arr[2])]), np.array([float(arr[3])]),
+										np.array([len(tokens)]))
+		return [arr[:2] + [start, duration, t] + arr[5:] for start, duration, t in zip(starts, durations, tokens)]
+
+
+def split_times(starts, durations, counts):
+	"""The start and duration of each sub-token of tokens split in counts parts, formatted.
+
+	Each token's duration is divided evenly between its sub-tokens, in order.
+	"""
+	line = np.repeat(np.arange(len(counts)), counts)
+	offsets = np.zeros(len(counts), dtype=np.int64)
+	np.cumsum(counts[:-1], out=offsets[1:])
+	k = np.arange(len(line)) - offsets[line]
+	step = durations / counts
+	times = starts[line] + k * step[line]
+	return ["%.3f" % t for t in times.tolist()], ["%.3f" % d for d in step[line].tolist()]
 
 
 if __name__=="__main__":
@@ -131,5 +306,11 @@ if __name__=="__main__":
 	parser.add_argument("outdir", type=str, help="Directory to save new files.")
 	parser.add_argument("--disf", action="store_true",
 		help="Group disfluencies (e.g. uh, um) into a single hesitations group.")
+	parser.add_argument("--jobs", type=int, default=1,
+		help="Number of worker processes (default is serial).")
+	parser.add_argument("--files", type=str, nargs='+',
+		help="Only process these CTM files.")
+	parser.add_argument("--profile-rules", type=str, metavar="JSON",
+		help="Profile the normalization branches in a serial run, saving the report here.")
 	args = parser.parse_args()
 	Main(args)
@@ -18,9 +18,15 @@ https://mig.nist.gov/MIG_Website/tests/ctr/2000/h5_2000_v1.3.html
 """
 
 import os
+import sys
 import argparse
 import string
 import re
+from contextlib import contextmanager, nullcontext
+from multiprocessing import Pool
+from rule_stats import RuleStats
+import token_rules
+import util
 
 
 def get_prefix(datatype):
@@ -32,57 +38,80 @@ def get_prefix(datatype):
 		return None
 
 
+def compile_word(pattern):
+	"""Compiles a pattern to match within a word boundary.
+
+	The boundary is group 1, so groups in the pattern start at 2.
+	"""
+	BOW = r"((?<=\s)|(?<=^))"
+	EOW = r"((?=\s)|(?<=$))"
+	return re.compile(BOW + pattern + EOW)
+
+
 class Trans:
-	waveform = None
-	channel = None
-	speaker = None
-	begin = None
-	end = None
-	transcript = None
-
-	NORMALIZE = [('daycare', 'day care'), ('all right', 'alright'),
-				 ('every day', 'everyday'), ('anymore', 'any more'), ('into', 'in to'),
-				 ('boyscouts', 'boy scouts'), ('airflow', 'air flow'),
-				 ('Bentsy', 'Bensi'), ('Lori', 'Laurie'), ('Leigh', 'Lee'),
-				 ('Rachael', 'Rachel'), ('allen', 'alan'),
-				 ('Tricia', 'Trisha'), ('Johnny', 'Jonnie'), ('Abby', 'Abbie')]
-	HESITATIONS = ["uh", "um", "eh", "hm", "hmm", "mm", "ah", "huh",
-				   "ha", "er", "oof", "hee", "ach", "ee", "ew"]
-	FRAGMENT_HESITATIONS = ["uh-", "u-", "a-", "e-"]
-	BACKCHANNELS = ["uh-huh", "um-hum", "mhm"]
+	# one record per reference line, the waveform, channel and speaker strings
+	# are shared by all the records of a conversation
+	__slots__ = ('waveform', 'channel', 'speaker', 'begin', 'end', 'transcript')
+
 	EMPTY = "IGNORE_TIME_SEGMENT_IN_SCORING"
 
+	# rules are compiled once, the word rules shared with the hypotheses are
+	# tries over tokens (see token_rules.py), by the disf option
+	REDUCED_RULES = token_rules.ref_reduced_rules()
+	TOKEN_RULES = {disf: token_rules.ref_rules(disf) for disf in (False, True)}
+
+	# special label for noise (will match alternative pronunciations)
+	NOISE = re.compile(r"{[^}]+}")
+
+	# contraction labels
+	CONT1 = re.compile(r"<contraction e_form=\"\[[^=]+=>([^\]]+)\]\">(\S+)")
+	CONT2 = re.compile(r"<contraction e_form=\"\[[^=]+=>([^=]+)\]\[[^=]+=>([^=]+)\]\">(\S+)")
+	CONT = re.compile(r"<contraction e_form=\"(\[[^=]+=>[^=]+\])+\">")
+
+	# type-specific labels
+	GUESS = re.compile(r"([^\s]+)\[([^\]]+)]")
+	FOREIGN = re.compile(r"<[\S+]+\s([^>|=]+)>")
+
+	# various special labels, keyed by a character they require
+	LABELS = [("[", re.compile(r"\[[^\]]+\]+")),  # comment (warning: will match contractions)
+			  ("<", re.compile(r"<[^>]+>")),  # aside (warning: will match contractions)
+			  ("//", re.compile(r"//")),  # aside
+			  ("--", re.compile(r"--"))]  # interruption markers
+
+	PUNCT = str.maketrans("", "", "".join(set(string.punctuation) - {"-", "\'", "/", "{", "}", "_"}))
+	SPACES = re.compile(r"\s+")
+
+	INCOMPLETE = compile_word(r"(\S+-|-\S+)")
+	DASHED = re.compile(r"([^uh|um|\s])-(\S)")
+	YALLVE = re.compile(r"y'{ all have / all've }")
+
 	def __init__(self, waveid, line, datatype):
-		self.waveform = get_prefix(datatype) + waveid
+		self.waveform = sys.intern(get_prefix(datatype) + waveid)
 		l = line.split()
 		try:
 			self.begin = float(l[0])
 			self.end = float(l[1])
-			self.channel = l[2][:-1]
+			self.channel = sys.intern(l[2][:-1])
 			if self.channel == "B1":
 				self.channel = "B"
 			self.transcript = ' '.join(l[3:])
 		except IndexError:
-			raise("Corrupt line at file {}: {}".format(self.waveform, line))
-		self.speaker = self.waveform + "_" + self.channel
+			raise ValueError("Corrupt line at file {}: {}".format(self.waveform, line.strip()))
+		self.speaker = sys.intern(self.waveform + "_" + self.channel)
 		self.transcript = self.process_str(self.transcript, datatype)
 
 	def process_str(self, sent, datatype):
 
-		# special label for noise (will match alternative pronunciations)
-		NOISE = re.compile(r"{[^}]+}")
-		sent = NOISE.sub("", sent)
+		if "{" in sent:
+			sent = self.NOISE.sub("", sent)
 
 		# contraction label
-		if args.cont:
-			CONT1 = re.compile(r"<contraction e_form=\"\[[^=]+=>([^\]]+)\]\">(\S+)")
-			sent = CONT1.sub(r"{ \1 / \2 }", sent)
-
-			CONT2 = re.compile(r"<contraction e_form=\"\[[^=]+=>([^=]+)\]\[[^=]+=>([^=]+)\]\">(\S+)")
-			sent = CONT2.sub(r"{ \1 \2 / \3 }", sent)
-		else:
-			CONT = re.compile(r"<contraction e_form=\"(\[[^=]+=>[^=]+\])+\">")
-			sent = CONT.sub(r"", sent)
+		if "<contraction" in sent:
+			if args.cont:
+				sent = self.CONT1.sub(r"{ \1 / \2 }", sent)
+				sent = self.CONT2.sub(r"{ \1 \2 / \3 }", sent)
+			else:
+				sent = self.CONT.sub(r"", sent)
 
 		# type-specific processing
 		if datatype == "SWBD":
@@ -90,57 +119,32 @@ class Trans:
 		else:
 			sent = self.normalize_en(sent)
 
-		# various special labels
-		COMMENT = re.compile(r"\[[^\]]+\]+")  # comment (warning: will match contractions)
-		TAG = re.compile(r"<[^>]+>")  # aside (warning: will match contractions)
-		DDASH = re.compile(r"//")  # aside
-		INTERRUPT = re.compile(r"--")  # interruption markers
-
-		patterns = [COMMENT, TAG, DDASH, INTERRUPT]
-		for p in patterns:
-			sent = p.sub("", sent)
+		for c, p in self.LABELS:
+			if c in sent:
+				sent = p.sub("", sent)
 
 		# strip punctuation
-		punct_keep = {"-", "\'", "/", "{", "}", "_"}
-		punct_remove = set(string.punctuation)
-		punct_remove.difference_update(punct_keep)
-		sent = "".join(ch for ch in sent if ch not in punct_remove)
+		sent = sent.translate(self.PUNCT)
 
 		sent = sent.strip()  # leading and trailing whitespace
-		sent = re.sub(r"\s+", " ", sent)  # remove double spaces
+		sent = self.SPACES.sub(" ", sent)  # remove double spaces
 
 		# fragments
-		INCOMPLETE = re.compile(r"(\S+-|-\S+)")
-		sent = self.sub_word(INCOMPLETE, r"{ \2 / @ }", sent)
-
-		# normalize
-		for varients in self.NORMALIZE:
-			for v in varients:
-				if re.search(v, sent):
-					alt = self.get_alt(varients)
-					sent = self.sub_word(re.compile(v), alt, sent)
-					break
-
-		# disfluency related normalizations
-		sent = self.sub_word(re.compile(r"hmm"), "hm", sent)
-		sent = self.sub_word(re.compile(r"ooh"), "oh", sent)
-
-		if args.disf:
-			sent = self.sub_hesitations(sent)
-
-		# matches MSFT transcript conventions, otherwise WER is extremely high
-		sent = self.sub_word(re.compile(r"uh-huh"), r"%backchannel", sent)
-		sent = self.sub_word(re.compile(r"um-hum"), r"%backchannel", sent)
-		# according to NIST guidelines
-		sent = self.sub_word(re.compile(r"mhm"), r"%backchannel", sent)
+		if "-" in sent:
+			sent = self.INCOMPLETE.sub(r"{ \2 / @ }", sent)
+
+		# spelling alternations and disfluency related normalizations, in one pass:
+		# backchannels match MSFT transcript conventions, otherwise WER is extremely high
+		# uh-huh and um-hum, and mhm according to NIST guidelines
+		sent = self.TOKEN_RULES[args.disf].sub(sent)
 
 		# hyphenation
-		DASHED = re.compile(r"([^uh|um|\s])-(\S)")
-		sent = DASHED.sub(r"\1 \2", sent)
+		if "-" in sent:
+			sent = self.DASHED.sub(r"\1 \2", sent)
 
 		# fix segmentation fault before it happens, you'll thank yourself later
-		YALLVE = re.compile(r"y'{ all have / all've }")
-		sent = YALLVE.sub("{ you all have / y'all have / y'all've }", sent)
+		if "y'{" in sent:
+			sent = self.YALLVE.sub("{ you all have / y'all have / y'all've }", sent)
 
 		# empty sentences
 		if sent != self.EMPTY:
@@ -149,66 +153,132 @@ class Trans:
 			sent = self.EMPTY
 		return sent
 
-	def sub_word(self, pattern, replace, s):
-		"""Subs a pattern within a word boundary."""
-		BOW = re.compile(r"((?<=\s)|(?<=^))")
-		EOW = re.compile(r"((?=\s)|(?<=$))")
-		temp = "".join(x.pattern for x in [BOW, pattern, EOW])
-		return re.sub(temp, replace, s)
-
-	def sub_hesitations(self, s):
-		# tag hesitations
-		for h in self.HESITATIONS:
-			s = self.sub_word(re.compile(h), r"%hesitation", s)
-		for fh in self.FRAGMENT_HESITATIONS:
-			FRAGH = re.compile(r"({})".format(fh))
-			s = self.sub_word(FRAGH, r"\2 / %hesitation", s)
-		return s
-
 	def normalize_swbd(self, sent):
-		sent = self.sub_word(re.compile(r"gonna"), "going to", sent)
-		sent = self.sub_word(re.compile(r"wanna"), "want to", sent)
-		GUESS = re.compile(r"([^\s]+)\[([^\]]+)]")
-		sent = GUESS.sub(r"\1\2", sent)
+		sent = self.REDUCED_RULES.sub(sent)
+		if "[" in sent:
+			sent = self.GUESS.sub(r"\1\2", sent)
 		return sent
 
 	def normalize_en(self, sent):
-		FOREIGN = re.compile(r"<[\S+]+\s([^>|=]+)>")
-		FOREIGN.sub(r"\1", sent)
+		self.FOREIGN.sub(r"\1", sent)
 		return sent
 
-	def get_alt(self, l):
-		return "{ " + " / ".join(l) + " }"
-
 	def toString(self):
 		result = [self.waveform, self.channel, self.speaker, self.begin,
 				  self.end, self.transcript]
 		return "\t".join(str(x) for x in result)
 
 
+# the patterns and rules of Trans.process_str, by class attribute
+PROFILED = ['NOISE', 'CONT1', 'CONT2', 'CONT', 'REDUCED_RULES', 'GUESS', 'FOREIGN', 'LABELS',
+			'INCOMPLETE', 'TOKEN_RULES', 'DASHED', 'YALLVE']
+
+
+@contextmanager
+def profile_rules(stats):
+	"""Records the rules of Trans.process_str in stats while in the context, by wrapping their patterns.
+
+	The patterns of the class are restored on exit.
+	"""
+	T = Trans
+	saved = {name: getattr(T, name) for name in PROFILED}
+	try:
+		T.NOISE = stats.pattern("noise", T.NOISE)
+		T.CONT1 = stats.pattern("contraction_expansion", T.CONT1)
+		T.CONT2 = stats.pattern("contraction_expansion", T.CONT2)
+		T.CONT = stats.pattern("contraction_removal", T.CONT)
+		T.REDUCED_RULES = stats.token_rules("normalize_swbd.reduced", T.REDUCED_RULES)
+		T.GUESS = stats.pattern("normalize_swbd.guess", T.GUESS)
+		T.FOREIGN = stats.pattern("normalize_en.foreign", T.FOREIGN)
+		T.LABELS = [(c, stats.pattern("label " + c, p)) for c, p in T.LABELS]
+		T.INCOMPLETE = stats.pattern("fragments", T.INCOMPLETE)
+		T.TOKEN_RULES = {d: stats.token_rules("token_rules", r) for d, r in T.TOKEN_RULES.items()}
+		T.DASHED = stats.pattern("hyphen_split", T.DASHED)
+		T.YALLVE = stats.pattern("yallve", T.YALLVE)
+		yield stats
+	finally:
+		for name, value in saved.items():
+			setattr(T, name, value)
+
+
+def set_args(a):
+	"""Shares the command line options with pool workers."""
+	global args
+	args = a
+
+
 class Main:
+	DIGIT = re.compile(r"\d")
 
 	def __init__(self, args):
-		processed = list()
-		DIGIT = re.compile(r"\d")
-
-		files = os.listdir(args.indir)
-		for file in files:
-			if file.startswith(get_prefix(args.datatype)):
-				print("Cleaning file {}".format(file))
-				with open(os.path.join(args.indir, file), 'r') as infile:
-					lines = infile.readlines()
-					for line in lines:
-						if DIGIT.match(line[0]):  # check line for transcription
-							temp = Trans(file[3:7], line, args.datatype)
-							processed.append(temp)
-
-		# write processed transcription to file
-		outfilename = args.datatype + ".stm"
+		self.args = args
+		files = [f for f in os.listdir(args.indir) if f.startswith(get_prefix(args.datatype))]
+		failed = list()
+		self.nlines = 0
+
+		# rules are profiled in a serial run
+		stats = None
+		if args.profile_rules:
+			stats = RuleStats()
+
+		# write processed transcription to file, sorted for sclite
+		outfilename = args.datatype + "O.stm"
 		with open(os.path.join(args.outdir, outfilename), 'w+') as outfile:
-			for t in processed:
-				outfile.write(t.toString())
+			if args.jobs > 1 and stats is None:
+				with Pool(args.jobs, initializer=set_args, initargs=(args,)) as pool:
+					self.write(pool.imap(self.clean_group, self.group_files(files)), outfile, failed)
+			else:
+				with profile_rules(stats) if stats is not None else nullcontext():
+					self.write(map(self.clean_group, self.group_files(files)), outfile, failed)
+
+		if stats is not None:
+			stats.lines = self.nlines
+			stats.report()
+			stats.save(args.profile_rules)
+
+		if failed:
+			util.report_failures(failed)
+			sys.exit(1)
+
+	def group_files(self, files):
+		"""Groups the files by waveform, in waveform order.
+
+		The waveform comes from the file name, so sorting each group on its
+		own sorts the whole transcription.
+		"""
+		groups = dict()
+		for file in sorted(files):
+			groups.setdefault(file[3:7], list()).append(file)
+		return [groups[k] for k in sorted(groups)]
+
+	def clean_group(self, files):
+		"""Returns the sorted lines of the files of one waveform and their corrupt lines."""
+		failed = list()
+		records = list()
+		for file in files:
+			records.extend(self.clean_file(file, failed))
+		# ties are broken by the whole line, as sort(1) does
+		lines = sorted((t.channel, t.begin, t.toString()) for t in records)
+		return [l for _, _, l in lines], failed
+
+	def clean_file(self, file, failed):
+		"""Yields the processed lines of one file, recording corrupt lines in failed."""
+		print("Cleaning file {}".format(file))
+		with open(os.path.join(self.args.indir, file), 'r') as infile:
+			for n, line in enumerate(infile, 1):
+				if self.DIGIT.match(line[0]):  # check line for transcription
+					try:
+						yield Trans(file[3:7], line, self.args.datatype)
+					except ValueError as e:
+						failed.append((file, n, str(e)))
+
+	def write(self, results, outfile, failed):
+		for lines, temp in results:
+			self.nlines += len(lines)
+			for l in lines:
+				outfile.write(l)
 				outfile.write("\n")
+			failed.extend(temp)
 
 
 if __name__ == "__main__":
@@ -220,5 +290,9 @@ if __name__ == "__main__":
 						help="Include both reduced and expanded contraction forms (default is reduced).")
 	parser.add_argument("--disf", action="store_true",
 						help="Group disfluencies (e.g. uh, um) into a single hesitations group.")
+	parser.add_argument("--jobs", type=int, default=1,
+						help="Number of worker processes (default is serial).")
+	parser.add_argument("--profile-rules", type=str, metavar="JSON",
+						help="Profile the normalization rules in a serial run, saving the report here.")
 	args = parser.parse_args()
 	Main(args)
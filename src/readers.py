@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" readers.py
+Author: coman8@uw.edu
+
+Memory-mapped, byte-level reader of CTM files.
+
+A file is mapped and split into lines and fields with NumPy over its bytes,
+so lines are not decoded or split one by one. Fields are whitespace separated
+as by str.split. Times are parsed from the field bytes into float64 arrays
+when first used, and only the word field is decoded, once per distinct word,
+into a Vocab (see vocab.py).
+
+The masks and sums of the split take many times the bytes they are over, so
+a file is read in windows of about WINDOW bytes of whole lines, each a
+CtmTable with the first line of the next window as lookahead. Memory stays
+bounded by the window, whatever the size of the file.
+
+Files that the byte-level split would read differently from a text-mode
+readline, i.e. with carriage returns or non-ASCII whitespace, raise Irregular
+before any window is read, so that the caller can fall back to reading lines.
+"""
+
+import mmap
+import numpy as np
+from vocab import Vocab, IDS
+
+# ASCII whitespace of str.split
+WHITESPACE = np.zeros(256, dtype=bool)
+WHITESPACE[[9, 10, 11, 12, 13, 28, 29, 30, 31, 32]] = True
+NEWLINE, SPACE = 10, 32
+# bytes of whole lines read at a time
+WINDOW = 1 << 22
+
+
+class Irregular(ValueError):
+    pass
+
+
+def map_file(path):
+    """The bytes of a file as a read-only uint8 array over its memory map."""
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            return np.zeros(0, dtype=np.uint8)
+    return np.frombuffer(mm, dtype=np.uint8)
+
+
+def split_lines(buf):
+    """The start and end (without the newline) of each line."""
+    ends = np.flatnonzero(buf == NEWLINE)
+    starts = np.zeros(len(ends) + 1, dtype=np.int64)
+    starts[1:] = ends + 1
+    if len(buf) and buf[-1] != NEWLINE:
+        ends = np.append(ends, len(buf))
+    else:
+        starts = starts[:-1]
+    return starts, ends
+
+
+def line_end(buf, pos):
+    """The position after the first newline at or after pos, or the end of buf."""
+    step = 1 << 16
+    while pos < len(buf):
+        hits = np.flatnonzero(buf[pos:pos + step] == NEWLINE)
+        if len(hits):
+            return pos + int(hits[0]) + 1
+        pos += step
+    return len(buf)
+
+
+def check_regular(buf, starts, ends, offset=0):
+    """Raises Irregular when lines would not split on bytes as they do on text.
+
+    offset is the number of lines before buf, for the line numbers.
+    """
+    if (buf == 13).any():
+        raise Irregular('carriage return')
+    high = np.flatnonzero(buf >= 0x80)
+    if len(high):
+        for i in np.unique(np.searchsorted(starts, high, side='right') - 1):
+            line = buf[starts[i]:ends[i]].tobytes().decode('utf-8')
+            if any(c.isspace() and ord(c) >= 0x80 for c in line):
+                raise Irregular('non-ASCII whitespace at line {}'.format(offset + i + 1))
+
+
+def gather(buf, starts, ends):
+    """The byte strings of spans, as one fixed width 'S' array."""
+    lengths = ends - starts
+    width = max(int(lengths.max()) if len(lengths) else 0, 1)
+    ix = starts[:, None] + np.arange(width)
+    inside = np.arange(width) < lengths[:, None]
+    data = np.where(inside, buf[np.minimum(ix, len(buf) - 1)], 0).astype(np.uint8)
+    return data.view('S{}'.format(width)).ravel()
+
+
+class Fields:
+    """The whitespace separated fields of each line of a buffer."""
+
+    def __init__(self, buf, starts, ends):
+        self.buf = buf
+        self.starts, self.ends = starts, ends
+        ws = WHITESPACE[buf]
+        text = ~ws
+        before = np.ones(len(buf), dtype=bool)
+        before[1:] = ws[:-1]
+        after = np.ones(len(buf), dtype=bool)
+        after[:-1] = ws[1:]
+        self.field_starts = np.flatnonzero(text & before)
+        self.field_ends = np.flatnonzero(text & after) + 1
+
+        line = np.searchsorted(starts, self.field_starts, side='right') - 1
+        self.count = np.bincount(line, minlength=len(starts))
+        self.first = np.zeros(len(starts) + 1, dtype=np.int64)
+        np.cumsum(self.count, out=self.first[1:])
+
+        # a line is in normal form when its fields are joined by single spaces,
+        # i.e. it has one space less than fields and no other whitespace
+        spaces = np.zeros(len(buf) + 1, dtype=np.int64)
+        np.cumsum(ws & (buf != NEWLINE), out=spaces[1:])
+        others = np.zeros(len(buf) + 1, dtype=np.int64)
+        np.cumsum(ws & (buf != NEWLINE) & (buf != SPACE), out=others[1:])
+        self.normal = (spaces[ends] - spaces[starts] == np.maximum(self.count - 1, 0)) \
+            & (others[ends] == others[starts])
+
+    def field(self, k):
+        """The start and end of field k of each line, and the lines that have it."""
+        present = self.count > k
+        start = np.full(len(self.starts), -1, dtype=np.int64)
+        end = np.full(len(self.starts), -1, dtype=np.int64)
+        ix = self.first[:-1][present] + k
+        start[present] = self.field_starts[ix]
+        end[present] = self.field_ends[ix]
+        return start, end, present
+
+    def floats(self, k, rows=None):
+        """Field k of each line (or of the given rows) as float64, NaN where the line is too short."""
+        start, end, present = self.field(k)
+        if rows is not None:
+            start, end, present = start[rows], end[rows], present[rows]
+        result = np.full(len(start), np.nan)
+        if present.any():
+            try:
+                result[present] = gather(self.buf, start[present], end[present]).astype(np.float64)
+            except ValueError as e:
+                raise ValueError('Field {} is not a number: {}'.format(k, e))
+        return result
+
+    def strings(self, k):
+        """Field k of each line as ids of its decoded distinct values, -1 where too short."""
+        start, end, present = self.field(k)
+        ids = np.full(len(self.starts), -1, dtype=IDS)
+        vocab = Vocab()
+        if present.any():
+            values, inverse = np.unique(gather(self.buf, start[present], end[present]),
+                                        return_inverse=True)
+            lookup = np.fromiter((vocab.add(v.decode('utf-8')) for v in values),
+                                 dtype=IDS, count=len(values))
+            ids[present] = lookup[inverse.ravel()]
+        return ids, vocab
+
+
+class CtmTable:
+    """The columns of a CTM, or of a window of its lines: waveform, channel,
+    start, duration and word.
+
+    Every line is kept, including short lines (see nfields) and comments. The
+    first owned lines are the window's own, the others are lookahead, and
+    offset is the number of lines of the file before the window.
+    """
+    WAVEFORM, CHANNEL, START, DURATION, WORD = range(5)
+
+    def __init__(self, path=None, buf=None, owned=None, offset=0):
+        self.buf = map_file(path) if buf is None else buf
+        self.line_starts, self.line_ends = split_lines(self.buf)
+        if buf is None:
+            check_regular(self.buf, self.line_starts, self.line_ends)
+        self.owned = len(self.line_starts) if owned is None else owned
+        self.offset = offset
+        self.fields = Fields(self.buf, self.line_starts, self.line_ends)
+        self.nfields = self.fields.count
+        self.words, self.vocab = self.fields.strings(self.WORD)
+        self._times = dict()
+
+    @classmethod
+    def windows(cls, path, size=WINDOW):
+        """The tables of the windows of a file, each with one line of lookahead.
+
+        The whole file is checked first, so Irregular is raised before any
+        window is returned.
+        """
+        buf = map_file(path)
+        spans = list()
+        start = 0
+        while start < len(buf):
+            end = line_end(buf, min(start + size, len(buf)) - 1)
+            spans.append((start, end, line_end(buf, end)))
+            start = end
+        offsets = [0]
+        for start, end, _ in spans:
+            window = buf[start:end]
+            line_starts, line_ends = split_lines(window)
+            check_regular(window, line_starts, line_ends, offsets[-1])
+            offsets.append(offsets[-1] + len(line_starts))
+        return cls.read_windows(buf, spans, offsets)
+
+    @classmethod
+    def read_windows(cls, buf, spans, offsets):
+        for (start, end, lookahead), offset, following in zip(spans, offsets, offsets[1:]):
+            yield cls(buf=buf[start:lookahead], owned=following - offset, offset=offset)
+
+    def __len__(self):
+        return len(self.line_starts)
+
+    @property
+    def comment(self):
+        """Whether each line starts with ;;."""
+        result = self.line_ends - self.line_starts >= 2
+        starts = self.line_starts[result]
+        result[result] = (self.buf[starts] == ord(';')) & (self.buf[starts + 1] == ord(';'))
+        return result
+
+    @property
+    def start(self):
+        return self.times(self.START)
+
+    @property
+    def duration(self):
+        return self.times(self.DURATION)
+
+    def times(self, k):
+        if k not in self._times:
+            self._times[k] = self.fields.floats(k)
+        return self._times[k]
+
+    def channel(self):
+        return self.fields.strings(self.CHANNEL)
+
+    def waveform(self):
+        return self.fields.strings(self.WAVEFORM)
+
+    def line(self, i):
+        """The text of line i, decoded."""
+        return self.buf[self.line_starts[i]:self.line_ends[i]].tobytes().decode('utf-8')
+
+    def lines(self, start, end):
+        """The bytes of lines start to end, each with its newline."""
+        data = self.buf[self.line_starts[start]:self.line_ends[end - 1]].tobytes()
+        return data + b'\n'
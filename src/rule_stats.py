@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" rule_stats.py
+Author: coman8@uw.edu
+
+Opt-in instrumentation of the preprocessing rules.
+
+For each rule, records the lines it was applied to (calls), the lines it
+changed, its number of substitutions and its wall time. Rules applied
+together in one pass, like the groups of the token rules, are timed as the
+pass, and each group is only counted, as <pass>.<group> without a time.
+Rules are only wrapped when profiling is asked for, so the normal run is
+unchanged.
+"""
+
+import json
+import sys
+import time
+
+
+class CountingPattern:
+    """Wraps a compiled pattern, recording each sub in the rule stats."""
+    __slots__ = ('name', 'pattern', 'stats')
+
+    def __init__(self, name, pattern, stats):
+        self.name = name
+        self.pattern = pattern
+        self.stats = stats
+
+    def sub(self, repl, string, count=0):
+        start = time.perf_counter()
+        result, n = self.pattern.subn(repl, string, count)
+        self.stats.add(self.name, time.perf_counter() - start, n)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.pattern, name)
+
+
+class CountingRules:
+    """Wraps token rules (see token_rules.py), recording each sub in the rule stats.
+
+    The pass is timed as one rule, and with several rule groups each group
+    is counted on its own.
+    """
+    __slots__ = ('name', 'groups', 'rules', 'stats')
+
+    def __init__(self, name, rules, stats):
+        self.name = name
+        self.groups = [(g, name + '.' + g) for g in rules.names] if len(rules.names) > 1 else []
+        self.rules = rules
+        self.stats = stats
+
+    def sub(self, string):
+        counts = dict()
+        start = time.perf_counter()
+        result, n = self.rules.subn(string, counts)
+        self.stats.add(self.name, time.perf_counter() - start, n)
+        for group, rule in self.groups:
+            self.stats.count(rule, counts.get(group, 0))
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.rules, name)
+
+
+class RuleStats:
+
+    def __init__(self):
+        # rule -> [calls, lines changed, substitutions, seconds]
+        self.rules = dict()
+        self.lines = 0
+        self.start = time.perf_counter()
+
+    def add(self, rule, seconds, subs):
+        temp = self.rules.setdefault(rule, [0, 0, 0, 0.0])
+        temp[0] += 1
+        temp[1] += subs > 0
+        temp[2] += subs
+        temp[3] += seconds
+
+    def count(self, rule, subs):
+        """Records a rule applied within a timed pass, without a time of its own."""
+        temp = self.rules.setdefault(rule, [0, 0, 0, None])
+        temp[0] += 1
+        temp[1] += subs > 0
+        temp[2] += subs
+
+    def pattern(self, rule, pattern):
+        return CountingPattern(rule, pattern, self)
+
+    def token_rules(self, rule, rules):
+        return CountingRules(rule, rules, self)
+
+    def get_data(self):
+        return {'lines': self.lines, 'seconds': time.perf_counter() - self.start,
+                'rules': {r: {'calls': c, 'lines': l, 'subs': s, 'seconds': t}
+                          for r, (c, l, s, t) in self.rules.items()}}
+
+    def report(self, out=sys.stderr):
+        data = self.get_data()
+        print('Rule profile: {} lines in {:.3f}s'.format(data['lines'], data['seconds']), file=out)
+        print('{:<36} {:>9} {:>9} {:>9} {:>10} {:>9}'.format(
+            'rule', 'calls', 'lines', 'subs', 'seconds', 'us/call'), file=out)
+        timed = [(r, d) for r, d in data['rules'].items() if d['seconds'] is not None]
+        counted = [(r, d) for r, d in data['rules'].items() if d['seconds'] is None]
+        # the groups counted within a pass are listed under it
+        for rule, d in sorted(timed, key=lambda x: -x[1]['seconds']):
+            print('{:<36} {:>9} {:>9} {:>9} {:>10.4f} {:>9.2f}'.format(
+                rule, d['calls'], d['lines'], d['subs'], d['seconds'],
+                1e6 * d['seconds'] / max(d['calls'], 1)), file=out)
+            for group, g in counted:
+                if group.startswith(rule + '.'):
+                    print('  {:<34} {:>9} {:>9} {:>9} {:>10} {:>9}'.format(
+                        group, g['calls'], g['lines'], g['subs'], '-', '-'), file=out)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.get_data(), f, indent=1, sort_keys=True)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" token_rules.py
+Author: coman8@uw.edu
+
+Token normalization rules shared by the reference and hypothesis preprocessing.
+
+The word lists below are the one rule table of both sides. Each side compiles
+its rules into a TokenRules trie over token sequences, and rewrites a sentence
+(or a CTM line and the line after it) in one left to right pass, the longest
+rule at each position winning. A rule either replaces its tokens, or splits a
+token into several, which the CTM side spreads over the token's time. Rules
+are named by their group (e.g. hesitation), so profiled runs can count them.
+
+Spelling variants are alternations: as the references always did, a pair is
+rewritten only at the first of its variants found in the sentence, pair by
+pair, before the trie pass.
+"""
+
+HESITATION = "%hesitation"
+BACKCHANNEL = "%backchannel"
+
+# name of the spelling alternation rules
+ALTERNATION = "alternation"
+
+HESITATIONS = ["uh", "um", "eh", "hm", "hmm", "mm", "ah", "huh",
+               "ha", "er", "oof", "hee", "ach", "ee", "ew"]
+FRAGMENT_HESITATIONS = ["uh-", "u-", "a-", "e-"]
+BACKCHANNELS = ["uh-huh", "um-hum", "mhm"]
+# backchannels the ASR systems write as two tokens
+SPLIT_BACKCHANNELS = [("uh", "huh")]
+
+# spelling updates, by side
+DISFLUENCIES = {"hmm": "hm", "ooh": "oh"}
+UPDATES = {"'bout": "about", "'cause": "because", "hmm": "hm"}
+
+# reduced forms, the references only expand the first two
+REDUCED = {"gonna": ("going", "to"),
+           "wanna": ("want", "to"),
+           "kinda": ("kind", "of"),
+           "sorta": ("sort", "of"),
+           "gotta": ("got", "to")}
+REF_REDUCED = ["gonna", "wanna"]
+
+# ASR abbreviations spelled out as letters
+ABBREVIATIONS = {"hp": ("h", "p"),
+                 "dj": ("d", "j"),
+                 "dc": ("d", "c"),
+                 "ll": ("l", "l"),
+                 "cre": ("c", "r", "e"),
+                 "rpm": ("r", "p", "m"),
+                 "phd": ("p", "h", "d"),
+                 "twa": ("t", "w", "a")}
+
+# reference spellings scored as alternations of each other
+NORMALIZE = [('daycare', 'day care'), ('all right', 'alright'),
+             ('every day', 'everyday'), ('anymore', 'any more'), ('into', 'in to'),
+             ('boyscouts', 'boy scouts'), ('airflow', 'air flow'),
+             ('Bentsy', 'Bensi'), ('Lori', 'Laurie'), ('Leigh', 'Lee'),
+             ('Rachael', 'Rachel'), ('allen', 'alan'),
+             ('Tricia', 'Trisha'), ('Johnny', 'Jonnie'), ('Abby', 'Abbie')]
+
+
+def alternation(variants):
+    """The tokens of a reference alternation, e.g. { all right / alright }."""
+    tokens = ["{"]
+    for i, v in enumerate(variants):
+        if i:
+            tokens.append("/")
+        tokens.extend(v.split())
+    tokens.append("}")
+    return tuple(tokens)
+
+
+class TokenRules:
+    """A trie over token sequences, mapping each rule's tokens to its output tokens and names.
+
+    With alternations, a list of spelling variants of the same words, each
+    pair is rewritten to its alternation at the first variant found anywhere
+    in the sentence, pair by pair, then the trie rules are applied.
+    """
+    # key of the output of a rule ending at a node
+    OUTPUT = None
+
+    def __init__(self, rules, alternations=()):
+        self.root = dict()
+        self.depth = 0
+        # the rule groups, in the order they are added
+        self.names = [ALTERNATION] if alternations else []
+        for pattern, output, names in rules:
+            self.add(tuple(pattern), tuple(output), names)
+        # the variants of each pair, as text and tokens, and their alternation
+        self.pairs = [([(v, tuple(v.split())) for v in variants], alternation(variants))
+                      for variants in alternations]
+        # the pairs by the first token of their variants
+        self.pair_first = dict()
+        for k, (variants, _) in enumerate(self.pairs):
+            for _, tokens in variants:
+                self.pair_first.setdefault(tokens[0], set()).add(k)
+        # tokens that start a rule, to skip sentences no rule applies to
+        self.first = frozenset(self.root) | frozenset(self.pair_first)
+
+    def add(self, pattern, output, names):
+        node = self.root
+        for token in pattern:
+            node = node.setdefault(token, dict())
+        node[self.OUTPUT] = (output, names)
+        self.names.extend(n for n in names if n not in self.names)
+        self.depth = max(self.depth, len(pattern))
+
+    def extends(self, token):
+        """Whether a rule starting with token has more tokens."""
+        node = self.root.get(token)
+        return node is not None and len(node) > (self.OUTPUT in node)
+
+    def match(self, tokens, i):
+        """The longest rule at tokens[i], as its end, output and names, or None."""
+        node = self.root
+        result = None
+        for j in range(i, len(tokens)):
+            node = node.get(tokens[j])
+            if node is None:
+                break
+            if self.OUTPUT in node:
+                result = (j + 1,) + node[self.OUTPUT]
+        return result
+
+    def apply(self, tokens, counts=None):
+        """Rewrites a token list, returns the new tokens and the number of rules applied.
+
+        With counts, a dict, the rules applied are added to it by name.
+        """
+        result = list()
+        n = 0
+        i = 0
+        while i < len(tokens):
+            m = self.match(tokens, i) if tokens[i] in self.root else None
+            if m is None:
+                result.append(tokens[i])
+                i += 1
+            else:
+                i, output, names = m
+                result.extend(output)
+                n += 1
+                if counts is not None:
+                    for name in names:
+                        counts[name] = counts.get(name, 0) + 1
+        return result, n
+
+    def alternate(self, tokens, counts=None):
+        """Rewrites the spelling variants of a token list to their alternations.
+
+        Pair by pair, only the first variant found in the sentence text is
+        rewritten, where it is a whole word sequence, so a variant inside
+        another word (e.g. into in pinto) keeps the other from being rewritten.
+        """
+        n = 0
+        k = 0
+        while True:
+            pairs = [p for t in tokens if t in self.pair_first for p in self.pair_first[t] if p >= k]
+            if not pairs:
+                return tokens, n
+            k = min(pairs)
+            variants, output = self.pairs[k]
+            sent = " ".join(tokens)
+            for text, pattern in variants:
+                if text in sent:
+                    tokens, m = replace(tokens, pattern, output)
+                    n += m
+                    if counts is not None and m:
+                        counts[ALTERNATION] = counts.get(ALTERNATION, 0) + m
+                    break
+            k += 1
+
+    def subn(self, sent, counts=None):
+        """Rewrites the space separated tokens of a sentence, returns it and the number of rules applied.
+
+        With counts, a dict, the rules applied are added to it by name.
+        """
+        tokens = sent.split(" ")
+        if self.first.isdisjoint(tokens):
+            return sent, 0
+        n = 0
+        if self.pairs:
+            tokens, n = self.alternate(tokens, counts)
+        tokens, m = self.apply(tokens, counts)
+        return " ".join(tokens), n + m
+
+    def sub(self, sent):
+        return self.subn(sent)[0]
+
+
+def replace(tokens, pattern, output):
+    """Replaces each occurrence of pattern in a token list, left to right."""
+    result = list()
+    n = 0
+    i = 0
+    size = len(pattern)
+    while i < len(tokens):
+        if tokens[i] == pattern[0] and tuple(tokens[i:i + size]) == pattern:
+            result.extend(output)
+            i += size
+            n += 1
+        else:
+            result.append(tokens[i])
+            i += 1
+    return result, n
+
+
+def ref_reduced_rules():
+    """The reduced forms expanded in the SWBD references."""
+    return TokenRules([((w,), REDUCED[w], ("reduced",)) for w in REF_REDUCED])
+
+
+def ref_rules(disf):
+    """The rules of the reference sentences, after fragments are marked.
+
+    Spelling variants become alternations, then disfluencies, hesitations
+    (with disf) and backchannels are substituted in this order, the single
+    token rules being composed into one, named by every step it takes.
+    """
+    rules = list()
+    words = set(DISFLUENCIES) | set(BACKCHANNELS)
+    if disf:
+        words |= set(HESITATIONS) | set(FRAGMENT_HESITATIONS)
+    for word in sorted(words):
+        output = (DISFLUENCIES.get(word, word),)
+        names = ("disfluency",) if word in DISFLUENCIES else ()
+        if disf and output[0] in HESITATIONS:
+            output = (HESITATION,)
+            names += ("hesitation",)
+        elif disf and output[0] in FRAGMENT_HESITATIONS:
+            output = (output[0], "/", HESITATION)
+            names += ("fragment_hesitation",)
+        if output[0] in BACKCHANNELS:
+            output = (BACKCHANNEL,)
+            names += ("backchannel",)
+        if output != (word,):
+            rules.append(((word,), output, names))
+    return TokenRules(rules, NORMALIZE)
+
+
+def hyp_rules(disf):
+    """The rules of the lowercased CTM tokens, after hyphenated tokens are split.
+
+    Reduced forms and abbreviations are split into several tokens, the other
+    rules replace one token, or a split backchannel, with one token.
+    """
+    rules = [((w,), v, ("reduced",)) for w, v in REDUCED.items()]
+    rules += [((w,), v, ("reduced",)) for w, v in ABBREVIATIONS.items()]
+    rules += [(p, (BACKCHANNEL,), ("split_backchannel",)) for p in SPLIT_BACKCHANNELS]
+
+    words = set(UPDATES) | set(BACKCHANNELS)
+    if disf:
+        words |= set(HESITATIONS)
+    for word in sorted(words):
+        output = UPDATES.get(word, word)
+        names = ("updates",) if word in UPDATES else ()
+        if word in BACKCHANNELS:
+            output = BACKCHANNEL
+            names += ("backchannel",)
+        if disf and word in HESITATIONS:
+            output = HESITATION
+            names += ("hesitation",)
+        if output != word:
+            rules.append(((word,), (output,), names))
+    return TokenRules(rules)
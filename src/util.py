@@ -11,67 +11,216 @@ import sys
 import os
 import csv
 import re
+from ast import literal_eval
+from itertools import chain, islice
+import numpy as np
 import pandas as pd
 
+FORMATS = ['csv', 'parquet']
+# quoted items of a list of strings, as written by str(list)
+LIST_ITEM = re.compile(r"'([^'\\]*)'|\"([^\"\\]*)\"")
+INT = re.compile(r"\s*-?\d+\s*")
+# parentheses around the utterance id of a table index
+IX_PARENS = re.compile(r"\((.+)\)")
 
-class Counter:
-
-    def __init__(self):
-        self.ix = 0
-        self.hyp = 0
-        self.ref = 0
-        self.hyp_cont = 0
-        self.ref_cont = 0
-
-    def iterall(self, atype):
-        self.ix += 1
-        if atype != 'D':
-            self.hyp += 1
-            self.hyp_cont += 1
-        if atype != 'I':
-            self.ref += 1
-            self.ref_cont += 1
-
-    def iter(self, source=None):
-        if source == "ref_cont":
-            self.ref_cont += 1
-        elif source == "hyp_cont":
-            self.hyp_cont += 1
-
-    def itercont(self, row, atype):
-        try:
-            if atype != 'D' and row['hyp_cont_tag_gloss'][self.hyp_cont] == 1:
-                self.iter('hyp_cont')
-            if atype != 'I' and row['ref_cont_tag_gloss'][self.ref_cont] == 1:
-                self.iter('ref_cont')
-        except IndexError:
-            catch_index_error(row, vars(self))
-            raise
-
-
-def load_file(projdir, file):
+
+def flatten(series):
+    """Flattens a column of lists into one array of values.
+
+    Returns the values with the start offset and length of each list.
+    """
+    lengths = np.fromiter((len(x) for x in series), dtype=np.int64, count=len(series))
+    values = np.empty(lengths.sum(), dtype=object)
+    values[:] = list(chain.from_iterable(series))
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    return values, starts, lengths
+
+
+def counts(mask, starts, lengths):
+    """Counts the True values of mask within each list."""
+    total = np.zeros(len(mask) + 1, dtype=np.int64)
+    np.cumsum(mask, out=total[1:])
+    return total[starts + lengths] - total[starts]
+
+
+def offsets(mask, starts, rows):
+    """Counts the True values of mask before each position, within its list."""
+    total = np.zeros(len(mask) + 1, dtype=np.int64)
+    np.cumsum(mask, out=total[1:])
+    return total[:-1] - total[starts][rows]
+
+
+def parse_list(x):
+    """Parses the string representation of a list of strings.
+
+    Items are quoted with ' or ", falls back to literal_eval for escapes.
+    """
+    if '\\' in x:
+        return literal_eval(x)
+    return [a or b for a, b in LIST_ITEM.findall(x)]
+
+
+def parse_numbers(x):
+    """Parses the string representation of a list of ints and floats."""
+    x = x.strip()[1:-1]
+    if not x.strip():
+        return []
+    return [int(v) if INT.fullmatch(v) else float(v) for v in x.split(',')]
+
+
+def parse_cell(x):
+    """Parses a list cell of strings or numbers."""
+    if x.lstrip('[ ')[:1] in ('"', "'"):
+        return parse_list(x)
+    return parse_numbers(x)
+
+
+def table_name(name, fmt='csv'):
+    """Gets the file name of a table in the given format from its csv name."""
+    if fmt == 'parquet':
+        if name.endswith('.csv'):
+            name = name[:-4]
+        return name + '.parquet'
+    return name
+
+
+def load_file(projdir, file, columns=None, list_columns=None):
+    """Loads a csv or parquet table.
+
+    Parquet tables keep list columns natively, csv tables have the
+    list_columns parsed from their string representation.
+    """
     infile = os.path.join(projdir, file)
     print('Loading {}'.format(infile))
+    if file.endswith('.parquet'):
+        return pd.read_parquet(infile, columns=columns)
     df = pd.read_csv(infile, index_col=0)
+    if columns:
+        df = df[columns]
+    for c in list_columns or []:
+        df[c] = df[c].apply(literal_eval)
     return df
 
-def write_file(errors, projdir, file, cols=None):
+def read_chunks(projdir, file, columns, list_columns=None, chunksize=10000):
+    """Reads the columns of a csv or parquet table, chunksize rows at a time.
+
+    Only the given columns are read, list_columns of csv tables are parsed
+    as in load_file.
+    """
+    infile = os.path.join(projdir, file)
+    print('Loading {}'.format(infile))
+    if file.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(infile)
+        # the stored index is restored from the pandas metadata
+        index = [i for i in pf.schema_arrow.pandas_metadata['index_columns'] if isinstance(i, str)]
+        for batch in pf.iter_batches(batch_size=chunksize, columns=index + columns):
+            yield batch.to_pandas()
+        return
+    index = pd.read_csv(infile, nrows=0).columns[0]
+    reader = pd.read_csv(infile, usecols=[index] + columns, index_col=0, dtype=str,
+                         keep_default_na=False, chunksize=chunksize)
+    for df in reader:
+        for c in list_columns or []:
+            df[c] = [parse_cell(x) for x in df[c]]
+        yield df
+
+def write_table(df, projdir, file):
+    output = os.path.join(projdir, file)
+    print('Writing to {}'.format(output))
+    if file.endswith('.parquet'):
+        df.to_parquet(output)
+    else:
+        df.to_csv(output)
+
+def write_rows(rows, projdir, file, cols=None, dtypes=None, chunksize=100000):
+    """Writes rows to a csv or parquet table, as they are produced.
+
+    Parquet tables are written chunksize rows at a time when the dtypes of
+    the columns are given, converted to the schema of the dtypes, and at
+    once with the types of the values otherwise. The first column is the
+    index of the table.
+    """
     output = os.path.join(projdir, file)
     print('Writing to {}'.format(output))
+    if file.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        rows = iter(rows)
+        if dtypes:
+            schema = arrow_schema(cols, dtypes)
+            batches = iter(lambda: list(islice(rows, chunksize)), [])
+        else:
+            schema = None
+            batches = [list(rows)]
+        writer = None
+        for batch in chain(batches, [[]]):
+            if batch or writer is None:
+                table = arrow_table(batch, cols, schema)
+                if writer is None:
+                    writer = pq.ParquetWriter(output, table.schema)
+                writer.write_table(table)
+        writer.close()
+        return
     with open(output, 'w', encoding='utf-8') as out:
-        writer = csv.writer(out, lineterminator='\n')
-        if cols:
-            writer.writerow(cols)
-        for e in errors:
-            writer.writerow(e.get_data())
+        write_csv(out, rows, cols)
+
+def arrow_schema(cols, dtypes):
+    """The arrow schema of a table of the given column dtypes, strings by default."""
+    import pyarrow as pa
+    df = pd.DataFrame({c: pd.Series(dtype=dtypes.get(c, str)) for c in cols})
+    return pa.Schema.from_pandas(df.set_index(cols[0]))
+
+def arrow_table(rows, cols, schema=None):
+    """The arrow table of rows, with the first column as its index.
+
+    With a schema, the values are converted to its types, empty strings and
+    NaN being missing values. Without, the types are inferred from the values,
+    so list cells stay lists.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    columns = [list(c) for c in zip(*rows)] if rows else [[] for _ in cols]
+    if schema is None:
+        df = pd.DataFrame(dict(zip(cols, columns)), columns=cols)
+        return pa.Table.from_pandas(df.set_index(cols[0]))
+    data = dict(zip(cols, columns))
+    arrays = list()
+    for field in schema:
+        values = [None if v == '' else v for v in data[field.name]]
+        array = pa.array(values, type=None if values else field.type)
+        if array.type != field.type:
+            array = array.cast(field.type)
+        if pa.types.is_floating(field.type):
+            array = pc.if_else(pc.is_nan(array), pa.scalar(None, field.type), array)
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def write_csv(out, rows, cols=None):
+    writer = csv.writer(out, lineterminator='\n')
+    if cols:
+        writer.writerow(cols)
+    writer.writerows(rows)
+
+
+def utterance_name(ix):
+    """The utterance id of a table index, without its parentheses."""
+    return IX_PARENS.sub(r"\1", ix)
 
 
 def ix_name(ix, i):
-    ix_name = re.sub(r"\((.+)\)", r"\1", ix)
+    ix_name = utterance_name(ix)
     ix_name = ix_name + "#" + str(i)
     return ix_name
 
 
+def report_failures(failed):
+    """Prints the (file, line number, message) of each corrupt line skipped."""
+    print("Skipped {} corrupt line(s):".format(len(failed)), file=sys.stderr)
+    for file, n, message in failed:
+        print("  {}:{}: {}".format(file, n, message), file=sys.stderr)
+
+
 def catch_index_error(*args):
     print('IndexError')
     for a in args:
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" vocab.py
+Author: coman8@uw.edu
+
+Interned token vocabulary, with sentences as flat int32 token ids.
+
+A Vocab gives each token an int32 id, in order of first appearance. A column
+of sentences is stored as one array of ids and an array of offsets, one more
+than the sentences, so sentence i is ids[offsets[i]:offsets[i + 1]]. Counts,
+groupings and joins over tokens are then integer operations, and tokens are
+only decoded when written out.
+
+get_utterance_table.py --ids saves the sentences of each utterance table as
+a token table (<table>.ids.npz) with its vocabulary and utterance index,
+which get_sents.py and get_error_table.py read instead of the list cells.
+"""
+
+import os
+import numpy as np
+
+IDS = np.int32
+SUFFIX = '.ids.npz'
+
+
+class Vocab:
+
+    def __init__(self, tokens=()):
+        self.ids = dict()
+        self.tokens = list()
+        for t in tokens:
+            self.add(t)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def add(self, token):
+        i = self.ids.get(token)
+        if i is None:
+            i = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return i
+
+    def encode(self, tokens):
+        """The ids of a sequence of tokens, adding the new ones."""
+        return np.fromiter((self.add(t) for t in tokens), dtype=IDS)
+
+    def encode_sents(self, sents):
+        """The ids and offsets of a column of sentences."""
+        lengths = np.fromiter((len(s) for s in sents), dtype=np.int64, count=len(sents))
+        offsets = np.zeros(len(sents) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        ids = np.empty(offsets[-1], dtype=IDS)
+        for s, start, end in zip(sents, offsets[:-1], offsets[1:]):
+            ids[start:end] = [self.add(t) for t in s]
+        return ids, offsets
+
+    def array(self):
+        """The tokens by id, to decode an array of ids by indexing."""
+        result = np.empty(len(self.tokens), dtype=object)
+        result[:] = self.tokens
+        return result
+
+
+class TokenTable:
+    """The sentence columns of an utterance table, as ids and offsets sharing one vocabulary."""
+
+    def __init__(self, vocab, index, columns):
+        self.vocab = vocab
+        self.tokens = vocab.array()
+        self.index = index
+        # column name -> (ids, offsets)
+        self.columns = columns
+
+    @classmethod
+    def from_frame(cls, df, names):
+        vocab = Vocab()
+        columns = {c: vocab.encode_sents(df[c].tolist()) for c in names}
+        return cls(vocab, np.asarray(df.index, dtype=str), columns)
+
+    def save(self, path):
+        data = {'tokens': np.array(self.vocab.tokens, dtype=str), 'index': self.index}
+        for c, (ids, offsets) in self.columns.items():
+            data[c + '.ids'] = ids
+            data[c + '.offsets'] = offsets
+        with open(path, 'wb') as f:
+            np.savez(f, **data)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            names = [k[:-len('.ids')] for k in data.files if k.endswith('.ids')]
+            columns = {c: (data[c + '.ids'], data[c + '.offsets']) for c in names}
+            return cls(Vocab(data['tokens'].tolist()), data['index'], columns)
+
+    def sents(self, column, start, end, skip=()):
+        """The sentences of rows start to end as lists of tokens, without the tokens in skip."""
+        ids, offsets = self.columns[column]
+        bounds = offsets[start:end + 1]
+        ids, offsets = ids[bounds[0]:bounds[-1]], bounds - bounds[0]
+        if skip:
+            keep = ~np.isin(ids, [self.vocab.ids[t] for t in skip if t in self.vocab.ids])
+            ids = ids[keep]
+            offsets = np.concatenate([[0], np.cumsum(keep)])[offsets]
+        tokens = self.tokens[ids].tolist()
+        return [tokens[a:b] for a, b in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+    def rows(self, column, start, end):
+        """The ids, starts and lengths of the sentences of rows start to end."""
+        ids, offsets = self.columns[column]
+        bounds = offsets[start:end + 1]
+        return ids[bounds[0]:bounds[-1]], bounds[:-1] - bounds[0], np.diff(bounds)
+
+
+def table_path(projdir, table):
+    """The token table of an utterance table, e.g. x.ctm.csv -> x.ctm.ids.npz."""
+    name = os.path.splitext(table)[0]
+    return os.path.join(projdir, name + SUFFIX)
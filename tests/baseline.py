@@ -0,0 +1,283 @@
+""" baseline.py
+Author: coman8@uw.edu
+
+The implementations the optimized code replaced, as they were, for the
+regression tests to compare against. The command line options they read
+from globals are arguments here.
+"""
+
+import re
+import string
+
+# preprocess_ref.py
+
+NORMALIZE = [('daycare', 'day care'), ('all right', 'alright'),
+             ('every day', 'everyday'), ('anymore', 'any more'), ('into', 'in to'),
+             ('boyscouts', 'boy scouts'), ('airflow', 'air flow'),
+             ('Bentsy', 'Bensi'), ('Lori', 'Laurie'), ('Leigh', 'Lee'),
+             ('Rachael', 'Rachel'), ('allen', 'alan'),
+             ('Tricia', 'Trisha'), ('Johnny', 'Jonnie'), ('Abby', 'Abbie')]
+HESITATIONS = ["uh", "um", "eh", "hm", "hmm", "mm", "ah", "huh",
+               "ha", "er", "oof", "hee", "ach", "ee", "ew"]
+FRAGMENT_HESITATIONS = ["uh-", "u-", "a-", "e-"]
+EMPTY = "IGNORE_TIME_SEGMENT_IN_SCORING"
+
+
+def process_str(sent, datatype, cont=False, disf=False):
+    """Trans.process_str of the references."""
+    # special label for noise (will match alternative pronunciations)
+    NOISE = re.compile(r"{[^}]+}")
+    sent = NOISE.sub("", sent)
+
+    # contraction label
+    if cont:
+        CONT1 = re.compile(r"<contraction e_form=\"\[[^=]+=>([^\]]+)\]\">(\S+)")
+        sent = CONT1.sub(r"{ \1 / \2 }", sent)
+
+        CONT2 = re.compile(r"<contraction e_form=\"\[[^=]+=>([^=]+)\]\[[^=]+=>([^=]+)\]\">(\S+)")
+        sent = CONT2.sub(r"{ \1 \2 / \3 }", sent)
+    else:
+        CONT = re.compile(r"<contraction e_form=\"(\[[^=]+=>[^=]+\])+\">")
+        sent = CONT.sub(r"", sent)
+
+    # type-specific processing
+    if datatype == "SWBD":
+        sent = normalize_swbd(sent)
+
+    # various special labels
+    COMMENT = re.compile(r"\[[^\]]+\]+")
+    TAG = re.compile(r"<[^>]+>")
+    DDASH = re.compile(r"//")
+    INTERRUPT = re.compile(r"--")
+    for p in [COMMENT, TAG, DDASH, INTERRUPT]:
+        sent = p.sub("", sent)
+
+    # strip punctuation
+    punct_keep = {"-", "\'", "/", "{", "}", "_"}
+    punct_remove = set(string.punctuation)
+    punct_remove.difference_update(punct_keep)
+    sent = "".join(ch for ch in sent if ch not in punct_remove)
+
+    sent = sent.strip()
+    sent = re.sub(r"\s+", " ", sent)
+
+    # fragments
+    INCOMPLETE = re.compile(r"(\S+-|-\S+)")
+    sent = sub_word(INCOMPLETE, r"{ \2 / @ }", sent)
+
+    sent = sub_tokens(sent, disf)
+
+    # hyphenation
+    DASHED = re.compile(r"([^uh|um|\s])-(\S)")
+    sent = DASHED.sub(r"\1 \2", sent)
+
+    YALLVE = re.compile(r"y'{ all have / all've }")
+    sent = YALLVE.sub("{ you all have / y'all have / y'all've }", sent)
+
+    # empty sentences
+    if sent != EMPTY:
+        sent = sent.lower()
+    if sent == "":
+        sent = EMPTY
+    return sent
+
+
+def sub_tokens(sent, disf=False):
+    """The normalizations, disfluencies and backchannels of process_str."""
+    for varients in NORMALIZE:
+        for v in varients:
+            if re.search(v, sent):
+                alt = "{ " + " / ".join(varients) + " }"
+                sent = sub_word(re.compile(v), alt, sent)
+                break
+
+    sent = sub_word(re.compile(r"hmm"), "hm", sent)
+    sent = sub_word(re.compile(r"ooh"), "oh", sent)
+
+    if disf:
+        for h in HESITATIONS:
+            sent = sub_word(re.compile(h), r"%hesitation", sent)
+        for fh in FRAGMENT_HESITATIONS:
+            sent = sub_word(re.compile(r"({})".format(fh)), r"\2 / %hesitation", sent)
+
+    sent = sub_word(re.compile(r"uh-huh"), r"%backchannel", sent)
+    sent = sub_word(re.compile(r"um-hum"), r"%backchannel", sent)
+    sent = sub_word(re.compile(r"mhm"), r"%backchannel", sent)
+    return sent
+
+
+def sub_word(pattern, replace, s):
+    """Subs a pattern within a word boundary."""
+    BOW = re.compile(r"((?<=\s)|(?<=^))")
+    EOW = re.compile(r"((?=\s)|(?<=$))")
+    temp = "".join(x.pattern for x in [BOW, pattern, EOW])
+    return re.sub(temp, replace, s)
+
+
+def normalize_swbd(sent):
+    sent = sub_word(re.compile(r"gonna"), "going to", sent)
+    sent = sub_word(re.compile(r"wanna"), "want to", sent)
+    GUESS = re.compile(r"([^\s]+)\[([^\]]+)]")
+    sent = GUESS.sub(r"\1\2", sent)
+    return sent
+
+
+# get_error_table.py
+
+ERRORS = ['I', 'D', 'S']
+
+
+class Counter:
+
+    def __init__(self):
+        self.ix = 0
+        self.hyp = 0
+        self.ref = 0
+        self.hyp_cont = 0
+        self.ref_cont = 0
+
+    def iterall(self, atype):
+        self.ix += 1
+        if atype != 'D':
+            self.hyp += 1
+            self.hyp_cont += 1
+        if atype != 'I':
+            self.ref += 1
+            self.ref_cont += 1
+
+    def itercont(self, row, atype):
+        if atype != 'D' and row['hyp_cont_tag_gloss'][self.hyp_cont] == 1:
+            self.hyp_cont += 1
+        if atype != 'I' and row['ref_cont_tag_gloss'][self.ref_cont] == 1:
+            self.ref_cont += 1
+
+
+def get_errors(df):
+    """The rows of the error table of a model table with its list columns parsed, row by row."""
+    result = list()
+    for ix, row in df.iterrows():
+        result.extend(extract_errors(ix, row))
+    return result
+
+
+def extract_errors(ix, row):
+    errors = list()
+    i = Counter()
+    ann = row['annotation']
+    sen_len = len([x for x in ann if x != 'I'])
+    for j in range(len(ann)):
+        atype = ann[j]
+        # since TAG has tokenized contractions, skip those
+        i.itercont(row, atype)
+        if atype in ERRORS:
+            hyp = extract_src(row, i, 'hyp') if atype != 'D' else [''] * 5
+            ref = extract_src(row, i, 'ref') if atype != 'I' else [''] * 5
+            name = re.sub(r"\((.+)\)", r"\1", ix) + "#" + str(j)
+            errors.append([str(x) for x in [name, atype, i.ref + 1, sen_len] + hyp + ref])
+        i.iterall(atype)
+    return errors
+
+
+def extract_src(row, i, label):
+    count = getattr(i, label)
+    ccount = getattr(i, label + '_cont')
+    fields = [(label + '_sent', i.ix), (label + '_tag', ccount), (label + '_shape', ccount),
+              (label + '_prob', count), (label + '_cprob', count)]
+    result = [''] * 5
+    # fields are filled in order up to the first index out of range
+    for k, (column, index) in enumerate(fields):
+        try:
+            result[k] = row[column][index]
+        except IndexError:
+            break
+    return result
+
+
+# preprocess_hyp.py
+
+UPDATES = {"'bout": "about",
+           "'cause": "because",
+           "hmm": "hm"}
+REDUCED = {"gonna": ("going", "to"),
+           "wanna": ("want", "to"),
+           "kinda": ("kind", "of"),
+           "sorta": ("sort", "of"),
+           "gotta": ("got", "to"),
+           # abbrevs. to expand
+           "hp": ("h", "p"),
+           "dj": ("d", "j"),
+           "dc": ("d", "c"),
+           "ll": ("l", "l"),
+           "cre": ("c", "r", "e"),
+           "rpm": ("r", "p", "m"),
+           "phd": ("p", "h", "d"),
+           "twa": ("t", "w", "a")}
+BACKCHANNELS = ["uh-huh", "um-hum", "mhm"]
+
+
+def clean_ctm(lines, disf=False):
+    """The processed CTM text of the lines of a CTM, from Main of the hypotheses."""
+    processed = list()
+    i = 0
+    while i < len(lines):
+        current = lines[i].split()
+        if len(current) > 4:
+            current[4] = current[4].lower()
+            token = current[4]
+
+            # hyphenation
+            if "-" in token and token != "uh-huh":
+                processed.extend(get_extension(current, token.split("-"), get_endpoint(lines[i + 1])))
+
+            # abbreviations
+            elif token in REDUCED:
+                processed.extend(get_extension(current, REDUCED[token], get_endpoint(lines[i + 1])))
+
+            # others (include normalize period from ASR abbreviations)
+            else:
+                if token in UPDATES:
+                    current[4] = UPDATES[token]
+                if token in BACKCHANNELS:
+                    current[4] = "%backchannel"
+                if match_split_backchannel(token, lines, i):
+                    token = 'uh-huh'
+                    current[4] = "%backchannel"
+                    i += 1
+                if disf and token in HESITATIONS:
+                    current[4] = "%hesitation"
+                if token.endswith("."):
+                    current[4] = token.rstrip(".")
+                processed.append(current)
+        i += 1
+    return "".join(' '.join(p) + "\n" for p in processed)
+
+
+def match_split_backchannel(token, line, i):
+    if token != "uh":
+        return False
+    if i + 1 > len(line) - 1:
+        return False
+    return line[i + 1].split()[4].lower() == "huh"
+
+
+def get_endpoint(line):
+    return float(line.split()[2])
+
+
+def get_extension(arr, tokens, end):
+    timepoint = float(arr[2])
+    step = float(end - timepoint) / float(len(tokens))
+
+    # edge case where current line ends conversation
+    if step < 0:
+        timepoint -= 0.004
+        step = 0.001
+
+    result = list()
+    for t in tokens:
+        temp = arr.copy()
+        temp[2] = "{:.3f}".format(timepoint)
+        temp[4] = t
+        timepoint += step
+        result.append(temp)
+    return result
@@ -0,0 +1,106 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+import baseline
+import util
+from get_error_table import Main, TError
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'models')
+
+
+@pytest.fixture
+def main():
+    # get_errors does not use the state of a run
+    return Main.__new__(Main)
+
+
+def load_sample():
+    return util.load_file(FIXTURES, 'sample.all', Main.COLUMNS, list_columns=Main.COLUMNS)
+
+
+def random_table(seed, n=200):
+    """Model table rows with random annotations, contraction glosses and list lengths."""
+    rng = np.random.default_rng(seed)
+    rows = dict()
+    for k in range(n):
+        ann = rng.choice(['C', 'S', 'D', 'I'], size=rng.integers(0, 12)).tolist()
+        row = {'annotation': ann}
+        for label, skip in [('hyp', 'D'), ('ref', 'I')]:
+            words = sum(a != skip for a in ann)
+            # runs of contraction tokens, up to twice as many tokens as words
+            gloss = (rng.random(2 * words + 1) < 0.4).astype(int).tolist()
+            size = len(gloss)
+            row[label + '_sent'] = ['w{}'.format(x) for x in range(len(ann))]
+            row[label + '_cont_tag_gloss'] = gloss
+            # some lists are too short, so that fields stop early
+            row[label + '_tag'] = ['T{}'.format(x) for x in range(rng.integers(max(size - 3, 0), size + 1))]
+            row[label + '_shape'] = [float(x) for x in range(rng.integers(max(size - 3, 0), size + 1))]
+            row[label + '_prob'] = [round(float(x), 4) for x in rng.normal(size=rng.integers(max(words - 1, 0), words + 1))]
+            row[label + '_cprob'] = [round(float(x), 4) for x in rng.normal(size=words)]
+        rows['(en_{}_a-{:04d})'.format(seed, k)] = row
+    return pd.DataFrame.from_dict(rows, orient='index')[Main.COLUMNS]
+
+
+def cont_walk(df, label, skip):
+    """The contraction offset of each position of the annotations with a word on one side, by the old walk."""
+    result = list()
+    for _, row in df.iterrows():
+        i = baseline.Counter()
+        for atype in row['annotation']:
+            i.itercont(row, atype)
+            if atype != skip:
+                result.append(getattr(i, label + '_cont'))
+            i.iterall(atype)
+    return result
+
+
+def test_get_errors_matches_baseline(main):
+    df = load_sample()
+    assert [list(e) for e in main.get_errors(df)] == baseline.get_errors(df)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_get_errors_matches_baseline_on_random_rows(main, seed):
+    df = random_table(seed)
+    assert [list(e) for e in main.get_errors(df)] == baseline.get_errors(df)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_get_cont_counts_matches_walk(main, seed):
+    df = random_table(seed)
+    ann, starts, lengths = util.flatten(df['annotation'])
+    rows = np.repeat(np.arange(len(df)), lengths)
+    for label, skip in [('hyp', 'D'), ('ref', 'I')]:
+        step = ann != skip
+        count = util.offsets(step, starts, rows)
+        ccount = main.get_cont_counts(df[label + '_cont_tag_gloss'], rows, step, count)
+        assert ccount[step].tolist() == cont_walk(df, label, skip)
+
+
+def test_get_cont_counts_runs(main):
+    # in a run of contraction tokens every other token is skipped, starting with the first
+    df = pd.DataFrame({'annotation': [['C'] * 4],
+                       'hyp_cont_tag_gloss': [[1, 1, 1, 0, 0, 0]]}, index=['(a)'])
+    step = np.ones(4, dtype=bool)
+    ccount = main.get_cont_counts(df['hyp_cont_tag_gloss'], np.zeros(4, dtype=np.int64),
+                                  step, np.arange(4))
+    assert ccount.tolist() == cont_walk(df.assign(ref_cont_tag_gloss=[[0] * 6]), 'hyp', 'D')
+
+
+def test_short_gloss_raises(main):
+    df = load_sample()
+    df['hyp_cont_tag_gloss'] = [[]] + df['hyp_cont_tag_gloss'].tolist()[1:]
+    with pytest.raises(IndexError):
+        baseline.get_errors(df)
+    with pytest.raises(IndexError):
+        list(main.get_errors(df))
+
+
+def test_main_writes_baseline_rows(tmp_path):
+    shutil.copy(os.path.join(FIXTURES, 'sample.all'), tmp_path)
+    Main(str(tmp_path))
+    df = pd.read_csv(tmp_path / 'sample_errors.csv', dtype=str, keep_default_na=False)
+    assert df.columns.tolist() == TError.get_columns()
+    assert df.to_numpy().tolist() == baseline.get_errors(load_sample())
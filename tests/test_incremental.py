@@ -0,0 +1,99 @@
+import os
+import shutil
+import pandas as pd
+import pytest
+import util
+from get_error_table import Main
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'models')
+
+
+def project(path, fmt):
+    """A project directory with the sample model table in a format."""
+    path.mkdir()
+    if fmt == 'csv':
+        shutil.copy(os.path.join(FIXTURES, 'sample.all'), path)
+    else:
+        df = util.load_file(FIXTURES, 'sample.all', list_columns=Main.COLUMNS)
+        df.to_parquet(path / 'sample.all.parquet')
+    return path
+
+
+def edit(path, fmt, change):
+    """Applies change to the model table of a project, a DataFrame with list columns."""
+    name = util.table_name('sample.all', fmt)
+    df = util.load_file(str(path), name, list_columns=Main.COLUMNS if fmt == 'csv' else None)
+    df = change(df)
+    if fmt == 'csv':
+        df.to_csv(path / name)
+    else:
+        df.to_parquet(path / name)
+
+
+def substitute(df, row=2):
+    """Annotates the first correct word of a row as substituted."""
+    ann = list(df['annotation'].iloc[row])
+    ann[ann.index('C')] = 'S'
+    df['annotation'] = df['annotation'].tolist()[:row] + [ann] + df['annotation'].tolist()[row + 1:]
+    return df
+
+
+def errors(path, fmt):
+    name = util.table_name('sample_errors.csv', fmt)
+    if fmt == 'csv':
+        return pd.read_csv(path / name, dtype=str, keep_default_na=False)
+    return pd.read_parquet(path / name).reset_index()
+
+
+def full(tmp_path, path, fmt):
+    """The error table of a full run over a copy of a project."""
+    copy = tmp_path / ('full_' + path.name)
+    shutil.rmtree(copy, ignore_errors=True)
+    shutil.copytree(path, copy)
+    for file in os.listdir(copy):
+        if 'errors' in file:
+            os.remove(copy / file)
+    Main(str(copy), fmt)
+    return errors(copy, fmt)
+
+
+@pytest.mark.parametrize('fmt', util.FORMATS)
+@pytest.mark.parametrize('chunksize', [3, 10000])
+def test_splice_matches_full_run(tmp_path, capsys, fmt, chunksize):
+    path = project(tmp_path / 'proj', fmt)
+    Main(str(path), fmt, chunksize=chunksize, incremental=True)
+    pd.testing.assert_frame_equal(errors(path, fmt), full(tmp_path, path, fmt))
+    assert 'Extracted 14 of 14 utterances again' in capsys.readouterr().out
+
+    # nothing changed
+    Main(str(path), fmt, chunksize=chunksize, incremental=True)
+    assert 'Extracted 0 of 14 utterances again' in capsys.readouterr().out
+    pd.testing.assert_frame_equal(errors(path, fmt), full(tmp_path, path, fmt))
+
+    edit(path, fmt, substitute)
+    Main(str(path), fmt, chunksize=chunksize, incremental=True)
+    assert 'Extracted 1 of 14 utterances again' in capsys.readouterr().out
+    pd.testing.assert_frame_equal(errors(path, fmt), full(tmp_path, path, fmt))
+
+
+@pytest.mark.parametrize('fmt', util.FORMATS)
+def test_splice_after_rows_removed_and_added(tmp_path, capsys, fmt):
+    path = project(tmp_path / 'proj', fmt)
+    Main(str(path), fmt, chunksize=4, incremental=True)
+    # the last utterance is moved to the front under a new name, two are removed
+    edit(path, fmt, lambda df: pd.concat([df.iloc[-1:].rename(index=lambda ix: '(en_4000_a-9999)'),
+                                          df.iloc[2:-1]]))
+    Main(str(path), fmt, chunksize=4, incremental=True)
+    assert 'Extracted 1 of 12 utterances again' in capsys.readouterr().out
+    pd.testing.assert_frame_equal(errors(path, fmt), full(tmp_path, path, fmt))
+
+
+def test_edited_error_table_is_extracted_again(tmp_path, capsys):
+    path = project(tmp_path / 'proj', 'csv')
+    Main(str(path), incremental=True)
+    with open(path / 'sample_errors.csv', 'a') as f:
+        f.write('en_4000_a-0003#9,S,1,1,,,,,,,,,,\n')
+    capsys.readouterr()
+    Main(str(path), incremental=True)
+    assert 'Extracted 14 of 14 utterances again' in capsys.readouterr().out
+    pd.testing.assert_frame_equal(errors(path, 'csv'), full(tmp_path, path, 'csv'))
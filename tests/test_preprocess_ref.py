@@ -0,0 +1,67 @@
+import argparse
+import os
+import pytest
+import baseline
+import preprocess_ref
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'ref')
+OPTIONS = [(datatype, cont, disf) for datatype in ['SWBD', 'CH']
+           for cont in [False, True] for disf in [False, True]]
+
+
+def make_args(datatype, cont, disf, outdir='', jobs=1, profile_rules=None):
+    args = argparse.Namespace(indir=FIXTURES, outdir=str(outdir), datatype=datatype,
+                              cont=cont, disf=disf, jobs=jobs, profile_rules=profile_rules)
+    preprocess_ref.set_args(args)
+    return args
+
+
+def transcripts(datatype):
+    """The waveform id and line of each transcript line of the fixtures of a datatype."""
+    prefix = preprocess_ref.get_prefix(datatype)
+    for file in sorted(os.listdir(FIXTURES)):
+        if file.startswith(prefix):
+            with open(os.path.join(FIXTURES, file)) as f:
+                for line in f:
+                    if line[:1].isdigit():
+                        yield file[3:7], line
+
+
+def expected_stm(datatype, cont, disf):
+    """The baseline records of the fixtures, sorted as sort -k1,1 -k2,2 -k4,4nb does."""
+    records = list()
+    for waveid, line in transcripts(datatype):
+        l = line.split()
+        waveform = preprocess_ref.get_prefix(datatype) + waveid
+        channel = l[2][:-1]
+        if channel == "B1":
+            channel = "B"
+        result = [waveform, channel, waveform + "_" + channel, float(l[0]), float(l[1]),
+                  baseline.process_str(' '.join(l[3:]), datatype, cont, disf)]
+        records.append((waveform, channel, float(l[0]), "\t".join(str(x) for x in result)))
+    return "".join(r[-1] + "\n" for r in sorted(records))
+
+
+@pytest.mark.parametrize('datatype,cont,disf', OPTIONS)
+def test_process_str_matches_baseline(datatype, cont, disf):
+    make_args(datatype, cont, disf)
+    for waveid, line in transcripts(datatype):
+        sent = ' '.join(line.split()[3:])
+        t = preprocess_ref.Trans(waveid, line, datatype)
+        assert t.transcript == baseline.process_str(sent, datatype, cont, disf), line
+
+
+@pytest.mark.parametrize('datatype,cont,disf', OPTIONS)
+def test_main_matches_baseline(tmp_path, datatype, cont, disf):
+    preprocess_ref.Main(make_args(datatype, cont, disf, tmp_path))
+    with open(os.path.join(tmp_path, datatype + "O.stm")) as f:
+        assert f.read() == expected_stm(datatype, cont, disf)
+
+
+def test_profiled_run_matches_baseline(tmp_path):
+    preprocess_ref.Main(make_args('SWBD', True, True, tmp_path,
+                                  profile_rules=str(tmp_path / 'rules.json')))
+    with open(os.path.join(tmp_path, "SWBDO.stm")) as f:
+        assert f.read() == expected_stm('SWBD', True, True)
+    # the rules are restored after profiling
+    assert preprocess_ref.Trans.TOKEN_RULES[True].__class__.__name__ == 'TokenRules'
@@ -0,0 +1,90 @@
+import argparse
+import os
+import random
+import pytest
+import baseline
+import preprocess_hyp
+import readers
+import token_rules
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'hyp')
+
+# tokens of the reference rules, tokens that contain them, and the tokens
+# the fragments are marked with
+REF_WORDS = sorted({w for pair in token_rules.NORMALIZE for v in pair for w in v.split()}) \
+    + token_rules.HESITATIONS + token_rules.FRAGMENT_HESITATIONS + token_rules.BACKCHANNELS \
+    + ["ooh", "pinto", "Leighton", "inform", "uh-huh-", "hmmm", "the", "{", "/", "@", "}"]
+
+
+def sentences(seed, n=500):
+    rng = random.Random(seed)
+    for _ in range(n):
+        yield " ".join(rng.choice(REF_WORDS) for _ in range(rng.randint(1, 12)))
+
+
+@pytest.mark.parametrize('disf', [False, True])
+def test_ref_rules_match_baseline(disf):
+    rules = token_rules.ref_rules(disf)
+    for sent in sentences(int(disf)):
+        assert rules.sub(sent) == baseline.sub_tokens(sent, disf), sent
+
+
+def test_ref_alternations():
+    rules = token_rules.ref_rules(False)
+    # only the first variant of a pair found in the sentence is rewritten
+    for sent in ["all right alright", "alright all right", "pinto in to into", "every day care"]:
+        assert rules.sub(sent) == baseline.sub_tokens(sent), sent
+
+
+def test_ref_reduced_rules():
+    rules = token_rules.ref_reduced_rules()
+    for sent in ["gonna wanna", "I gonna", "gonnawanna kinda", "wanna-be gonna"]:
+        assert rules.sub(sent) == baseline.normalize_swbd(sent)
+
+
+def test_counts_by_group():
+    counts = dict()
+    _, n = token_rules.ref_rules(True).subn("hmm uh uh- mhm all right", counts)
+    assert n == 5
+    assert counts == {'alternation': 1, 'disfluency': 1, 'hesitation': 2,
+                      'fragment_hesitation': 1, 'backchannel': 1}
+
+
+def run_hyp(tmp_path, disf, window=None, profile=False):
+    outdir = tmp_path / 'out'
+    outdir.mkdir(exist_ok=True)
+    args = argparse.Namespace(indir=FIXTURES, outdir=str(outdir), disf=disf, jobs=1, files=None,
+                              profile_rules=str(tmp_path / 'rules.json') if profile else None)
+    windows = readers.CtmTable.windows.__func__.__defaults__
+    if window:
+        readers.CtmTable.windows.__func__.__defaults__ = (window,)
+    try:
+        preprocess_hyp.Main(args)
+    finally:
+        readers.CtmTable.windows.__func__.__defaults__ = windows
+    with open(outdir / 'sample_processed.ctm') as f:
+        return f.read()
+
+
+def without_times(text):
+    """The fields of each CTM line but the times, which split tokens now take from their own duration."""
+    return [l.split()[:2] + l.split()[4:] for l in text.splitlines()]
+
+
+@pytest.mark.parametrize('disf', [False, True])
+def test_hyp_rules_match_baseline(tmp_path, disf):
+    with open(os.path.join(FIXTURES, 'sample.ctm')) as f:
+        lines = f.readlines()
+    assert without_times(run_hyp(tmp_path, disf)) == without_times(baseline.clean_ctm(lines, disf))
+
+
+@pytest.mark.parametrize('disf', [False, True])
+def test_hyp_stream_matches_mapped(tmp_path, disf):
+    # profiled runs read the file line by line
+    assert run_hyp(tmp_path, disf, profile=True) == run_hyp(tmp_path, disf)
+
+
+@pytest.mark.parametrize('window', [1, 40, 100, 333])
+def test_hyp_windows_match_mapped(tmp_path, window):
+    # windows end between the lines of a split backchannel and of a split token
+    assert run_hyp(tmp_path, True, window=window) == run_hyp(tmp_path, True)